@@ -0,0 +1,168 @@
+"""_summary_
+
+Benchmark the data path of the app on synthetic layers of growing size, see benchmarks/synthetic_layers.py.
+Every size is timed through parsing (df_to_gdf), csv_to_geojson, reprojection to EPSG:4326, the folium
+rendering of page 1 (render_base_layer, render_ntwk_meter_layer) and the size of the final map HTML.
+
+The results are written as JSON to ../output/benchmarks, one file per run labelled with the version under test,
+and --compare prints the change of every timing against an earlier result file to spot regressions.
+Run from the streamlit/src directory:
+`python benchmarks/bench_data_path.py --rows 10000 100000 --label my-branch --compare ../output/benchmarks/bench_main.json`
+
+"""
+import os
+import sys
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+sys.path.append(SCRIPT_DIR)
+import argparse
+import importlib.util
+import json
+import platform
+import subprocess
+import tempfile
+import time as t
+
+import pandas as pd
+import utils.data_processor as proc
+import utils.projection as projection
+import synthetic_layers
+
+BENCH_FOLDER = '../output/benchmarks'
+PAGE_PATH = os.path.join(os.path.dirname(SCRIPT_DIR), 'pages', '1_Visualise_Lower_Hall_B.py')
+DEFAULT_ROWS = [10_000, 100_000, 1_000_000]
+RENDER_MAX_ROWS = 100_000       # folium writes every feature into the page, larger layers are not rendered
+GEOJSON_MAX_ROWS = 1_000_000
+MAINS_LAYER_COLUMNS = ['GISID', 'FMZCODE', 'DMACODE', 'PMACODE', 'MAINNAME', 'geometry', 'layer']
+NTWKM_LAYER_COLUMNS = ['FMZ1CODE', 'FMZ2CODE', 'DMA1CODE', 'DMA2CODE', 'METRICCALCULATED', 'GISID', 'TWGUID',
+                       'LIFECYCLESTATUS', 'NETWORKCODE1', 'NETWORKCODE2', 'METERTYPE', 'SHAPEX', 'SHAPEY', 'geometry']
+LAYERS = {"mains": ("MultiLineString", MAINS_LAYER_COLUMNS),
+          "ntwk_meter": ("Point", NTWKM_LAYER_COLUMNS)}
+
+
+def load_page():
+    """
+    Import the page 1 module for its render functions, None if its dependencies are not installed
+    """
+    try:
+        spec = importlib.util.spec_from_file_location('page_lower_hall', PAGE_PATH)
+        page = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(page)
+        return page
+    except ImportError as e:
+        print(f"Render benchmarks skipped: {e}")
+        return None
+
+
+def timed(results: dict, name: str, func, *args, **kwargs):
+    start = t.perf_counter()
+    value = func(*args, **kwargs)
+    results[name] = round(t.perf_counter() - start, 4)
+    return value
+
+
+def git_version() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=SCRIPT_DIR, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def bench_layer(layer: str, n_rows: int, page=None, folder: str = synthetic_layers.SYNTHETIC_FOLDER) -> dict:
+    """_summary_
+    Time the data path of one synthetic layer
+    Args:
+        layer (str): "mains" or "ntwk_meter"
+        n_rows (int): number of features
+        page (module, optional): page 1 module from load_page, the render steps are skipped without it. Defaults to None.
+        folder (str, optional): folder of the synthetic csv files. Defaults to synthetic_layers.SYNTHETIC_FOLDER.
+
+    Returns:
+        dict: timings in seconds, sizes in bytes
+    """
+    geo_type, layer_columns = LAYERS[layer]
+    result = {"layer": layer, "rows": n_rows}
+    csv_path = timed(result, "generate_s", synthetic_layers.generate_layer, layer, n_rows,
+                     synthetic_layers.synthetic_path(layer, n_rows, folder))
+    result["csv_bytes"] = os.path.getsize(csv_path)
+
+    plain_df = timed(result, "read_csv_s", pd.read_csv, csv_path)
+    gdf = timed(result, "df_to_gdf_s", proc.df_to_gdf, plain_df, geo_type, layer_columns)
+    del plain_df
+    gdf.crs = "EPSG:27700"
+    gdf = timed(result, "reproject_s", projection.project_layer, gdf, "EPSG:4326",
+                layer_version=f"synthetic-{layer}-{n_rows}")
+
+    if n_rows <= GEOJSON_MAX_ROWS:
+        with tempfile.TemporaryDirectory() as tmp_folder:
+            output_path = os.path.join(tmp_folder, f'{layer}.geojson')
+            timed(result, "csv_to_geojson_s", proc.csv_to_geojson, csv_path, output_path, geo_type, layer_columns)
+            result["geojson_bytes"] = os.path.getsize(output_path)
+
+    if page is not None and n_rows <= RENDER_MAX_ROWS:
+        base_map = page.gen_base_layer()
+        if layer == "mains":
+            timed(result, "render_s", page.render_base_layer, base_map, gdf)
+        else:
+            fmz_list = [fmz for fmz in gdf['FMZ1CODE'].unique() if fmz != 'None']
+            fg_layers = timed(result, "render_s", page.render_ntwk_meter_layer, base_map, gdf, fmz_list)
+            for fg in fg_layers.values():
+                base_map.add_child(fg)
+        html = timed(result, "html_s", base_map.get_root().render)
+        result["html_bytes"] = len(html.encode())
+    print(result)
+    return result
+
+
+def compare(results: list[dict], baseline_path: str, threshold: float = 0.1) -> list[dict]:
+    """_summary_
+    Relative change of every timing against an earlier result file, positive is slower
+    Args:
+        results (list[dict]): results of this run
+        baseline_path (str): result file written by an earlier run
+        threshold (float, optional): relative change reported as a regression. Defaults to 0.1.
+
+    Returns:
+        list[dict]: one row per layer, size and timing
+    """
+    with open(baseline_path, 'r') as f:
+        baseline = {(r["layer"], r["rows"]): r for r in json.load(f)["results"]}
+    changes = []
+    for result in results:
+        base = baseline.get((result["layer"], result["rows"]))
+        if base is None:
+            continue
+        for name, value in result.items():
+            if not name.endswith('_s') or name == "generate_s" or not base.get(name):
+                continue
+            change = (value - base[name]) / base[name]
+            changes.append({"layer": result["layer"], "rows": result["rows"], "step": name, "baseline_s": base[name],
+                            "current_s": value, "change": round(change, 3), "regression": change > threshold})
+    return changes
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the data path on synthetic layers")
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS)
+    parser.add_argument('--layer', choices=list(LAYERS), nargs='+', default=list(LAYERS))
+    parser.add_argument('--label', default=None, help="version under test, defaults to the git commit")
+    parser.add_argument('--compare', default=None, help="earlier result file to compare against")
+    parser.add_argument('--no-render', action='store_true')
+    args = parser.parse_args()
+
+    page = None if args.no_render else load_page()
+    results = [bench_layer(layer, n_rows, page) for n_rows in args.rows for layer in args.layer]
+
+    label = args.label or git_version() or 'local'
+    report = {"label": label, "created": t.strftime('%Y-%m-%dT%H:%M:%S'), "python": platform.python_version(),
+              "machine": platform.machine(), "cpus": os.cpu_count(), "results": results}
+    os.makedirs(BENCH_FOLDER, exist_ok=True)
+    output_path = os.path.join(BENCH_FOLDER, f'bench_{label}.json')
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=4)
+    print(f"Results written to {output_path}")
+
+    if args.compare:
+        changes = pd.DataFrame(compare(results, args.compare))
+        print(changes.to_string(index=False) if not changes.empty else "Nothing to compare")
@@ -0,0 +1,67 @@
+"""_summary_
+
+Benchmark the vectorized WKT parser (data_processor.strings_to_geometries) 
+against the per-row string_to_geometry path used by df_to_gdf before it. 
+Run from the streamlit/src directory: `python benchmarks/bench_geometry_parsing.py`
+
+"""
+import os
+import sys
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+import time as t
+
+import numpy as np
+import pandas as pd
+import utils.data_processor as proc
+
+NTWKM_PATH = '../data/ntwk_meter_full.csv'
+
+
+def gen_mains_wkt(n_rows: int, n_parts: int = 1, n_vertices: int = 12, seed: int = 0) -> pd.Series:
+    # synthetic MULTILINESTRINGs in EPSG:27700 around London
+    rng = np.random.default_rng(seed)
+    rows = []
+    for _ in range(n_rows):
+        parts = []
+        for _ in range(n_parts):
+            start = rng.uniform([500000, 150000], [560000, 200000])
+            coords = start + np.cumsum(rng.normal(0, 15, (n_vertices, 2)), axis=0)
+            parts.append('(' + ', '.join(f'{x} {y}' for x, y in coords) + ')')
+        rows.append('MULTILINESTRING (' + ', '.join(parts) + ')')
+    return pd.Series(rows)
+
+
+def time_call(func, repeat: int = 3) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = t.perf_counter()
+        func()
+        best = min(best, t.perf_counter() - start)
+    return best
+
+
+def bench(name: str, wkt: pd.Series, geo_type: str, per_row: bool = True) -> dict:
+    vectorized = time_call(
+        lambda: proc.strings_to_geometries(wkt, geo_type=geo_type))
+    result = {"layer": name, "rows": len(wkt), "vectorized_s": round(vectorized, 4)}
+    # the per-row parser cannot read true multi-part strings, so it is skipped for those
+    if per_row:
+        per_row_s = time_call(lambda: wkt.apply(
+            lambda x: proc.string_to_geometry(x, geo_type=geo_type)))
+        result["per_row_s"] = round(per_row_s, 4)
+        result["speedup"] = round(per_row_s / vectorized, 1)
+    print(result)
+    return result
+
+
+if __name__ == '__main__':
+    results = []
+    if os.path.exists(NTWKM_PATH):
+        ntwkm_df = pd.read_csv(NTWKM_PATH)
+        results.append(bench('ntwk_meter_full', ntwkm_df['geometry'], 'Point'))
+    for n_rows in (1000, 10000):
+        results.append(bench(f'synthetic_mains_{n_rows}',
+                       gen_mains_wkt(n_rows), 'MultiLineString'))
+    results.append(bench('synthetic_multipart_mains_10000', gen_mains_wkt(
+        10000, n_parts=3), 'MultiLineString', per_row=False))
@@ -0,0 +1,233 @@
+"""_summary_
+
+Synthetic GIS workload generator.
+Writes mains (MULTILINESTRING) and network meter (POINT) csv files in EPSG:27700 with the column schema of the
+real GIS extracts, at any size from a few thousand to 10M features, so the data path can be measured beyond
+the 4,400 rows of ntwk_meter_full.csv.
+
+Features are clustered by zone like the real network: every FMZ gets a centre around London, its DMAs and PMAs
+are codes derived from the FMZ code, and the 'None' / 'null' / '<Null>' strings of the extracts are reproduced.
+The output only depends on the number of rows and the seed, and is written in chunks so 10M rows fit in memory.
+Run from the streamlit/src directory:
+`python benchmarks/synthetic_layers.py --layer mains --rows 1000000`
+
+"""
+import os
+import sys
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+import argparse
+import string
+import time as t
+
+import numpy as np
+import pandas as pd
+import shapely
+
+SYNTHETIC_FOLDER = '../data/synthetic'
+CHUNK_ROWS = 100_000
+FEATURES_PER_FMZ = 2_000        # average zone size, the number of FMZs grows with the layer
+LONDON_BOUNDS = (500000, 150000, 560000, 200000)     # min x, min y, max x, max y in EPSG:27700
+
+MAINS_COLUMNS = ["ENABLED", "CREATIONUSER", "DATECREATED", "DATEMODIFIED", "LASTUSER", "GENID", "GISID", "SHORTGISID",
+                 "TWGUID", "OPERATINGPRESSURE", "LIFECYCLESTATUS", "MEASUREDLENGTH", "WATERTRACEWEIGHT",
+                 "METRICCALCULATED", "FMZCODE", "DMACODE", "PMACODE", "NETWORKCODE", "WATERTYPE", "MAINNAME",
+                 "geometry", "layer", "OPERATION", "PRESSURETYPE", "GLOBALID"]
+NTWKM_COLUMNS = ["FMZ1CODE", "FMZ2CODE", "DMA1CODE", "DMA2CODE", "METRICCALCULATED", "GENID", "GISID", "SHORTGISID",
+                 "TWGUID", "LIFECYCLESTATUS", "NETWORKCODE1", "NETWORKCODE2", "METERTYPE", "SHAPEX", "SHAPEY", "geometry"]
+
+LIFECYCLE_STATUS = (["LIVE", "PROP", "DCOM"], [0.973, 0.023, 0.004])
+METER_TYPES = (["VENT", "UNK", "None", "FBM", "WOLT", "ELEC"], [0.52, 0.22, 0.19, 0.04, 0.02, 0.01])
+DIAMETERS_MM = np.array([76.2, 101.6, 152.4, 177.8, 228.6, 304.8, 457.2, 609.6])
+WATER_TYPES = ["POTABLE", "RAW", "NON POTABLE"]
+
+
+def zone_codes(n_fmz: int, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """_summary_
+    Unique six letter FMZ codes and the centre of every zone
+    Args:
+        n_fmz (int): number of FMZs
+        seed (int, optional): _description_. Defaults to 0.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: FMZ codes and (n_fmz, 2) zone centres in EPSG:27700
+    """
+    rng = np.random.default_rng(seed)
+    letters = np.array(list(string.ascii_uppercase))
+    codes = set()
+    while len(codes) < n_fmz:
+        codes.add('Z' + ''.join(rng.choice(letters, 5)))
+    centres = rng.uniform(LONDON_BOUNDS[:2], LONDON_BOUNDS[2:], (n_fmz, 2))
+    return np.array(sorted(codes)), centres
+
+
+def _with_nulls(values: np.ndarray, rng: np.random.Generator, null_share: float, null_value: str = 'None') -> np.ndarray:
+    values = values.astype(object)
+    values[rng.random(len(values)) < null_share] = null_value
+    return values
+
+
+def _zone_columns(n_rows: int, rng: np.random.Generator, codes: np.ndarray, centres: np.ndarray) -> dict:
+    zone = rng.integers(0, len(codes), n_rows)
+    fmz = codes[zone]
+    dma = np.char.add(fmz.astype(str), np.char.zfill(rng.integers(1, 30, n_rows).astype(str), 2))
+    pma = np.char.add(dma, np.array(list(string.ascii_uppercase[:6]))[rng.integers(0, 6, n_rows)])
+    # zone spread of ~1.5 km, a few zones overlap like neighbouring FMZs do
+    xy = centres[zone] + rng.normal(0, 1500, (n_rows, 2))
+    return {"fmz": fmz, "dma": dma, "pma": pma, "xy": xy}
+
+
+def _id_columns(start: int, n_rows: int, rng: np.random.Generator) -> dict:
+    gisid = np.arange(start, start + n_rows) + 1_000_000
+    guid = np.char.add(np.char.zfill(np.char.upper(np.vectorize(np.base_repr)(rng.integers(0, 16 ** 8, n_rows), 16)), 8),
+                       '-9352-11D6-9595-0002A54212B3')
+    return {"GISID": gisid,
+            "SHORTGISID": np.vectorize(np.base_repr)(gisid, 36),
+            "GENID": _with_nulls(rng.integers(10_000_000, 30_000_000, n_rows), rng, 0.24, 'null'),
+            "TWGUID": _with_nulls(guid, rng, 0.24)}
+
+
+def gen_mains_chunk(start: int, n_rows: int, codes: np.ndarray, centres: np.ndarray, seed: int = 0,
+                    n_vertices: int = 8) -> pd.DataFrame:
+    """_summary_
+    One chunk of the synthetic mains layer, rows start to start + n_rows
+    Args:
+        start (int): position of the first row, it seeds the chunk so chunks can be generated in any order
+        n_rows (int): _description_
+        codes (np.ndarray): FMZ codes from zone_codes
+        centres (np.ndarray): zone centres from zone_codes
+        seed (int, optional): _description_. Defaults to 0.
+        n_vertices (int, optional): vertices per main. Defaults to 8.
+
+    Returns:
+        pd.DataFrame: mains rows with the MAINS_COLUMNS schema
+    """
+    rng = np.random.default_rng([seed, start])
+    zones = _zone_columns(n_rows, rng, codes, centres)
+    # random walk of short segments from the start point of every main
+    steps = rng.normal(0, 12, (n_rows, n_vertices, 2))
+    steps[:, 0] = 0
+    coords = zones["xy"][:, None, :] + np.cumsum(steps, axis=1)
+    lines = shapely.linestrings(coords)
+    geometries = shapely.multilinestrings(lines, indices=np.arange(n_rows))
+    dates = pd.Timestamp('2002-06-01') + pd.to_timedelta(rng.integers(0, 7300, n_rows), unit='D')
+
+    chunk = pd.DataFrame({
+        "ENABLED": 1,
+        "CREATIONUSER": rng.choice(["MIGRATION", "GISEDIT", "None"], n_rows, p=[0.7, 0.2, 0.1]),
+        "DATECREATED": dates.strftime('%Y-%m-%d %H:%M:%S'),
+        "DATEMODIFIED": (dates + pd.to_timedelta(rng.integers(0, 2000, n_rows), unit='D')).strftime('%Y-%m-%d %H:%M:%S'),
+        "LASTUSER": rng.choice(["GISEDIT", "None"], n_rows, p=[0.6, 0.4]),
+        **_id_columns(start, n_rows, rng),
+        "OPERATINGPRESSURE": _with_nulls(rng.integers(20, 90, n_rows), rng, 0.3),
+        "LIFECYCLESTATUS": rng.choice(LIFECYCLE_STATUS[0], n_rows, p=LIFECYCLE_STATUS[1]),
+        "MEASUREDLENGTH": np.round(shapely.length(geometries), 2),
+        "WATERTRACEWEIGHT": rng.integers(0, 4, n_rows),
+        "METRICCALCULATED": rng.choice(DIAMETERS_MM, n_rows),
+        "FMZCODE": zones["fmz"],
+        "DMACODE": _with_nulls(zones["dma"], rng, 0.05),
+        "PMACODE": _with_nulls(zones["pma"], rng, 0.4),
+        "NETWORKCODE": zones["dma"],
+        "WATERTYPE": rng.choice(WATER_TYPES, n_rows, p=[0.95, 0.03, 0.02]),
+        "MAINNAME": _with_nulls(np.char.add('MAIN ', zones["dma"]), rng, 0.3),
+        "geometry": shapely.to_wkt(geometries, rounding_precision=3),
+        "layer": "gis_mains",
+        "OPERATION": "None",
+        "PRESSURETYPE": rng.choice(["GRAVITY", "PUMPED"], n_rows, p=[0.8, 0.2]),
+        "GLOBALID": 'None',
+    })
+    return chunk[MAINS_COLUMNS]
+
+
+def gen_ntwk_meter_chunk(start: int, n_rows: int, codes: np.ndarray, centres: np.ndarray, seed: int = 0) -> pd.DataFrame:
+    """_summary_
+    One chunk of the synthetic network meter layer, rows start to start + n_rows
+    Args:
+        start (int): position of the first row
+        n_rows (int): _description_
+        codes (np.ndarray): FMZ codes from zone_codes
+        centres (np.ndarray): zone centres from zone_codes
+        seed (int, optional): _description_. Defaults to 0.
+
+    Returns:
+        pd.DataFrame: meter rows with the schema of ntwk_meter_full.csv
+    """
+    rng = np.random.default_rng([seed, start + 1])
+    zones = _zone_columns(n_rows, rng, codes, centres)
+    xy = np.round(zones["xy"], 4)
+    dma2 = _with_nulls(rng.choice(zones["dma"], n_rows), rng, 0.72)
+    ids = _id_columns(start, n_rows, rng)
+
+    chunk = pd.DataFrame({
+        "FMZ1CODE": _with_nulls(zones["fmz"], rng, 0.14),
+        "FMZ2CODE": _with_nulls(rng.choice(codes, n_rows), rng, 0.94),
+        "DMA1CODE": _with_nulls(_with_nulls(zones["dma"], rng, 0.25), rng, 0.005, '<Null>'),
+        "DMA2CODE": dma2,
+        "METRICCALCULATED": rng.choice(DIAMETERS_MM, n_rows),
+        "GENID": ids["GENID"],
+        "GISID": ids["GISID"],
+        "SHORTGISID": ids["SHORTGISID"],
+        "TWGUID": ids["TWGUID"],
+        "LIFECYCLESTATUS": rng.choice(LIFECYCLE_STATUS[0], n_rows, p=LIFECYCLE_STATUS[1]),
+        "NETWORKCODE1": zones["dma"],
+        "NETWORKCODE2": np.where(dma2 == 'None', zones["fmz"], dma2),
+        "METERTYPE": rng.choice(METER_TYPES[0], n_rows, p=METER_TYPES[1]),
+        "SHAPEX": xy[:, 0],
+        "SHAPEY": xy[:, 1],
+        "geometry": shapely.to_wkt(shapely.points(xy), rounding_precision=4),
+    })
+    return chunk[NTWKM_COLUMNS]
+
+
+LAYER_GENERATORS = {"mains": gen_mains_chunk, "ntwk_meter": gen_ntwk_meter_chunk}
+
+
+def synthetic_path(layer: str, n_rows: int, folder: str = SYNTHETIC_FOLDER) -> str:
+    return os.path.join(folder, f'synthetic_{layer}_{n_rows}.csv')
+
+
+def generate_layer(layer: str, n_rows: int, output_path: str | None = None, seed: int = 0,
+                   chunk_rows: int = CHUNK_ROWS, overwrite: bool = False) -> str:
+    """_summary_
+    Write a synthetic layer to csv, chunk by chunk. An existing file is reused unless overwrite is set
+    Args:
+        layer (str): "mains" or "ntwk_meter"
+        n_rows (int): number of features
+        output_path (str | None, optional): _description_. Defaults to synthetic_path(layer, n_rows).
+        seed (int, optional): _description_. Defaults to 0.
+        chunk_rows (int, optional): rows generated and written at a time. Defaults to CHUNK_ROWS.
+        overwrite (bool, optional): _description_. Defaults to False.
+
+    Returns:
+        str: path of the csv file
+    """
+    output_path = output_path or synthetic_path(layer, n_rows)
+    if os.path.exists(output_path) and not overwrite:
+        return output_path
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+
+    gen_chunk = LAYER_GENERATORS[layer]
+    codes, centres = zone_codes(max(1, n_rows // FEATURES_PER_FMZ), seed)
+    tmp_path = f'{output_path}.{os.getpid()}.tmp'
+    for start in range(0, n_rows, chunk_rows):
+        chunk = gen_chunk(start, min(chunk_rows, n_rows - start), codes, centres, seed)
+        chunk.to_csv(tmp_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    os.replace(tmp_path, output_path)
+    return output_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate synthetic GIS layers in EPSG:27700")
+    parser.add_argument('--layer', choices=list(LAYER_GENERATORS), nargs='+', default=list(LAYER_GENERATORS))
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--folder', default=SYNTHETIC_FOLDER)
+    parser.add_argument('--overwrite', action='store_true')
+    args = parser.parse_args()
+
+    for layer in args.layer:
+        for n_rows in args.rows:
+            start = t.perf_counter()
+            path = generate_layer(layer, n_rows, synthetic_path(layer, n_rows, args.folder),
+                                  seed=args.seed, overwrite=args.overwrite)
+            print(f"{path}: {n_rows} rows, {os.path.getsize(path) / 2**20:.1f} MB in {t.perf_counter() - start:.1f}s")
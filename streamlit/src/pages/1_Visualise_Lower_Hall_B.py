@@ -14,6 +14,17 @@ import streamlit_folium as st_folium
 import utils.config as configutils
 import utils.data_processor as proc
 import utils.databricks as dbutils
+import utils.projection as projection
+import utils.layer_metadata as layer_metadata
+import utils.layer_schema as layer_schema
+import utils.layer_store as layer_store
+import utils.partition as partition
+import utils.boundaries as boundaries
+import utils.map_render as map_render
+import utils.viewport as viewport
+import utils.lod as lod
+import utils.tile_server as tile_server
+import utils.instrumentation as instrumentation
 from folium import Map
 from folium.features import GeoJsonTooltip
 from geopandas import GeoDataFrame
@@ -71,62 +82,27 @@ def map_fmz_colors(feature, meter: bool, fmz: str | None = None):
 
 def get_fmz_regions(base: GeoDataFrame, fmz_names: list[str]):
     # based on the list of FMZs, group the dataset into FMZs
-    # return all the FMZs as their own dataframe
-    fmz_regions = {}
-    unique_fmz_names = base['FMZCODE'].unique()
-    # print(unique_fmz_names)
-    for fmz in unique_fmz_names:
-        fmz_region = base[base['FMZCODE'] == fmz].copy()
-        # fmz_region['polygon']
-        fmz_regions[fmz] = fmz_region
+    # return all the FMZs as their own dataframe, split with the partition index of the layer
+    fmz_regions = partition.partitions(base, 'FMZCODE')
 
     # return the fmz regions
     return fmz_regions
 
 
-def calculate_centroid(gpd: GeoDataFrame):
-    """
-    Calculates the centroid for a dataframe 
-    Purpose is to provide a central location of all the coordinates in a given dataframe object 
-
-    In order to calculate the centroid the geodataframe is projected to a flat surface, and then the centroid is calculated 
-        and then is converted back to the original coordinate system
-    Args:
-        gpd (GeoDataFrame): _description_
-    Returns:
-        GeoDataFrame: _description_
-    """
-    # round tri
-    centroid_df = gpd.to_crs('+proj=cea').centroid.to_crs(gpd.crs)
-    # calculate the centroids of every geometry point
-    # centroid_df = centroid_df.geometry.centroid
-    x_sum = 0
-    y_sum = 0
-    count = 0
-    for c in centroid_df:
-        x_sum += c.x
-        y_sum += c.y
-        count += 1
-
-    avg_centroid = [round(y_sum/count, 4), round(x_sum/count, 4)]
-    # print(f"Avg Centroid: {avg_centroid}")
-
-    return avg_centroid
-
-
-def gen_base_layer(center: list[float] | None = None):
+def gen_base_layer(center: list[float] | None = None, prefer_canvas: bool = False):
     if center:
         # print("location added")
-        m = folium.Map(location=center, tiles="cartodb positron")
+        m = folium.Map(location=center, tiles="cartodb positron", prefer_canvas=prefer_canvas)
     else:
-        m = folium.Map()
+        m = folium.Map(prefer_canvas=prefer_canvas)
     return m
 
 
 def add_layer_to_base(base: Map, gdf: GeoDataFrame, fig: folium.Figure):
     # folium.GeoJson(gdf).add_to(base)
-    gdf.crs = "EPSG:27700"
-    gdf = gdf.to_crs(epsg=4326)
+    if gdf.crs is None:
+        gdf.crs = "EPSG:27700"
+    gdf = projection.project_layer(gdf, "EPSG:4326")
 
     # print(gdf.crs)
     gdf.explore(m=base)
@@ -137,15 +113,15 @@ def add_layer_to_base(base: Map, gdf: GeoDataFrame, fig: folium.Figure):
     return fig, base
 
 
-@st.cache_data()
 def load_lower_hall_local():
     # print("Manual Function for loading the Lower Hall B data")
     csv_path = "../data/lower_hall_b_full.csv"
-    plain_df = pd.read_csv(csv_path)
-    fmz_regions = get_fmz_regions(plain_df, [
-                                  "ZSEWRD", "ZDARNH", "ZUPSHB", "ZHAILY", "ZEXGGT", "ZHAILB", "ZDARNP", "ZHODDN", "ZDARNB"])
-    lower_hall_b_gdf = proc.df_to_gdf(plain_df, layer_columns=[
-                                      'GISID', 'FMZCODE', 'DMACODE', 'PMACODE', 'MAINNAME', 'geometry', 'layer'], geo_type="MultiLineString")
+    # read through the disk cache, the layer is returned already parsed and in EPSG:4326
+    # only the columns of the schema are read, the codes are categoricals
+    # one read-only copy of the layer is shared by every session of the process
+    lower_hall_b_gdf = layer_store.shared_file_layer(csv_path, layer_schema.MAINS_SCHEMA)
+    # centroid, bounds and FMZ extents are computed once per layer version
+    layer_metadata.get_metadata(lower_hall_b_gdf)
     return lower_hall_b_gdf
 
 
@@ -161,10 +137,10 @@ def load_network_layer_local(fmz_list):
         _type_: _description_
     """
     csv_path = "../data/ntwk_meter_full.csv"
-    plain_df = pd.read_csv(csv_path)
-    filtered = plain_df[plain_df['FMZ1CODE'].isin(fmz_list)]
-    ntwkm_gdf = proc.df_to_gdf(filtered, layer_columns=['FMZ1CODE', 'FMZ2CODE', 'DMA1CODE', 'DMA2CODE', 'METRICCALCULATED',
-                                                        'GISID', 'TWGUID', 'LIFECYCLESTATUS', 'NETWORKCODE1', 'NETWORKCODE2', 'METERTYPE', 'SHAPEX', 'SHAPEY', 'geometry'], geo_type="Point")
+    ntwkm_gdf = layer_store.shared_file_layer(csv_path, layer_schema.NTWK_METER_SCHEMA)
+    # the selection gets a layer version of its own
+    ntwkm_gdf = partition.select(ntwkm_gdf, 'FMZ1CODE', fmz_list)
+    layer_metadata.get_metadata(ntwkm_gdf)
 
     return ntwkm_gdf
 
@@ -178,17 +154,21 @@ def load_data():
     return ne_london_data
 
 
-def render_base_layer(base_map: Map, lower_hall_gdf: GeoDataFrame) -> Map:
+def render_base_layer(base_map: Map, lower_hall_gdf: GeoDataFrame, fit_bounds: bool = True, layer_meta: dict | None = None) -> Map:
     """
     _summary_
     Create the Mains Pipe Layer
+    fit_bounds is turned off in viewport mode, so the map keeps the view of the user
+    layer_meta is the metadata of the full mains layer when a simplified or culled copy is rendered
 
     """
     # update the center location and the boundaries of the base map
-    center_loc = calculate_centroid(lower_hall_gdf)
-    bounds = lower_hall_gdf.total_bounds
+    layer_meta = layer_meta or layer_metadata.get_metadata(lower_hall_gdf)
+    center_loc = layer_meta['centroid']
+    bounds = layer_meta['bounds']
     update_center_location(center=center_loc)
-    base_map.fit_bounds([[bounds[1], bounds[0]], [bounds[3], bounds[2]]])
+    if fit_bounds:
+        base_map.fit_bounds([[bounds[1], bounds[0]], [bounds[3], bounds[2]]])
 
     # to dynamically add or remove items(e.g. layer) from a map, add them as a feature group and then pass it to st_folium
     lower_hall_fg = folium.FeatureGroup(name="Lower Hall B")
@@ -205,66 +185,113 @@ def render_base_layer(base_map: Map, lower_hall_gdf: GeoDataFrame) -> Map:
     return base_map
 
 
-def render_fmz_layer(base_map: Map, lower_hall_gdf: GeoDataFrame, fmz_list: list[str] | None = None) -> Map:
+@st.cache_resource()
+def get_tile_server():
+    # one local tile service per streamlit process, shared by every session
+    return tile_server.start_tile_server()
+
+
+def render_tile_layers(base_map: Map, lower_hall_gdf: GeoDataFrame, ntwkm_gdf: GeoDataFrame, fmz_list: list[str]) -> Map:
+    """_summary_
+    Add the mains and the selected network meters as vector tile layers served by the local tile service,
+    nothing but the tile urls is written into the page
+    Args:
+        base_map (Map): _description_
+        lower_hall_gdf (GeoDataFrame): the mains layer
+        ntwkm_gdf (GeoDataFrame): the network meter layer
+        fmz_list (list[str]): selected FMZs
+
+    Returns:
+        Map: _description_
+    """
+    get_tile_server()
+    bounds = layer_metadata.get_metadata(lower_hall_gdf)['bounds']
+    base_map.fit_bounds([[bounds[1], bounds[0]], [bounds[3], bounds[2]]])
+
+    mains_fields = ['MAINNAME', 'GISID', 'FMZCODE', 'DMACODE']
+    tile_server.register_layer('mains', lower_hall_gdf, properties=mains_fields)
+    map_render.VectorTileLayer(tile_server.tile_url('mains'), 'mains',
+                               style={"color": '#FF0035', "weight": 3, "opacity": 0.9},
+                               popup_fields=mains_fields, name="Lower Hall B Mains Layer").add_to(base_map)
+
+    meter_fields = ['NETWORKCODE1', 'LIFECYCLESTATUS', 'METRICCALCULATED']
+    for fmz, fmz_gdf in partition.partitions(ntwkm_gdf, 'FMZ1CODE', fmz_list).items():
+        layer_name = f'meters-{fmz}'
+        tile_server.register_layer(layer_name, fmz_gdf, properties=meter_fields)
+        css_color = map_render.MARKER_CSS_COLORS[map_fmz_colors(feature=None, meter=True, fmz=fmz)]
+        map_render.VectorTileLayer(tile_server.tile_url(layer_name), layer_name,
+                                   style={"radius": 5, "fill": True, "fillColor": css_color, "fillOpacity": 0.8,
+                                          "color": css_color, "weight": 1},
+                                   popup_fields=meter_fields, name=f"{fmz} Network Meter Points").add_to(base_map)
+    return base_map
+
+
+def render_fmz_layer(base_map: Map, lower_hall_gdf: GeoDataFrame, fmz_list: list[str] | None = None,
+                     method: str = "concave") -> Map:
     """_summary_
     This function is used to render the fmz tiles layer
+    The FMZ boundaries are built once per version of the mains layer, see utils.boundaries
     Args:
         base_map (Map): _description_
         lower_hall_gdf (GeoDataFrame): _description_
+        fmz_list (list[str] | None, optional): FMZs to outline. Defaults to every FMZ with a color.
+        method (str, optional): "concave" or "convex" boundaries. Defaults to "concave".
 
     Returns:
         Map: _description_
     """
-    fmz_list = ["ZSEWRD", "ZDARNH", "ZUPSHB", "ZHAILY",
-                "ZEXGGT", "ZHAILB", "ZDARNP", "ZHODDN", "ZDARNB"]
+    fmz_list = fmz_list or ["ZSEWRD", "ZDARNH", "ZUPSHB", "ZHAILY",
+                            "ZEXGGT", "ZHAILB", "ZDARNP", "ZHODDN", "ZDARNB"]
     # initialize the feature group for the FMZ layers
     fmz_fg = folium.FeatureGroup(name="FMZ Layer")
+    fmz_boundaries = boundaries.get_boundaries(lower_hall_gdf, level="FMZ", method=method)
+    fmz_boundaries = fmz_boundaries[fmz_boundaries['FMZCODE'].isin(fmz_list)]
 
-    for fmz in fmz_list:
-        fmz_df = lower_hall_gdf[lower_hall_gdf['FMZCODE'] == fmz]
-        # extract multiline string geometries
-        fmz_geometries = fmz_df['geometry'].values
-        # combine the MultiLineString into a single LineString
-        combined_line = unary_union(fmz_geometries)
-        polygon = Polygon(combined_line.convex_hull)
-        # create geodataframe for ploygon
-        polygon_gdf = gpd.GeoDataFrame(geometry=[polygon])
-        polygon_gdf.crs = "EPSG:4326"
-        polygon_gdf = polygon_gdf.to_crs(epsg=4326)
-        polygon_gdf['FMZCODE'] = fmz
-
-        folium.GeoJson(polygon_gdf, style_function=lambda x: {
-            "fillColor": map_fmz_colors(x, False),
-            "color": '#01295F',
-            "weight": 2,
-            "fillOpacity": 0.7
-        }, name=fmz,
-            tooltip=GeoJsonTooltip(fields=["FMZCODE"], aliases=["FMZ Code"], labels=True, sticky=False)).add_to(fmz_fg)
+    folium.GeoJson(fmz_boundaries, style_function=lambda x: {
+        "fillColor": map_fmz_colors(x, False),
+        "color": '#01295F',
+        "weight": 2,
+        "fillOpacity": 0.7
+    }, name="FMZ Boundaries",
+        tooltip=GeoJsonTooltip(fields=["FMZCODE", "count"], aliases=["FMZ Code", "Mains"], labels=True, sticky=False)).add_to(fmz_fg)
 
     base_map.add_child(fmz_fg)
     return base_map
 
 
-def render_ntwk_meter_layer(base_map: Map, ntwkm_gdf: GeoDataFrame, fmz_list: list[str] | None = None) -> folium.FeatureGroup:
+def render_ntwk_meter_layer(base_map: Map, ntwkm_gdf: GeoDataFrame, fmz_list: list[str] | None = None,
+                            render_mode: str = 'auto', fast_threshold: int = map_render.FAST_MARKER_THRESHOLD) -> folium.FeatureGroup:
     """_summary_
 
     Args:
         base_map (Map): _description_
         ntwkm_gdf (GeoDataFrame): _description_
         fmz_list (list[str] | None, optional): _description_. Defaults to None.
+        render_mode (str, optional): 'exact' markers, 'cluster' or 'canvas' fast modes, 'auto' switches to
+            clustering above fast_threshold points. Defaults to 'auto'.
+        fast_threshold (int, optional): number of selected meters above which 'auto' uses a fast mode.
 
     Returns:
         folium.FeatureGroup: _description_
     """
     fg_layers = {}
+    # the rows of every FMZ come from the partition index of the layer, the FMZ column is not scanned per FMZ
+    fmz_gdfs = partition.partitions(ntwkm_gdf, 'FMZ1CODE', fmz_list)
+    render_mode = map_render.resolve_render_mode(render_mode, sum(len(fmz_gdf) for fmz_gdf in fmz_gdfs.values()), fast_threshold)
 
     for fmz in fmz_list:
         # print(f"Current FMZ: {fmz}")
         fg_layers[fmz] = folium.FeatureGroup(
             name=f"{fmz} Network Meter Points")
-        fmz_gdf = ntwkm_gdf[ntwkm_gdf['FMZ1CODE'] == fmz]
+        fmz_gdf = fmz_gdfs[fmz]
         hex_color = map_fmz_colors(feature=fmz_gdf, meter=True, fmz=fmz)
         # print(f"Hex Color: {hex_color}")
+        if render_mode == 'cluster':
+            map_render.build_meter_cluster(fmz_gdf, hex_color).add_to(fg_layers[fmz])
+            continue
+        if render_mode == 'canvas':
+            map_render.build_meter_canvas(fmz_gdf, hex_color).add_to(fg_layers[fmz])
+            continue
         for index, row in fmz_gdf.iterrows():
             lat, lon = row['geometry'].y, row['geometry'].x
             meter_marker = folium.Marker(
@@ -275,65 +302,10 @@ def render_ntwk_meter_layer(base_map: Map, ntwkm_gdf: GeoDataFrame, fmz_list: li
             fg_layers[fmz].add_child(meter_marker)
     return fg_layers
 
-# @st.cache_data()
-
-
-def request_gis_layer(work_path: str, cluster: int, job_params: Any, f_name: str | None = None) -> pd.DataFrame:
-    # # print("Use this function to asynchronously request the data from Databricks")
-    # request the data from the databricks api then write the response to the application
-    run_id = dbutils.get_one_time_run(db_connection=st.session_state['databricks_connection'],
-                                      cluster_id=cluster,
-                                      run_name="Get Lower Hall B Layer", timeout_seconds=3600,
-                                      workspace_path=work_path, notebook_params=job_params,
-                                      git=False)['run_id']
-    # while the response status is still false then send another request to the run id
-    # print(f"Run ID: {run_id}")
-    status = ""
-    response = None
-    # max_retries = 5
-    # count = 0
-    while status != "SUCCESS":
-        # make a request to the server and get the output of the last run job
-        run_response = dbutils.get_job_output(
-            db_connection=st.session_state['databricks_connection'], run_id=run_id)
-        configutils.save_json_data(
-            data=run_response, file_name=f_name)
-        state = run_response["metadata"]["state"]["life_cycle_state"]
-        if state == "TERMINATED":
-            status = run_response["metadata"]["state"]["result_state"]
-            if status == "SUCCESS":
-                response = run_response
-        # add a delay to allow the notebook to complete it's run
-        t.sleep(8)
-
-    output_str = response["notebook_output"]["result"]
-    # print(f"Output: \n{output_str}")
-    # convert the output string to a dictionary
-    output_dict = proc.string_to_dict(output_str)
-    output_df = pd.DataFrame(output_dict)
-
-    return output_df
-
-
-@st.cache_data()
-def request_ntwk_meter_data(selected_fmz: list[str] | None = None):
-    nb_name = 'GISNTWM_Notebook_001'
-    nb_path = os.environ.get('AZ_DB_NOTEBOOK_PATH') + nb_name
-    param_str = ','.join(selected_fmz)
-    # # print(f"Param String: {param_str}")
-    ntwk_meter_df = request_gis_layer(work_path=nb_path, cluster=os.environ.get(
-        'AZ_DB_CLUSTER_ID'), job_params={"FMZCode": param_str}, f_name="ntwkm_run_output.json")
-    st.session_state['ntwk_meter_df'] = ntwk_meter_df
-    return ntwk_meter_df
-
-
-@st.cache_data()
-def get_ntwk_session(fmz_list):
-    st.session_state['ntwk_meter_df'] = request_ntwk_meter_data(
-        selected_fmz=fmz_list)
-
 
 def main():
+    show_timings, trace_memory = instrumentation.instrumentation_controls()
+    instrumentation.start_rerun(trace_memory)
     st.markdown(
         """
         <link href="https://rsms.me/inter/inter.css" rel='stylesheet'>
@@ -363,19 +335,28 @@ def main():
     # Load the dataframes
     # gen the data
     lower_hall_gdf = load_lower_hall_local()
-    # normalise the crs for our map
-    lower_hall_gdf.crs = "EPSG:27700"
-    lower_hall_gdf = lower_hall_gdf.to_crs(epsg=4326)
+    render_mode, fast_threshold = map_render.meter_render_controls()
+    tiles_mode = map_render.vector_tile_controls()
+    # culling and level of detail are done by the tile service in vector tile mode
+    viewport_mode = viewport.viewport_controls() and not tiles_mode
+    lod_mode = lod.lod_controls() and not tiles_mode
+    show_fmz_boundaries, boundary_method = boundaries.boundary_controls()
+    # the map reports its view back when the layers depend on it, only its zoom when the layers depend on nothing else
+    track_view = viewport_mode or lod_mode
+    zoom_only = lod_mode and not viewport_mode
     # # initialise the base map
-    base_map = gen_base_layer()
+    base_map = gen_base_layer(prefer_canvas=render_mode == 'canvas')
     # st.write(f"{type(st.session_state['ntwk_meter_df'])}")
     # add the fmz regions layer
     fmz_list = ["ZSEWRD", "ZDARNH", "ZUPSHB", "ZHAILY",
                 "ZEXGGT", "ZHAILB", "ZDARNP", "ZHODDN", "ZDARNB"]
-    # Add the awkward looking fmz regions to the basemap
-    # base_map = render_fmz_layer(base_map=base_map, lower_hall_gdf=lower_hall_gdf, fmz_list=fmz_list)
+    # Add the fmz boundaries to the basemap, they are built once per version of the mains layer
+    if show_fmz_boundaries:
+        base_map = render_fmz_layer(base_map=base_map, lower_hall_gdf=lower_hall_gdf, fmz_list=fmz_list,
+                                    method=boundary_method)
     # add the mains layer
-    center_loc = calculate_centroid(lower_hall_gdf)
+    lower_hall_meta = layer_metadata.get_metadata(lower_hall_gdf)
+    center_loc = lower_hall_meta['centroid']
     # # print(f"Center location: {center_loc}")
     st.session_state['center_loc'] = center_loc
     # add the network meter layer
@@ -414,28 +395,57 @@ def main():
         </p> """,
                 unsafe_allow_html=True,)
     ntwkm_gdf = load_network_layer_local(fmz_list=fmz_list)
-    ntwkm_gdf.crs = "EPSG:27700"
-    ntwkm_gdf = ntwkm_gdf.to_crs(epsg=4326)
 
     # Add markers to a Feature Group
     st.session_state['selected_fmzs'] = st.multiselect(
         'Select FMZ Codes', fmz_list)
     st.write(f"Selected FMZ Codes: {st.session_state['selected_fmzs']}")
 
-    # second_map = gen_base_layer()
-    base_map = render_base_layer(base_map=base_map, lower_hall_gdf=lower_hall_gdf)
-    # ntwk_fg = render_ntwk_meter_layer(base_map=second_map, ntwkm_gdf=ntwkm_gdf, fmz_list=st.session_state['selected_fmzs'])
-    ntwk_fg_layers = render_ntwk_meter_layer(
-        base_map=base_map, ntwkm_gdf=ntwkm_gdf, fmz_list=st.session_state['selected_fmzs'])
-
-    for key, value in ntwk_fg_layers.items():
-        base_map.add_child(value) # 
+    view_bounds = st.session_state.get('viewport_bounds') if viewport_mode else None
+    reported_zoom = st.session_state.get('viewport_zoom') if track_view else None
+    if lod_mode:
+        # pick the simplified mains that match the zoom, the opening zoom is the one that fits the whole layer
+        map_zoom_level = reported_zoom
+        if map_zoom_level is None:
+            map_zoom_level = lod.fit_zoom(lower_hall_meta['bounds'], width=950, height=720)
+        lower_hall_gdf = lod.select_lod(lower_hall_gdf, map_zoom_level)
+    if viewport_mode:
+        # only serialise the features inside the last known view of the map
+        lower_hall_gdf = viewport.cull_to_viewport(lower_hall_gdf, view_bounds)
+        ntwkm_gdf = viewport.cull_to_viewport(ntwkm_gdf, view_bounds)
+
+    with instrumentation.stage("folium_build"):
+        if tiles_mode:
+            base_map = render_tile_layers(base_map=base_map, lower_hall_gdf=lower_hall_gdf, ntwkm_gdf=ntwkm_gdf,
+                                          fmz_list=st.session_state['selected_fmzs'])
+        else:
+            # second_map = gen_base_layer()
+            base_map = render_base_layer(base_map=base_map, lower_hall_gdf=lower_hall_gdf, fit_bounds=reported_zoom is None,
+                                         layer_meta=lower_hall_meta)
+            # ntwk_fg = render_ntwk_meter_layer(base_map=second_map, ntwkm_gdf=ntwkm_gdf, fmz_list=st.session_state['selected_fmzs'])
+            ntwk_fg_layers = render_ntwk_meter_layer(
+                base_map=base_map, ntwkm_gdf=ntwkm_gdf, fmz_list=st.session_state['selected_fmzs'],
+                render_mode=render_mode, fast_threshold=fast_threshold)
+
+            for key, value in ntwk_fg_layers.items():
+                base_map.add_child(value) # 
         
     # center_loc = calculate_centroid(ntwkm_gdf)
     # render the map
     folium.LayerControl().add_to(base_map)
-    st_data_two = st_folium.st_folium(
-        base_map, center=center_loc, zoom=10, width=950, height=720, returned_objects=[])
+    map_center, map_zoom, returned_objects = viewport.map_view(center_loc, 10, track_view, zoom_only=zoom_only)
+    # serializes the whole map to HTML and sends it to the browser
+    with instrumentation.stage("html_serialize"):
+        st_data_two = st_folium.st_folium(
+            base_map, center=map_center, zoom=map_zoom, width=950, height=720, returned_objects=returned_objects)
+    instrumentation.end_rerun("lower_hall")
+    if show_timings:
+        instrumentation.render_stage_panel()
+        layer_store.render_memory_panel({"Lower Hall B mains": load_lower_hall_local(),
+                                         "Network meters": ntwkm_gdf})
+        layer_store.render_store_panel()
+    if track_view and viewport.update_viewport(st_data_two, rerun_on_pan=viewport_mode, zoom_only=zoom_only):
+        st.experimental_rerun()
     if st.button("Save the Network Meters HTML"):
         # save the map to a file
         base_map.save('../output/NetworkMeter_Base.html')
@@ -445,7 +455,7 @@ def main():
 
 if __name__ == "__main__":
     app_setup_on_load()
-    # init_db_connection()
+    init_db_connection()  # shared pooled connection, cheap to call on every page load
     init_state()
     # asyncio.run(main())
     main()
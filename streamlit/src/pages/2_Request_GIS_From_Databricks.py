@@ -17,6 +17,21 @@ import streamlit_folium as st_folium
 import utils.config as configutils
 import utils.data_processor as proc
 import utils.databricks as dbutils
+import utils.run_poller as run_poller
+import utils.instrumentation as instrumentation
+import utils.run_cache as run_cache
+import utils.run_journal as run_journal
+import utils.fmz_fanout as fmz_fanout
+import utils.delta_sync as delta_sync
+import utils.dbfs_reader as dbfs_reader
+import utils.projection as projection
+import utils.layer_metadata as layer_metadata
+import utils.layer_schema as layer_schema
+import utils.layer_store as layer_store
+import utils.partition as partition
+import utils.map_render as map_render
+import utils.viewport as viewport
+import shapely
 from folium import Map
 from folium.features import GeoJsonTooltip
 from geopandas import GeoDataFrame
@@ -30,34 +45,6 @@ init_db_connection()
 # init_state()
 
 
-def calculate_centroid(gpd: GeoDataFrame):
-    """
-    Calculates the centroid for a dataframe 
-    Purpose is to provide a central location of all the coordinates in a given dataframe object 
-
-    In order to calculate the centroid the geodataframe is projected to a flat surface, and then the centroid is calculated 
-        and then is converted back to the original coordinate system
-    Args:
-        gpd (GeoDataFrame): _description_
-    Returns:
-        GeoDataFrame: _description_
-    """
-    centroid_df = gpd.to_crs('+proj=cea').centroid.to_crs(gpd.crs)
-    # calculate the centroids of every geometry point
-    x_sum = 0
-    y_sum = 0
-    count = 0
-    for c in centroid_df:
-        x_sum += c.x
-        y_sum += c.y
-        count += 1
-
-    avg_centroid = [round(y_sum/count, 4), round(x_sum/count, 4)]
-    # print(f"Avg Centroid: {avg_centroid}")
-
-    return avg_centroid
-
-
 def map_fmz_colors(feature, meter: bool, fmz: str | None = None):
 
     if meter:
@@ -89,64 +76,88 @@ def map_fmz_colors(feature, meter: bool, fmz: str | None = None):
         return color_map[str(fmz_value)]
 
 
-def request_gis_layer(work_path: str, cluster: int, job_params: Any, run_name: str, f_name: str | None = None) -> pd.DataFrame:
-    # # print("Use this function to asynchronously request the data from Databricks")
-    # request the data from the databricks api then write the response to the application
-    run_id = dbutils.get_one_time_run(db_connection=st.session_state['databricks_connection'],
-                                      cluster_id=cluster,
-                                      run_name=run_name, timeout_seconds=3600,
-                                      workspace_path=work_path, notebook_params=job_params,
-                                      git=False)['run_id']
-    # while the response status is still false then send another request to the run id
-    # print(f"Run ID: {run_id}")
-    status = ""
-    response = None
-    # max_retries = 5
-    # count = 0
-    while status != "SUCCESS":
-        # make a request to the server and get the output of the last run job
-        run_response = dbutils.get_job_output(
-            db_connection=st.session_state['databricks_connection'], run_id=run_id)
-        # use this function to check if the data is received
-        configutils.save_json_data(
-            data=run_response, file_name=f_name)
-        state = run_response["metadata"]["state"]["life_cycle_state"]
-        if state == "TERMINATED":
-            status = run_response["metadata"]["state"]["result_state"]
-            if status == "SUCCESS":
-                response = run_response
-        # add a delay to allow the notebook to complete it's run
-        t.sleep(8)
-
-    output_str = response["notebook_output"]["result"]
-    # print(f"Output: \n{output_str}")
-    # convert the output string to a dictionary
-    output_dict = proc.string_to_dict(output_str)
-    output_df = pd.DataFrame(output_dict)
-
-    return output_df
-
-
-def render_ntwk_meter_layer(base_map: Map, ntwkm_gdf: GeoDataFrame, fmz_list: list[str] | None = None) -> folium.FeatureGroup:
+def request_gis_layer(work_path: str, cluster: int, job_params: Any, run_name: str) -> run_poller.TrackedRun:
+    """_summary_
+    Submit the notebook run and return straight away, the shared background poller tracks the run
+    and fetches its output once it terminates. The output is decoded once, in the completion callback,
+    into run.result, which is both cached and picked up by the page. Use show_run_status on every rerun to follow it.
+    The state changes and the final response are written to the run journal.
+    Args:
+        work_path (str): _description_
+        cluster (int): _description_
+        job_params (Any): _description_
+        run_name (str): _description_
+
+    Returns:
+        run_poller.TrackedRun: the tracked run
+    """
+    poller = run_poller.get_run_poller(st.session_state['databricks_connection'])
+
+    def decode_output(run: run_poller.TrackedRun):
+        if run.succeeded:
+            run.result = proc.run_output_to_df(run.output)
+            # later requests for the same notebook and parameters are served from the run cache
+            run_cache.put_result(run_cache.cache_key(work_path, job_params), run.result,
+                                 notebook_path=work_path, params=job_params, run_id=run.run_id)
+
+    return poller.submit(run_name=run_name, cluster_id=cluster, workspace_path=work_path,
+                         notebook_params=job_params, timeout_seconds=3600, on_done=decode_output)
+
+
+def show_run_status(run_id: int | None) -> run_poller.TrackedRun | None:
+    """
+    Display the live status of a tracked run, returns the run so the caller can pick up its output
+    """
+    if run_id is None:
+        return None
+    run = run_poller.get_run_poller(st.session_state['databricks_connection']).status(run_id)
+    if run is None:
+        st.warning(f"Run {run_id} is no longer tracked, request the data again")
+        return None
+    if not run.done:
+        st.info(f"Run {run_id} ({run.name}): {run.life_cycle_state}, {run.elapsed:.0f}s elapsed")
+    elif run.succeeded and run.error is not None:
+        st.error(f"Run {run_id} finished but its output could not be read: {run.error}")
+    elif run.succeeded:
+        st.success(f"Run {run_id} finished in {run.elapsed:.0f}s")
+    else:
+        st.error(f"Run {run_id} {run.result_state}: {run.error}")
+    return run
+
+
+def render_ntwk_meter_layer(base_map: Map, ntwkm_gdf: GeoDataFrame, fmz_list: list[str] | None = None,
+                            render_mode: str = 'auto', fast_threshold: int = map_render.FAST_MARKER_THRESHOLD) -> folium.FeatureGroup:
     """_summary_
 
     Args:
         base_map (Map): _description_
         ntwkm_gdf (GeoDataFrame): _description_
         fmz_list (list[str] | None, optional): _description_. Defaults to None.
+        render_mode (str, optional): 'exact' markers, 'cluster' or 'canvas' fast modes, 'auto' switches to
+            clustering above fast_threshold points. Defaults to 'auto'.
+        fast_threshold (int, optional): number of selected meters above which 'auto' uses a fast mode.
 
     Returns:
         folium.FeatureGroup: _description_
     """
     fg_layers = {}
+    # the rows of every FMZ come from the partition index of the layer, the FMZ column is not scanned per FMZ
+    fmz_gdfs = partition.partitions(ntwkm_gdf, 'FMZ1CODE', fmz_list)
+    render_mode = map_render.resolve_render_mode(render_mode, sum(len(fmz_gdf) for fmz_gdf in fmz_gdfs.values()), fast_threshold)
 
     for fmz in fmz_list:
         # print(f"Current FMZ: {fmz}")
         fg_layers[fmz] = folium.FeatureGroup(
             name=f"{fmz} Network Meter Points")
-        fmz_gdf = ntwkm_gdf[ntwkm_gdf['FMZ1CODE'] == fmz]
+        fmz_gdf = fmz_gdfs[fmz]
         hex_color = map_fmz_colors(feature=fmz_gdf, meter=True, fmz=fmz)
         # print(f"Hex Color: {hex_color}")
+        if render_mode == 'cluster':
+            map_render.build_meter_cluster(fmz_gdf, hex_color).add_to(fg_layers[fmz])
+            continue
+        if render_mode == 'canvas':
+            map_render.build_meter_canvas(fmz_gdf, hex_color).add_to(fg_layers[fmz])
+            continue
         for index, row in fmz_gdf.iterrows():
             lat, lon = row['geometry'].y, row['geometry'].x
             meter_marker = folium.Marker(
@@ -158,61 +169,194 @@ def render_ntwk_meter_layer(base_map: Map, ntwkm_gdf: GeoDataFrame, fmz_list: li
     return fg_layers
 
 
-def gen_base_layer(center: list[float] | None = None):
+def project_ntwk_meter_df(ntwk_meter_df: pd.DataFrame) -> GeoDataFrame:
+    """_summary_
+    Convert the requested Network Meter dataframe into a layer in EPSG:4326.
+    The projected layer is cached per version of the dataframe, so reruns with the same data do not reproject it
+    Args:
+        ntwk_meter_df (pd.DataFrame): the Network Meter data returned by Databricks
+
+    Returns:
+        GeoDataFrame: the projected Network Meter layer
+    """
+    layer_columns = ['FMZ1CODE', 'FMZ2CODE', 'DMA1CODE', 'DMA2CODE', 'METRICCALCULATED',
+                     'GISID', 'TWGUID', 'LIFECYCLESTATUS', 'NETWORKCODE1', 'NETWORKCODE2', 'METERTYPE', 'SHAPEX', 'SHAPEY', 'geometry']
+    # the version is computed once when the data is shared, see share_ntwk_meter_df
+    version = ntwk_meter_df.attrs.get('layer_version') or projection.frame_version(ntwk_meter_df)
+    # the point coordinates are transformed directly from the SHAPEX/SHAPEY arrays
+    ntwkm_gdf = projection.points_from_xy(ntwk_meter_df, layer_columns=layer_columns, layer_version=version)
+    if ntwkm_gdf is None:
+        # convert from df -> gdf through the WKT geometry column
+        ntwkm_gdf = proc.df_to_gdf(ntwk_meter_df, layer_columns=layer_columns, geo_type="Point")
+        ntwkm_gdf.crs = "EPSG:27700"
+        ntwkm_gdf = projection.project_layer(ntwkm_gdf, "EPSG:4326", layer_version=version)
+    # centroid, bounds and FMZ extents are computed once per version of the fetched data
+    layer_metadata.get_metadata(ntwkm_gdf)
+    return ntwkm_gdf
+
+
+def gen_base_layer(center: list[float] | None = None, prefer_canvas: bool = False):
     if center:
         # print("location added")
-        m = folium.Map(location=center, tiles="cartodb positron")
+        m = folium.Map(location=center, tiles="cartodb positron", prefer_canvas=prefer_canvas)
     else:
-        m = folium.Map()
+        m = folium.Map(prefer_canvas=prefer_canvas)
     return m
 
-@st.cache_data()
-def request_ntwk_meter_data(selected_fmz: list[str] | None = None):
+NTWK_METER_SLOT = 'ntwk_meter'
+
+
+def share_ntwk_meter_df(ntwk_meter_df: pd.DataFrame):
+    """
+    Keep the fetched Network Meter data once in the shared layer store, the session only binds its slot to it.
+    Sessions fetching the same data share a single read-only copy, the key and the layer version follow every column
+    so an update of the attributes alone is shared as a new layer
+    """
+    store = layer_store.get_layer_store()
+    version = projection.frame_version(ntwk_meter_df)
+    ntwk_meter_df.attrs['layer_version'] = version
+    key = f"ntwk_meter-{version}"
+    store.put(key, ntwk_meter_df)
+    store.bind(NTWK_METER_SLOT, key)
+
+
+def get_ntwk_meter_df() -> pd.DataFrame | None:
+    """
+    Read-only view of the Network Meter data of the session, or None before it is fetched
+    """
+    return layer_store.get_layer_store().view(NTWK_METER_SLOT)
+
+
+def request_ntwk_meter_data(selected_fmz: list[str] | None = None) -> int | None:
     """_summary_
-    Call the Network Meter Layers Notebook
+    Call the Network Meter Layers Notebook, the run is tracked in the background.
+    A cached result of the same request is put in the session straight away without submitting a run
     Args:
         selected_fmz (list[str] | None, optional): _description_. Defaults to None.
 
     Returns:
-        _type_: _description_
+        int | None: the run id, also stored in st.session_state['ntwk_meter_run_id'], None for a cache hit
     """
     nb_name = 'GISNTWM_Notebook_001'
     nb_path = os.environ.get('AZ_DB_NOTEBOOK_PATH') + nb_name
-    print(nb_path, "\n", nb_name)
     param_str = ','.join(selected_fmz)
+    cached_df = run_cache.get_result(run_cache.cache_key(nb_path, {"FMZCode": param_str}))
+    if cached_df is not None:
+        share_ntwk_meter_df(cached_df)
+        st.session_state['ntwk_meter_run_id'] = None
+        return None
     # # print(f"Param String: {param_str}")
-    ntwk_meter_df = request_gis_layer(work_path=nb_path, cluster=os.environ.get('AZ_DB_CLUSTER_ID'), 
-                                      job_params={"FMZCode": param_str}, f_name="ntwkm_run_output.json",
-                                      run_name="Get Network Meter Data")
-    st.session_state['ntwk_meter_df'] = None
-    st.session_state['ntwk_meter_df'] = ntwk_meter_df
-    print(f"Network Meter Data: {type(st.session_state['ntwk_meter_df'])}")
-    return ntwk_meter_df
+    run = request_gis_layer(work_path=nb_path, cluster=os.environ.get('AZ_DB_CLUSTER_ID'), 
+                            job_params={"FMZCode": param_str},
+                            run_name="Get Network Meter Data")
+    st.session_state['ntwk_meter_run_id'] = run.run_id
+    return run.run_id
 
 
-@st.cache_data()
-def request_mains_data():
+def request_ntwk_meter_data_per_fmz(selected_fmz: list[str], parallelism: int = fmz_fanout.DEFAULT_PARALLELISM) -> fmz_fanout.FMZFanOut:
+    """_summary_
+    Call the Network Meter Layers Notebook once per FMZ, at most `parallelism` runs are in flight
+    and a failed FMZ is retried on its own
+    Args:
+        selected_fmz (list[str]): _description_
+        parallelism (int, optional): maximum number of concurrent runs. Defaults to fmz_fanout.DEFAULT_PARALLELISM.
+
+    Returns:
+        fmz_fanout.FMZFanOut: the fan-out, also stored in st.session_state['ntwk_meter_fanout']
     """
-    _summary_
+    nb_name = 'GISNTWM_Notebook_001'
+    nb_path = os.environ.get('AZ_DB_NOTEBOOK_PATH') + nb_name
+    poller = run_poller.get_run_poller(st.session_state['databricks_connection'])
+    fanout = fmz_fanout.FMZFanOut(poller, notebook_path=nb_path, cluster_id=os.environ.get('AZ_DB_CLUSTER_ID'),
+                                  fmz_list=selected_fmz, parallelism=parallelism).start()
+    st.session_state['ntwk_meter_fanout'] = fanout
+    st.session_state['ntwk_meter_run_id'] = None
+    return fanout
+
+
+def request_ntwk_meter_sync(selected_fmz: list[str], parallelism: int = fmz_fanout.DEFAULT_PARALLELISM,
+                            full: bool = False) -> delta_sync.DeltaSync:
+    """_summary_
+    Sync the Network Meter data of every FMZ, only the meters modified since the last sync of an FMZ are requested
+    and upserted into its synced rows. FMZs due a reconciliation are fetched in full
+    Args:
+        selected_fmz (list[str]): _description_
+        parallelism (int, optional): maximum number of concurrent runs. Defaults to fmz_fanout.DEFAULT_PARALLELISM.
+        full (bool, optional): fetch every FMZ in full to pick up the deleted meters. Defaults to False.
+
+    Returns:
+        delta_sync.DeltaSync: the sync, followed like a fan-out in st.session_state['ntwk_meter_fanout']
     """
     nb_name = 'GISNTWM_Notebook_001'
     nb_path = os.environ.get('AZ_DB_NOTEBOOK_PATH') + nb_name
+    poller = run_poller.get_run_poller(st.session_state['databricks_connection'])
+    sync = delta_sync.DeltaSync(poller, notebook_path=nb_path, cluster_id=os.environ.get('AZ_DB_CLUSTER_ID'),
+                                fmz_list=selected_fmz, layer=NTWK_METER_SLOT, full=full,
+                                parallelism=parallelism).start()
+    st.session_state['ntwk_meter_fanout'] = sync
+    st.session_state['ntwk_meter_run_id'] = None
+    return sync
+
+
+def collect_ntwk_meter_fanout(fanout: fmz_fanout.FMZFanOut | None):
+    """
+    Display the progress of a per FMZ fan-out and merge the FMZs finished so far into the session dataframe
+    """
+    if fanout is None:
+        return
+    progress = fanout.progress()
+    finished = int((progress['state'] == 'SUCCESS').sum())
+    st.progress(finished / max(len(progress), 1), text=f"{finished} of {len(progress)} FMZs received")
+    st.dataframe(progress)
+    merged_df = fanout.merged()
+    if merged_df is not None and st.session_state.get('ntwk_meter_df_source') != id(merged_df):
+        # the map picks up every FMZ as soon as its run has finished
+        share_ntwk_meter_df(merged_df)
+        st.session_state['ntwk_meter_df_source'] = id(merged_df)
+        st.session_state['ntwk_meter_df_run_id'] = None
+    if fanout.done and finished < len(progress):
+        st.error(f"{len(progress) - finished} FMZs failed after {fanout.max_retries} retries")
+
+
+def collect_ntwk_meter_data(run: run_poller.TrackedRun | None):
+    """
+    Share the output of a successful Network Meter run as the session dataframe, once per run.
+    The output was already decoded by the completion callback of the run, the poller drops the run once it is shared
+    """
+    if run is None or not run.succeeded or run.result is None:
+        return
+    if st.session_state.get('ntwk_meter_df_run_id') != run.run_id:
+        share_ntwk_meter_df(run.result)
+        st.session_state['ntwk_meter_df_run_id'] = run.run_id
+        st.session_state['ntwk_meter_df_source'] = None
+        st.session_state['ntwk_meter_run_id'] = None
+        run_poller.get_run_poller(st.session_state['databricks_connection']).forget(run.run_id)
+
+
+def request_mains_data(dbfs_path: str) -> GeoDataFrame:
+    """
+    Read the GIS Mains layer from the result file the mains notebook writes to DBFS, 
+    the layer is too large to be returned through the notebook output.
+    The layer is shared by every session through the layer store
+    """
+    db_connection = st.session_state['databricks_connection']
+    mains_gdf = layer_store.shared_layer(f"dbfs-mains-{dbfs_path}", lambda: dbfs_reader.load_dbfs_layer(
+        db_connection, dbfs_path, schema=layer_schema.MAINS_SCHEMA), slot='dbfs_mains')
+    return mains_gdf
 
 
-@st.cache_data()
 def load_lower_hall_local():
     # print("Manual Function for loading the Lower Hall B data")
     csv_path = "../data/lower_hall_b_full.csv"
-    plain_df = pd.read_csv(csv_path)
-    # fmz_regions = get_fmz_regions(plain_df, [
-    #                               "ZSEWRD", "ZDARNH", "ZUPSHB", "ZHAILY", "ZEXGGT", "ZHAILB", "ZDARNP", "ZHODDN", "ZDARNB"])
-
-    lower_hall_b_gdf = proc.df_to_gdf(plain_df, layer_columns=[
-                                      'GISID', 'FMZCODE', 'DMACODE', 'PMACODE', 'MAINNAME', 'geometry', 'layer'], geo_type="MultiLineString")
+    # read through the disk cache, the layer is returned already parsed and in EPSG:4326
+    # one read-only copy of the layer is shared by every session of the process
+    lower_hall_b_gdf = layer_store.shared_file_layer(csv_path, layer_schema.MAINS_SCHEMA)
     return lower_hall_b_gdf
 
 
 if __name__ == "__main__":
+    show_timings, trace_memory = instrumentation.instrumentation_controls()
+    instrumentation.start_rerun(trace_memory)
     st.markdown(
         """
         <link href="https://rsms.me/inter/inter.css" rel='stylesheet'>
@@ -246,15 +390,59 @@ if __name__ == "__main__":
         unsafe_allow_html=True,
     )
     # Request the Network Meter Layer Data
+    fan_out = st.checkbox("Request each FMZ separately", value=False,
+                          help="Submit one run per FMZ, every FMZ is shown as soon as its run finishes")
+    incremental = st.checkbox("Incremental sync", value=False,
+                              help="Only request the meters modified since the last sync of every FMZ")
+    full_sync = st.checkbox("Full reconciliation", value=False, disabled=not incremental,
+                            help="Fetch every FMZ in full to drop the deleted meters, "
+                                 "done automatically every few syncs")
+    parallelism = st.number_input("Concurrent FMZ runs", min_value=1, max_value=len(fmz_list),
+                                  value=fmz_fanout.DEFAULT_PARALLELISM, disabled=not (fan_out or incremental))
     if st.button('Fetch Network Meter Layer'):
-        # make a request to the data
-        request_ntwk_meter_data(selected_fmz=fmz_list)
+        # submit the request, the run is polled in the background while the page stays interactive
+        if incremental:
+            request_ntwk_meter_sync(selected_fmz=fmz_list, parallelism=int(parallelism), full=full_sync)
+        elif fan_out:
+            request_ntwk_meter_data_per_fmz(selected_fmz=fmz_list, parallelism=int(parallelism))
+        else:
+            request_ntwk_meter_data(selected_fmz=fmz_list)
+            st.session_state['ntwk_meter_fanout'] = None
+    auto_refresh = st.checkbox("Auto refresh run status", value=True)
+    ntwk_meter_run = show_run_status(st.session_state.get('ntwk_meter_run_id'))
+    collect_ntwk_meter_data(ntwk_meter_run)
+    ntwk_meter_fanout = st.session_state.get('ntwk_meter_fanout')
+    collect_ntwk_meter_fanout(ntwk_meter_fanout)
+    if incremental:
+        with st.expander("Sync state"):
+            st.dataframe(delta_sync.sync_status(NTWK_METER_SLOT))
+    with st.expander("Run history"):
+        # read from the compact journal lines, the run responses are not loaded
+        st.dataframe(run_journal.read_history(limit=50))
+    ntwk_meter_df = get_ntwk_meter_df()
+    if ntwk_meter_df is not None:
         # display the data once it's retrieved
-        # st.dataframe(st.session_state['ntwk_meter_df'])
-        st.success("Network Meter Data requested and saved to cache!")
-        # else:
         st.divider()
-        st.dataframe(st.session_state['ntwk_meter_df'])
+        st.dataframe(ntwk_meter_df)
+
+    st.divider()
+    st.markdown(
+        """
+        <link href="https://rsms.me/inter/inter.css" rel='stylesheet'>
+        <h3 style=' 
+        color: #FEEFDD; 
+        font-family:Inter;
+        '>
+        Request GIS Mains Data from DBFS</h3>
+        """,
+        unsafe_allow_html=True,
+    )
+    mains_dbfs_path = st.text_input("DBFS path of the mains result file (csv or parquet)",
+                                    value=os.environ.get('AZ_DB_MAINS_DBFS_PATH', ''))
+    if st.button('Fetch Mains Layer') and mains_dbfs_path:
+        # the file is read in 1MB chunks, an interrupted download resumes on the next attempt
+        mains_gdf = request_mains_data(mains_dbfs_path)
+        st.success(f"Loaded {len(mains_gdf)} mains from {mains_dbfs_path}")
 
     st.divider()
     st.markdown(
@@ -282,28 +470,47 @@ if __name__ == "__main__":
     st.session_state['selected_fmzs'] = st.multiselect(
         'Select FMZ Codes', fmz_list)
     # st.write(f"Selected FMZ Codes: {st.session_state['selected_fmzs']}")
+    render_mode, fast_threshold = map_render.meter_render_controls()
+    viewport_mode = viewport.viewport_controls()
     if st.button("Render the Map"):
-        # convert from df -> gdf
-        ntwkm_gdf = proc.df_to_gdf(st.session_state['ntwk_meter_df'], layer_columns=['FMZ1CODE', 'FMZ2CODE', 'DMA1CODE', 'DMA2CODE', 'METRICCALCULATED',
-                                                                                     'GISID', 'TWGUID', 'LIFECYCLESTATUS', 'NETWORKCODE1', 'NETWORKCODE2', 'METERTYPE', 'SHAPEX', 'SHAPEY', 'geometry'], geo_type="Point")
-
-        #  convert the crs to EPSG:4236
-        ntwkm_gdf.crs = "EPSG:27700"
-        ntwkm_gdf = ntwkm_gdf.to_crs(epsg=4326)
+        # keep rendering on the following reruns, panning the map reruns the page in viewport mode
+        st.session_state['render_ntwk_map'] = True
+    if st.session_state.get('render_ntwk_map') and ntwk_meter_df is not None:
+        ntwkm_gdf = project_ntwk_meter_df(ntwk_meter_df)
+        center_loc = layer_metadata.get_metadata(ntwkm_gdf)['centroid']
+        if viewport_mode:
+            ntwkm_gdf = viewport.cull_to_viewport(ntwkm_gdf, st.session_state.get('viewport_bounds'))
+
+        base_map = gen_base_layer(prefer_canvas=render_mode == 'canvas')
+        with instrumentation.stage("folium_build"):
+            ntwk_fg_layers = render_ntwk_meter_layer(
+                base_map=base_map, ntwkm_gdf=ntwkm_gdf, fmz_list=st.session_state['selected_fmzs'],
+                render_mode=render_mode, fast_threshold=fast_threshold)
+            for key, value in ntwk_fg_layers.items():
+                base_map.add_child(value)
 
-        base_map = gen_base_layer()
-        ntwk_fg_layers = render_ntwk_meter_layer(
-            base_map=base_map, ntwkm_gdf=ntwkm_gdf, fmz_list=st.session_state['selected_fmzs'])
-        for key, value in ntwk_fg_layers.items():
-            base_map.add_child(value)
-
-        center_loc = calculate_centroid(ntwkm_gdf)
         # render the map
         folium.LayerControl().add_to(base_map)
-        st_data_two = st_folium.st_folium(
-            base_map, center=center_loc, zoom=10, width=950, height=720, returned_objects=[])
+        map_center, map_zoom, returned_objects = viewport.map_view(center_loc, 10, viewport_mode)
+        with instrumentation.stage("html_serialize"):
+            st_data_two = st_folium.st_folium(
+                base_map, center=map_center, zoom=map_zoom, width=950, height=720, returned_objects=returned_objects)
+        if viewport_mode and viewport.update_viewport(st_data_two):
+            st.experimental_rerun()
         if st.button("Save the Network Meters HTML"):
             # save the map to a file
             base_map.save('../output/NetworkMeter_Base.html')
             st.success("Network Meter Map Saved")
         st.divider()
+
+    instrumentation.end_rerun("request_gis")
+    if show_timings:
+        instrumentation.render_stage_panel()
+        layer_store.render_store_panel()
+
+    run_pending = ntwk_meter_run is not None and not ntwk_meter_run.done
+    fanout_pending = ntwk_meter_fanout is not None and not ntwk_meter_fanout.done
+    if auto_refresh and (run_pending or fanout_pending):
+        # rerun shortly to refresh the status, any widget interaction interrupts the wait
+        t.sleep(2)
+        st.experimental_rerun()
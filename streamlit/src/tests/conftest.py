@@ -0,0 +1,24 @@
+"""_summary_
+
+Shared fixtures of the test suite, run from the streamlit/src directory: `python -m pytest tests`
+
+"""
+import os
+import sys
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(TESTS_DIR))
+
+import pytest
+
+
+@pytest.fixture
+def layer_csv(tmp_path):
+    """
+    Small Network Meter csv in EPSG:27700, the geometry is WKT
+    """
+    path = tmp_path / 'meters.csv'
+    path.write_text("GISID,FMZ1CODE,METERTYPE,geometry\n"
+                    "1,ZSEWRD,BULK,POINT (530000 180000)\n"
+                    "2,ZSEWRD,DISTRICT,POINT (530100 180100)\n"
+                    "3,ZDARNH,BULK,POINT (531000 181000)\n")
+    return str(path)
@@ -0,0 +1,71 @@
+import json
+import os
+
+import pytest
+import utils.data_processor as proc
+
+
+def write_meters(path, n_rows: int, bad_row: int | None = None) -> str:
+    lines = ["GISID,FMZ1CODE,geometry"]
+    for i in range(n_rows):
+        wkt = "POINT (not a number)" if i == bad_row else f"POINT ({530000 + i * 10} {180000 + i * 10})"
+        lines.append(f"{i},ZSEWRD,{wkt}")
+    path.write_text('\n'.join(lines) + '\n')
+    return str(path)
+
+
+def test_csv_to_geojson_feature_collection(tmp_path):
+    csv_path = write_meters(tmp_path / 'meters.csv', 7)
+    output_path = str(tmp_path / 'out' / 'meters.geojson')
+    summary = proc.csv_to_geojson(csv_path, output_path, "Point", chunk_rows=3)
+    with open(output_path) as f:
+        collection = json.load(f)
+    assert collection['type'] == 'FeatureCollection'
+    assert summary['format'] == 'geojson'
+    assert summary['features'] == len(collection['features']) == 7
+    assert summary['chunks'] == 3
+    assert summary['bytes'] == os.path.getsize(output_path)
+    assert [feature['properties']['GISID'] for feature in collection['features']] == list(range(7))
+    lon, lat = collection['features'][0]['geometry']['coordinates']
+    min_lon, min_lat, max_lon, max_lat = summary['bounds']
+    assert min_lon <= lon <= max_lon and min_lat <= lat <= max_lat
+    assert 50 < lat < 53
+
+
+def test_csv_to_geojson_ndjson(tmp_path):
+    csv_path = write_meters(tmp_path / 'meters.csv', 5)
+    output_path = str(tmp_path / 'meters.ndjson')
+    summary = proc.csv_to_geojson(csv_path, output_path, "Point", chunk_rows=2)
+    with open(output_path) as f:
+        features = [json.loads(line) for line in f]
+    assert summary['format'] == 'ndjson'
+    assert summary['features'] == len(features) == 5
+    assert all(feature['type'] == 'Feature' for feature in features)
+
+
+def test_csv_to_geojson_failure_leaves_no_output(tmp_path):
+    csv_path = write_meters(tmp_path / 'meters.csv', 6, bad_row=4)
+    output_path = str(tmp_path / 'meters.geojson')
+    with pytest.raises(Exception):
+        proc.csv_to_geojson(csv_path, output_path, "Point", chunk_rows=2)
+    assert os.listdir(tmp_path) == ['meters.csv']
+
+
+@pytest.mark.parametrize("layer_columns", [None, ['GISID', 'geometry']])
+def test_df_to_gdf_leaves_the_source_frame_unchanged(layer_columns):
+    import warnings
+    import pandas as pd
+    plain_df = pd.DataFrame({"GISID": [1, 2], "FMZ1CODE": ["ZSEWRD", "ZDARNH"], "EMPTY": [None, None],
+                             "geometry": ["POINT (1 2)", "POINT (3 4)"]})
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        gdf = proc.df_to_gdf(plain_df, "Point", layer_columns)
+    assert list(plain_df['geometry']) == ["POINT (1 2)", "POINT (3 4)"]
+    assert 'EMPTY' not in gdf.columns
+    assert gdf.geometry.x.tolist() == [1, 3]
+
+
+def test_missing_wkt_becomes_none():
+    geometries = proc.strings_to_geometries(["POINT (1 2)", None, float('nan')], geo_type="Point")
+    assert geometries[0].x == 1
+    assert geometries[1] is None and geometries[2] is None
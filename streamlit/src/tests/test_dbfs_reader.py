@@ -0,0 +1,86 @@
+import os
+
+import pytest
+import utils.dbfs_reader as dbfs_reader
+
+CHUNK = 1000
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch):
+    monkeypatch.setattr(dbfs_reader, 'RETRY_DELAY', 0.0)
+
+
+@pytest.fixture
+def dbfs_root(tmp_path):
+    root = tmp_path / 'dbfs'
+    (root / 'results').mkdir(parents=True)
+    # 10 full chunks and a short final one
+    (root / 'results' / 'mains.bin').write_bytes(os.urandom(10 * CHUNK + 337))
+    return root
+
+
+def source_bytes(dbfs_root) -> bytes:
+    return (dbfs_root / 'results' / 'mains.bin').read_bytes()
+
+
+def test_short_final_block(dbfs_root, tmp_path):
+    # the fake returns less than a chunk per call, the short reads are continued up to the end of the file
+    fake = dbfs_reader.LocalDBFS(str(dbfs_root), max_read=300)
+    local_path = dbfs_reader.download(fake, 'dbfs:/results/mains.bin', str(tmp_path / 'mains.bin'),
+                                      chunk_size=CHUNK, workers=1)
+    assert open(local_path, 'rb').read() == source_bytes(dbfs_root)
+    assert max(fake.offsets_read) == 10 * CHUNK + 300
+
+
+def test_concurrent_ranges_reassemble_in_order(dbfs_root, tmp_path):
+    # the first ranges are the slowest, they finish after the later ones
+    fake = dbfs_reader.LocalDBFS(str(dbfs_root), latency=lambda offset: 0.05 if offset < 4 * CHUNK else 0.0)
+    received = []
+    local_path = dbfs_reader.download(fake, 'dbfs:/results/mains.bin', str(tmp_path / 'mains.bin'),
+                                      chunk_size=CHUNK, workers=4, progress=lambda done, size: received.append(done))
+    assert open(local_path, 'rb').read() == source_bytes(dbfs_root)
+    assert received == sorted(received) and received[-1] == len(source_bytes(dbfs_root))
+
+
+def test_failed_block_is_retried(dbfs_root, tmp_path):
+    fake = dbfs_reader.LocalDBFS(str(dbfs_root), fail_offsets=[3 * CHUNK])
+    local_path = dbfs_reader.download(fake, 'dbfs:/results/mains.bin', str(tmp_path / 'mains.bin'),
+                                      chunk_size=CHUNK, workers=2)
+    assert open(local_path, 'rb').read() == source_bytes(dbfs_root)
+    assert fake.offsets_read.count(3 * CHUNK) == 1
+
+
+def test_download_resumes_after_a_failed_block(dbfs_root, tmp_path, monkeypatch):
+    monkeypatch.setattr(dbfs_reader, 'MAX_CHUNK_RETRIES', 0)
+    local_path = str(tmp_path / 'mains.bin')
+    failing = dbfs_reader.LocalDBFS(str(dbfs_root), fail_after=4)
+    with pytest.raises(ConnectionError):
+        dbfs_reader.download(failing, 'dbfs:/results/mains.bin', local_path, chunk_size=CHUNK, workers=1)
+    assert os.path.getsize(local_path + '.part') == 4 * CHUNK
+    assert not os.path.exists(local_path)
+
+    resumed = dbfs_reader.LocalDBFS(str(dbfs_root))
+    dbfs_reader.download(resumed, 'dbfs:/results/mains.bin', local_path, chunk_size=CHUNK, workers=3)
+    assert open(local_path, 'rb').read() == source_bytes(dbfs_root)
+    # only the missing blocks are read again
+    assert min(resumed.offsets_read) == 4 * CHUNK
+    assert not os.path.exists(local_path + '.part')
+
+
+def test_unchanged_download_is_not_read_again(dbfs_root, tmp_path):
+    local_path = str(tmp_path / 'mains.bin')
+    dbfs_reader.download(dbfs_reader.LocalDBFS(str(dbfs_root)), 'dbfs:/results/mains.bin', local_path, chunk_size=CHUNK)
+    again = dbfs_reader.LocalDBFS(str(dbfs_root))
+    dbfs_reader.download(again, 'dbfs:/results/mains.bin', local_path, chunk_size=CHUNK)
+    assert again.reads == 0
+
+
+def test_load_dbfs_layer(tmp_path, layer_csv, monkeypatch):
+    import utils.layer_cache as layer_cache
+    monkeypatch.setattr(layer_cache, 'LAYER_CACHE_FOLDER', str(tmp_path / 'layers'))
+    monkeypatch.setattr(dbfs_reader, 'DBFS_DOWNLOAD_FOLDER', str(tmp_path / 'downloads'))
+    fake = dbfs_reader.LocalDBFS(os.path.dirname(layer_csv), max_read=64)
+    gdf = dbfs_reader.load_dbfs_layer(fake, 'dbfs:/meters.csv', geo_type="Point", workers=2)
+    assert len(gdf) == 3
+    assert gdf.crs == "EPSG:4326"
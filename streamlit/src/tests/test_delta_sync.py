@@ -0,0 +1,122 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+import utils.delta_sync as delta_sync
+import utils.projection as projection
+from utils.layer_store import LayerStore
+
+
+def meters(metertype: str = "Revenue", modified: str = "2024-01-01 00:00:00") -> pd.DataFrame:
+    return pd.DataFrame({"GISID": [1, 2, 3], "METERTYPE": [metertype] * 3,
+                         "SHAPEX": [530000.0, 530100.0, 530200.0], "SHAPEY": [180000.0, 180100.0, 180200.0],
+                         "DATEMODIFIED": [modified] * 3})
+
+
+def sync(tmp_path, full: bool = False, columns: list[str] | None = None) -> delta_sync.DeltaSync:
+    return delta_sync.DeltaSync(None, "/nb", "cluster", ["ZSEWRD"], layer="ntwk_meter", full=full,
+                                folder=str(tmp_path), columns=columns)
+
+
+def share(store: LayerStore, df: pd.DataFrame):
+    # what share_ntwk_meter_df does for the page
+    version = projection.frame_version(df)
+    df.attrs['layer_version'] = version
+    store.put(f"ntwk_meter-{version}", df)
+    store.bind("ntwk_meter", f"ntwk_meter-{version}", session_id="a")
+
+
+def test_upsert_replaces_by_key_and_appends_new_rows():
+    base = meters()
+    delta = pd.DataFrame({"GISID": ["2", "4"], "METERTYPE": ["District", "Bulk"]})
+    rows = delta_sync.upsert(base, delta)
+    assert rows["GISID"].astype(str).tolist() == ["1", "3", "2", "4"]
+    assert rows["METERTYPE"].tolist() == ["Revenue", "Revenue", "District", "Bulk"]
+    assert delta_sync.upsert(base, delta.iloc[:0]) is base
+
+
+def test_attribute_only_delta_reaches_the_store_and_the_projected_layer(tmp_path):
+    store = LayerStore()
+    first = sync(tmp_path)
+    assert first.modes["ZSEWRD"] == "full"
+    share(store, first._result("ZSEWRD", meters()))
+    before = projection.points_from_xy(store.view("ntwk_meter", session_id="a"),
+                                       layer_version=store.view("ntwk_meter", session_id="a").attrs['layer_version'])
+
+    second = sync(tmp_path)
+    assert second.modes["ZSEWRD"] == "delta"
+    assert second._params("ZSEWRD")["ModifiedSince"] == "2024-01-01 00:00:00"
+    delta = meters("District", "2024-02-01 00:00:00").iloc[[1]]
+    share(store, second._result("ZSEWRD", delta))
+
+    view = store.view("ntwk_meter", session_id="a")
+    assert view.set_index("GISID")["METERTYPE"].to_dict() == {1: "Revenue", 2: "District", 3: "Revenue"}
+    after = projection.points_from_xy(view, layer_version=view.attrs['layer_version'])
+    assert after is not before
+    assert after.set_index("GISID")["METERTYPE"][2] == "District"
+    assert delta_sync.read_state(str(tmp_path))["ntwk_meter"]["ZSEWRD"]["high_water"] == "2024-02-01 00:00:00"
+
+
+def test_needs_full():
+    now = 1_000_000.0
+    entry = {"high_water": "2024-01-01 00:00:00", "last_full": now, "deltas_since_full": 0,
+             "columns": ["GISID", "METERTYPE"]}
+    assert delta_sync.needs_full(None, now)
+    assert delta_sync.needs_full({**entry, "high_water": None}, now)
+    assert not delta_sync.needs_full(entry, now)
+    assert delta_sync.needs_full(entry, now + delta_sync.SYNC_FULL_EVERY + 1)
+    assert delta_sync.needs_full({**entry, "deltas_since_full": delta_sync.SYNC_FULL_AFTER}, now)
+    assert delta_sync.needs_full(entry, now, columns=["GISID", "METERTYPE", "DMA1CODE"])
+    assert not delta_sync.needs_full(entry, now, columns=["GISID", "METERTYPE"])
+    assert delta_sync.needs_full({**entry, "schema_changed": True}, now)
+
+
+def test_schema_change_forces_a_full_fetch(tmp_path):
+    sync(tmp_path)._result("ZSEWRD", meters())
+    assert sync(tmp_path).modes["ZSEWRD"] == "delta"
+    assert sync(tmp_path, columns=list(meters().columns) + ["DMA1CODE"]).modes["ZSEWRD"] == "full"
+
+    delta = meters("District", "2024-02-01 00:00:00").iloc[[0]].assign(DMA1CODE="DMA01")
+    sync(tmp_path)._result("ZSEWRD", delta)
+    resync = sync(tmp_path)
+    assert resync.modes["ZSEWRD"] == "full"
+    resync._result("ZSEWRD", meters().assign(DMA1CODE="DMA01"))
+    assert sync(tmp_path).modes["ZSEWRD"] == "delta"
+
+
+def test_missing_rows_force_a_full_fetch(tmp_path):
+    sync(tmp_path)._result("ZSEWRD", meters())
+    os.remove(os.path.join(tmp_path, "ntwk_meter", "ntwk_meter_ZSEWRD.parquet"))
+    assert sync(tmp_path).modes["ZSEWRD"] == "full"
+
+
+def test_failed_state_rewrite_keeps_the_previous_state(tmp_path, monkeypatch):
+    delta_sync.update_state("ntwk_meter", "ZSEWRD", {"high_water": "2024-01-01 00:00:00"}, str(tmp_path))
+
+    def crash(*args, **kwargs):
+        raise OSError("disk full")
+    monkeypatch.setattr(delta_sync.json, "dump", crash)
+    with pytest.raises(OSError):
+        delta_sync.update_state("ntwk_meter", "ZSEWRD", {"high_water": "2024-02-01 00:00:00"}, str(tmp_path))
+
+    assert os.listdir(tmp_path) == [delta_sync.SYNC_STATE_FILE]
+    with open(os.path.join(tmp_path, delta_sync.SYNC_STATE_FILE)) as f:
+        assert json.load(f)["ntwk_meter"]["ZSEWRD"]["high_water"] == "2024-01-01 00:00:00"
+
+
+def test_failed_rows_write_keeps_the_previous_rows(tmp_path, monkeypatch):
+    delta_sync.write_rows(meters(), "ntwk_meter", "ZSEWRD", str(tmp_path))
+
+    def crash(self, path, *args, **kwargs):
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+        raise OSError("disk full")
+    monkeypatch.setattr(pd.DataFrame, "to_parquet", crash)
+    with pytest.raises(OSError):
+        delta_sync.write_rows(meters("District"), "ntwk_meter", "ZSEWRD", str(tmp_path))
+    monkeypatch.undo()
+
+    assert os.listdir(os.path.join(tmp_path, "ntwk_meter")) == ["ntwk_meter_ZSEWRD.parquet"]
+    assert delta_sync.read_rows("ntwk_meter", "ZSEWRD", str(tmp_path))["METERTYPE"].tolist() == ["Revenue"] * 3
@@ -0,0 +1,69 @@
+import os
+
+import pandas as pd
+import pytest
+import utils.layer_cache as layer_cache
+
+
+@pytest.fixture(autouse=True)
+def cache_folder(tmp_path, monkeypatch):
+    folder = tmp_path / 'layers'
+    monkeypatch.setattr(layer_cache, 'LAYER_CACHE_FOLDER', str(folder))
+    return folder
+
+
+def test_layer_is_cached_and_reused(layer_csv, cache_folder):
+    first = layer_cache.load_layer(layer_csv, geo_type="Point")
+    second = layer_cache.load_layer(layer_csv, geo_type="Point")
+    assert len(first) == len(second) == 3
+    assert first.crs == second.crs == "EPSG:4326"
+    assert first.attrs['layer_version'] == second.attrs['layer_version']
+    assert len([f for f in os.listdir(cache_folder) if f.endswith('.parquet')]) == 1
+
+
+def test_layer_version_follows_build_options(layer_csv):
+    full = layer_cache.load_layer(layer_csv, geo_type="Point")
+    narrow = layer_cache.load_layer(layer_csv, geo_type="Point", layer_columns=['GISID', 'geometry'])
+    assert list(narrow.columns) == ['GISID', 'geometry']
+    assert 'METERTYPE' in full.columns
+    assert full.attrs['layer_version'] != narrow.attrs['layer_version']
+
+
+def test_layer_version_follows_contents(layer_csv):
+    before = layer_cache.load_layer(layer_csv, geo_type="Point").attrs['layer_version']
+    with open(layer_csv, 'a') as f:
+        f.write("4,ZDARNH,BULK,POINT (532000 182000)\n")
+    after = layer_cache.load_layer(layer_csv, geo_type="Point")
+    assert len(after) == 4
+    assert after.attrs['layer_version'] != before
+
+
+def test_empty_sources(tmp_path):
+    csv_path = tmp_path / 'empty.csv'
+    csv_path.write_text("GISID,geometry\n")
+    parquet_path = tmp_path / 'empty.parquet'
+    pd.DataFrame({'GISID': pd.Series([], dtype='int64'), 'geometry': pd.Series([], dtype=object)}).to_parquet(parquet_path)
+    for path in (csv_path, parquet_path):
+        gdf = layer_cache.load_layer(str(path), geo_type="Point")
+        assert len(gdf) == 0
+        assert 'GISID' in gdf.columns
+
+
+def test_no_temp_files_left(layer_csv, cache_folder):
+    layer_cache.load_layer(layer_csv, geo_type="Point")
+    assert not [f for f in os.listdir(cache_folder) if f.endswith('.tmp')]
+
+
+def test_source_without_chunks(layer_csv, monkeypatch):
+    # e.g. a parquet file without row groups
+    monkeypatch.setattr(layer_cache, 'read_source_chunks', lambda *args, **kwargs: iter(()))
+    gdf = layer_cache.load_layer(layer_csv, geo_type="Point")
+    assert len(gdf) == 0
+    assert list(gdf.columns) == ['GISID', 'FMZ1CODE', 'METERTYPE', 'geometry']
+
+
+def test_meter_coordinates_keep_their_precision():
+    from utils.layer_schema import NTWK_METER_SCHEMA
+    df = NTWK_METER_SCHEMA.apply(pd.DataFrame({"SHAPEX": ["531234.57"], "SHAPEY": ["1012345.68"]}).astype(float))
+    assert df["SHAPEY"].iloc[0] == 1012345.68
+    assert str(df["METRICCALCULATED"].dtype) == "float32"
@@ -0,0 +1,47 @@
+import os
+
+import geopandas as gpd
+import pytest
+import shapely
+
+import utils.layer_metadata as layer_metadata
+import utils.projection as projection
+
+
+@pytest.fixture(autouse=True)
+def metadata_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(layer_metadata, "METADATA_FOLDER", str(tmp_path))
+    layer_metadata.clear_metadata_cache()
+    yield tmp_path
+    layer_metadata.clear_metadata_cache()
+
+
+def layer(version: str | None = None) -> gpd.GeoDataFrame:
+    gdf = gpd.GeoDataFrame({"FMZ1CODE": ["ZSEWRD", "ZSEWRD", "ZDARNH", "ZDARNH"]},
+                           geometry=[shapely.Point(-0.1, 51.5), shapely.Point(-0.3, 51.7),
+                                     shapely.box(-1.0, 52.0, -0.8, 52.2), None], crs="EPSG:4326")
+    if version is not None:
+        gdf.attrs['layer_version'] = version
+    return gdf
+
+
+def test_compute_metadata_does_not_fill_the_projection_cache():
+    projection.clear_projection_cache()
+    metadata = layer_metadata.compute_metadata(layer())
+    assert len(projection._projected_layers) == 0
+    assert metadata["count"] == 4
+    assert metadata["bounds"] == pytest.approx([-1.0, 51.5, -0.1, 52.2])
+    assert metadata["extents"]["ZSEWRD"]["centroid"] == pytest.approx([51.6, -0.2])
+    # the centroid of the box is taken on the equal area projection
+    lat, lon = metadata["extents"]["ZDARNH"]["centroid"]
+    assert lon == pytest.approx(-0.9) and 52.0 < lat < 52.2
+
+
+def test_metadata_files_are_pruned_least_recently_used_first(metadata_folder):
+    for i in range(5):
+        layer_metadata.get_metadata(layer(f"v{i}"))
+        os.utime(layer_metadata._metadata_path((f"v{i}", 4, "FMZ1CODE")), (i, i))
+    assert len(os.listdir(metadata_folder)) == 5
+    assert layer_metadata.prune_metadata_files(max_files=2) == 3
+    kept = {layer_metadata._metadata_path((f"v{i}", 4, "FMZ1CODE")) for i in (3, 4)}
+    assert {os.path.join(metadata_folder, f) for f in os.listdir(metadata_folder)} == kept
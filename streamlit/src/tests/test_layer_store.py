@@ -0,0 +1,83 @@
+import pandas as pd
+import pytest
+
+import utils.projection as projection
+from utils.layer_store import LayerStore
+
+
+def meters(metertype: str = "Revenue") -> pd.DataFrame:
+    return pd.DataFrame({"GISID": [1, 2, 3], "METERTYPE": [metertype] * 3,
+                         "SHAPEX": [530000.0, 530100.0, 530200.0], "SHAPEY": [180000.0, 180100.0, 180200.0]})
+
+
+def test_frame_version_follows_every_column_and_the_row_order():
+    df = meters()
+    assert projection.frame_version(df) == projection.frame_version(meters())
+    assert projection.frame_version(df) != projection.frame_version(meters("District"))
+    assert projection.frame_version(df) != projection.frame_version(df.iloc[::-1])
+    assert projection.frame_version(df) != projection.frame_version(df.rename(columns={"METERTYPE": "TYPE"}))
+
+
+def test_frame_version_of_unhashable_values():
+    df = pd.DataFrame({"GISID": [1, 2], "FMZS": [["ZSEWRD"], ["ZDARNH"]]})
+    assert projection.frame_version(df) != projection.frame_version(df.iloc[::-1])
+
+
+def test_put_keeps_identical_contents_once():
+    store = LayerStore()
+    first, second = meters(), meters()
+    first.attrs['layer_version'] = second.attrs['layer_version'] = projection.frame_version(first)
+    stored = store.put("ntwk_meter", first)
+    assert store.put("ntwk_meter", second) is stored
+    assert len(store.stats()) == 1
+
+
+def test_put_replaces_a_new_layer_version():
+    store = LayerStore()
+    old, new = meters(), meters("District")
+    old.attrs['layer_version'] = projection.frame_version(old)
+    new.attrs['layer_version'] = projection.frame_version(new)
+    store.put("ntwk_meter", old)
+    store.bind("ntwk_meter", "ntwk_meter", session_id="a")
+    assert store.put("ntwk_meter", new) is new
+    assert store.view("ntwk_meter", session_id="a")["METERTYPE"].tolist() == ["District"] * 3
+    assert store.refcounts() == {"ntwk_meter": 1}
+
+
+def test_put_replace_without_versions():
+    store = LayerStore()
+    store.put("layer", meters())
+    assert store.put("layer", meters("District"))["METERTYPE"].iloc[0] == "Revenue"
+    assert store.put("layer", meters("District"), replace=True)["METERTYPE"].iloc[0] == "District"
+
+
+def test_stored_layers_are_read_only_and_views_keep_the_version():
+    store = LayerStore()
+    df = meters()
+    df.attrs['layer_version'] = "v1"
+    store.put("layer", df)
+    view = store.bind("slot", "layer", session_id="a")
+    assert view.attrs['layer_version'] == "v1"
+    with pytest.raises(ValueError):
+        store.get("layer")["SHAPEX"].to_numpy()[0] = 0.0
+
+
+def test_get_or_load_loads_once():
+    store = LayerStore()
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return meters()
+
+    assert store.get_or_load("layer", loader) is store.get_or_load("layer", loader)
+    assert len(calls) == 1
+
+
+def test_unbound_layers_are_evicted_first():
+    store = LayerStore(max_bytes=0)
+    store.put("bound", meters())
+    store.bind("slot", "bound", session_id="a")
+    store.put("unbound", meters("District"))
+    store.put("latest", meters("Bulk"))
+    assert set(store.stats()["key"]) == {"bound", "latest"}
@@ -0,0 +1,24 @@
+import numpy as np
+import geopandas as gpd
+import shapely
+import utils.lod as lod
+
+
+def mains_layer(n: int = 50) -> gpd.GeoDataFrame:
+    lines = [shapely.LineString([(-0.1 + i * 1e-3 + j * 1e-5, 51.5 + np.sin(j) * 1e-5) for j in range(100)])
+             for i in range(n)]
+    gdf = gpd.GeoDataFrame({"GISID": np.arange(n), "FMZCODE": ["ZSEWRD"] * n}, geometry=lines, crs="EPSG:4326")
+    gdf.attrs['layer_version'] = 'test-mains'
+    return gdf
+
+
+def test_levels_share_attribute_columns():
+    gdf = mains_layer()
+    pyramid = lod.build_lod_pyramid(gdf, [10, 14])
+    for zoom, level in pyramid.items():
+        assert np.shares_memory(level['GISID'].to_numpy(), gdf['GISID'].to_numpy())
+        assert level.attrs['layer_version'] == f'test-mains-lod{zoom}'
+        assert shapely.get_num_coordinates(level.geometry.values).sum() <= \
+            shapely.get_num_coordinates(gdf.geometry.values).sum()
+    # the layer itself keeps its full geometries
+    assert (shapely.get_num_coordinates(gdf.geometry.values) == 100).all()
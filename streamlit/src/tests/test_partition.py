@@ -0,0 +1,41 @@
+import geopandas as gpd
+import pytest
+import shapely
+
+import utils.partition as partition
+
+
+def layer(version: str | None = "v1", fmz: list[str] | None = None) -> gpd.GeoDataFrame:
+    fmz = fmz or ["ZSEWRD", "ZDARNH", "ZSEWRD"]
+    gdf = gpd.GeoDataFrame({"FMZ1CODE": fmz},
+                           geometry=shapely.points([530000.0, 530100.0, 540000.0], [180000.0, 180100.0, 190000.0]),
+                           crs="EPSG:27700")
+    if version is not None:
+        gdf.attrs['layer_version'] = version
+    return gdf
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    partition.clear_partition_cache()
+    yield
+    partition.clear_partition_cache()
+
+
+def test_partition_index_is_cached_per_version():
+    index = partition.get_partition_index(layer("v1"), "FMZ1CODE")
+    assert partition.get_partition_index(layer("v1"), "FMZ1CODE") is index
+    changed = partition.get_partition_index(layer("v2", ["ZDARNH", "ZDARNH", "ZSEWRD"]), "FMZ1CODE")
+    assert changed["ZDARNH"].tolist() == [0, 1]
+    assert index["ZDARNH"].tolist() == [1]
+
+
+def test_selections_and_partitions_get_versions_of_their_own():
+    gdf = layer("v1")
+    selected = partition.select(gdf, "FMZ1CODE", ["ZSEWRD"])
+    assert len(selected) == 2
+    assert selected.attrs['layer_version'] == "v1-ZSEWRD"
+    parts = partition.partitions(gdf, "FMZ1CODE", ["ZSEWRD", "ZNONE"])
+    assert parts["ZNONE"].empty
+    assert parts["ZSEWRD"].attrs['layer_version'] == "v1-ZSEWRD"
+    assert 'layer_version' not in partition.partitions(layer(None), "FMZ1CODE")["ZSEWRD"].attrs
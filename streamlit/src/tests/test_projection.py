@@ -0,0 +1,40 @@
+import geopandas as gpd
+import pytest
+import shapely
+
+import utils.projection as projection
+
+
+def layer(version: str | None = "v1", fmz: list[str] | None = None) -> gpd.GeoDataFrame:
+    fmz = fmz or ["ZSEWRD", "ZDARNH", "ZSEWRD"]
+    gdf = gpd.GeoDataFrame({"FMZ1CODE": fmz},
+                           geometry=shapely.points([530000.0, 530100.0, 540000.0], [180000.0, 180100.0, 190000.0]),
+                           crs="EPSG:27700")
+    if version is not None:
+        gdf.attrs['layer_version'] = version
+    return gdf
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    projection.clear_projection_cache()
+    yield
+    projection.clear_projection_cache()
+
+
+def test_projection_is_cached_per_version():
+    projected = projection.project_layer(layer("v1"))
+    assert projection.project_layer(layer("v1")) is projected
+    assert projected.attrs['layer_version'] == "v1"
+    assert projected.crs == "EPSG:4326"
+    assert projection.project_layer(layer("v2")) is not projected
+    assert projection.project_layer(layer(None)) is not projection.project_layer(layer(None))
+
+
+def test_points_from_xy_is_cached_per_version():
+    df = layer(None).assign(SHAPEX=[530000.0, 530100.0, 540000.0], SHAPEY=[180000.0, 180100.0, 190000.0])
+    points = projection.points_from_xy(df, layer_version="v1")
+    assert projection.points_from_xy(df, layer_version="v1") is points
+    moved = projection.points_from_xy(df.assign(SHAPEX=df["SHAPEX"] + 1000), layer_version="v2")
+    assert moved is not points
+    assert moved.geometry.x.iloc[0] > points.geometry.x.iloc[0]
@@ -0,0 +1,45 @@
+import logging
+
+import pandas as pd
+import pytest
+import utils.run_cache as run_cache
+
+
+@pytest.fixture(autouse=True)
+def cache_folder(tmp_path, monkeypatch):
+    monkeypatch.setattr(run_cache, 'RUN_CACHE_FOLDER', str(tmp_path / 'runs'))
+
+
+def test_key_ignores_parameter_order():
+    assert run_cache.cache_key('nb', {"a": 1, "b": 2}) == run_cache.cache_key('nb', {"b": 2, "a": 1})
+    assert run_cache.cache_key('nb', {"a": 1}) != run_cache.cache_key('nb', {"a": 2})
+    assert run_cache.cache_key('nb', {"a": 1}, source_version='v1') != run_cache.cache_key('nb', {"a": 1}, source_version='v2')
+
+
+def test_result_round_trip_and_ttl():
+    key = run_cache.cache_key('nb', {"FMZCode": "ZSEWRD"})
+    result_df = pd.DataFrame({"GISID": [1, 2], "FMZ1CODE": ["ZSEWRD", "ZSEWRD"]})
+    assert run_cache.put_result(key, result_df, notebook_path='nb', params={"FMZCode": "ZSEWRD"}, run_id=7)
+    pd.testing.assert_frame_equal(run_cache.get_result(key), result_df)
+    assert run_cache.get_result(key, ttl=-1) is None
+    assert run_cache.get_result(key) is None
+
+
+def test_unwritable_result_is_logged_not_cached(caplog):
+    key = run_cache.cache_key('nb', {})
+    mixed_df = pd.DataFrame({"value": [1, "a", b"raw"]})
+    with caplog.at_level(logging.WARNING, logger=run_cache.__name__):
+        assert not run_cache.put_result(key, mixed_df, notebook_path='nb')
+    assert "not cached" in caplog.text
+    assert run_cache.get_result(key) is None
+
+
+def test_concurrent_writes_of_the_same_key(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    key = run_cache.cache_key('nb', {"FMZCode": "ZSEWRD"})
+    frames = [pd.DataFrame({"GISID": range(i, i + 1000)}) for i in range(8)]
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        written = list(pool.map(lambda df: run_cache.put_result(key, df, notebook_path='nb'), frames))
+    assert all(written)
+    assert sorted(p.name for p in (tmp_path / 'runs').iterdir()) == [f'{key}.json', f'{key}.parquet']
+    assert any(run_cache.get_result(key).equals(df) for df in frames)
@@ -0,0 +1,87 @@
+import json
+import os
+
+import utils.run_journal as run_journal
+
+
+def write_journal(folder, records):
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, run_journal.JOURNAL_FILE), 'a') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+
+
+def run_records(n_runs: int, states=("PENDING", "RUNNING", "TERMINATED")) -> list[dict]:
+    records = []
+    for run_id in range(n_runs):
+        for i, state in enumerate(states):
+            records.append({"ts": run_id * 100 + i, "run_id": run_id, "life_cycle_state": state})
+    return records
+
+
+def test_tail_lines(tmp_path):
+    path = tmp_path / 'lines.txt'
+    path.write_bytes(b''.join(f'line {i}\n'.encode() for i in range(1000)))
+    lines, whole_file = run_journal.tail_lines(str(path), 5, block_size=16)
+    assert lines == [f'line {i}'.encode() for i in range(995, 1000)]
+    assert not whole_file
+    lines, whole_file = run_journal.tail_lines(str(path), 5000, block_size=4096)
+    assert len(lines) == 1000 and whole_file
+
+
+def test_history_reads_the_tail_only(tmp_path, monkeypatch):
+    write_journal(tmp_path, run_records(500))
+    read_sizes = []
+    tail_lines = run_journal.tail_lines
+
+    def counting_tail(path, n_lines, block_size=run_journal.TAIL_BLOCK_SIZE):
+        read_sizes.append(n_lines)
+        return tail_lines(path, n_lines, block_size)
+
+    monkeypatch.setattr(run_journal, 'tail_lines', counting_tail)
+    history = run_journal.read_history(str(tmp_path), limit=10)
+    assert list(history['run_id']) == list(range(499, 489, -1))
+    assert (history['life_cycle_state'] == "TERMINATED").all()
+    assert read_sizes == [10 * run_journal.RECORDS_PER_RUN]
+
+
+def test_history_scans_further_for_chatty_runs(tmp_path):
+    write_journal(tmp_path, run_records(20, states=["RUNNING"] * 30 + ["TERMINATED"]))
+    history = run_journal.read_history(str(tmp_path), limit=3)
+    assert list(history['run_id']) == [19, 18, 17]
+    assert (history['life_cycle_state'] == "TERMINATED").all()
+
+
+def test_full_history_and_rotation(tmp_path):
+    journal = run_journal.RunJournal(str(tmp_path), max_bytes=2000)
+    for run_id in range(200):
+        journal.record({"run_id": run_id, "life_cycle_state": "TERMINATED"})
+    journal.flush()
+    assert os.path.getsize(tmp_path / run_journal.JOURNAL_FILE) < 2100
+    assert os.path.exists(tmp_path / run_journal.ROTATED_JOURNAL_FILE)
+    history = run_journal.read_history(str(tmp_path))
+    assert history['run_id'].iloc[0] == 199
+    # only the current and the rotated journal are kept
+    assert len(history) < 200
+
+
+def test_limited_history_continues_into_the_rotated_journal(tmp_path):
+    records = run_records(50)
+    write_journal(tmp_path, records[:-9])
+    os.replace(tmp_path / run_journal.JOURNAL_FILE, tmp_path / run_journal.ROTATED_JOURNAL_FILE)
+    write_journal(tmp_path, records[-9:])
+    history = run_journal.read_history(str(tmp_path), limit=20)
+    assert history['run_id'].tolist() == list(range(49, 29, -1))
+    assert (history['life_cycle_state'] == "TERMINATED").all()
+
+
+def test_rotation_deletes_the_payloads_of_dropped_runs(tmp_path):
+    journal = run_journal.RunJournal(str(tmp_path), max_bytes=2000)
+    for run_id in range(200):
+        journal.record({"run_id": run_id, "life_cycle_state": "TERMINATED"})
+        journal.save_payload(run_id, {"run_id": run_id})
+    journal.flush()
+    kept = set(run_journal.read_history(str(tmp_path))['run_id'])
+    assert 0 < len(kept) < 200
+    payloads = {run_id for run_id in range(200) if os.path.exists(run_journal.payload_path(run_id, str(tmp_path)))}
+    assert payloads == kept
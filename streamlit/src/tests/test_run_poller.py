@@ -0,0 +1,169 @@
+import threading
+import time
+
+import pytest
+import utils.run_poller as run_poller
+
+
+class FakeDatabricks:
+    """
+    Run states served in order per run id, the last state repeats
+    """
+
+    def __init__(self):
+        self.states: dict[int, list[dict]] = {}
+        self.outputs: dict[int, dict] = {}
+        self.output_calls: list[int] = []
+        self.next_run_id = 100
+
+    def get_run_state(self, db_connection, run_id):
+        states = self.states[run_id]
+        state = states[0]
+        if len(states) > 1:
+            states.pop(0)
+        if isinstance(state, Exception):
+            raise state
+        return state
+
+    def get_job_output(self, db_connection, run_id):
+        self.output_calls.append(run_id)
+        return self.outputs[run_id]
+
+    def get_one_time_run(self, db_connection, **kwargs):
+        self.next_run_id += 1
+        return {"run_id": self.next_run_id}
+
+
+RUNNING = {"life_cycle_state": "RUNNING"}
+SUCCESS = {"life_cycle_state": "TERMINATED", "result_state": "SUCCESS"}
+FAILED = {"life_cycle_state": "TERMINATED", "result_state": "FAILED", "state_message": "Notebook raised"}
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeDatabricks()
+    for name in ("get_run_state", "get_job_output", "get_one_time_run"):
+        monkeypatch.setattr(run_poller.dbutils, name, getattr(fake, name))
+    return fake
+
+
+@pytest.fixture
+def poller():
+    poller = run_poller.RunPoller(None, min_interval=0.01, max_interval=0.05, timeout=5)
+    yield poller
+    poller.stop()
+
+
+def test_success_fetches_the_output_once(fake, poller):
+    fake.states[1] = [RUNNING, RUNNING, SUCCESS]
+    fake.outputs[1] = {"notebook_output": {"result": "[]"}}
+    run = poller.wait(poller.track(1).run_id, timeout=5)
+    assert run.succeeded
+    assert run.output == fake.outputs[1]
+    assert fake.output_calls == [1]
+
+
+def test_failed_run_keeps_the_state_message(fake, poller):
+    fake.states[2] = [FAILED]
+    run = poller.wait(poller.track(2).run_id, timeout=5)
+    assert run.done and not run.succeeded
+    assert run.result_state == "FAILED"
+    assert run.error == "Notebook raised"
+    assert fake.output_calls == []
+
+
+def test_repeated_poll_errors_fail_the_run(fake, poller):
+    fake.states[3] = [ConnectionError("unreachable")]
+    run = poller.wait(poller.track(3).run_id, timeout=5)
+    assert run.result_state == "FAILED"
+    assert run.poll_errors == run_poller.MAX_POLL_ERRORS
+
+
+def test_run_times_out(fake):
+    poller = run_poller.RunPoller(None, min_interval=0.01, max_interval=0.02, timeout=0.1)
+    try:
+        fake.states[4] = [RUNNING]
+        run = poller.wait(poller.track(4).run_id, timeout=5)
+        assert run.result_state == "TIMEDOUT"
+    finally:
+        poller.stop()
+
+
+def test_callbacks_do_not_block_polling(fake, poller):
+    release = threading.Event()
+    fake.states[5] = [SUCCESS]
+    fake.outputs[5] = {}
+    fake.states[6] = [RUNNING, SUCCESS]
+    fake.outputs[6] = {}
+    slow = poller.track(5, on_done=lambda run: release.wait(5))
+    fast = poller.wait(poller.track(6).run_id, timeout=2)
+    assert fast.succeeded
+    # the slow run is finished but only done once its callback returns
+    assert slow.finished_at is not None and not slow.done
+    release.set()
+    assert poller.wait(5, timeout=5).succeeded
+
+
+def test_failing_callback_does_not_stop_the_poller(fake, poller):
+    fake.states[7] = [SUCCESS]
+    fake.outputs[7] = {}
+    fake.states[8] = [RUNNING, SUCCESS]
+    fake.outputs[8] = {}
+
+    def broken(run):
+        raise ValueError("bad output")
+
+    run = poller.wait(poller.track(7, on_done=broken).run_id, timeout=5)
+    assert run.error == "Callback failed: bad output"
+    assert poller.wait(poller.track(8).run_id, timeout=5).succeeded
+    assert poller._thread.is_alive()
+
+
+def test_callback_result_is_kept_on_the_run(fake, poller):
+    fake.states[9] = [SUCCESS]
+    fake.outputs[9] = {"rows": 3}
+
+    def decode(run):
+        run.result = run.output["rows"]
+
+    assert poller.wait(poller.track(9, on_done=decode).run_id, timeout=5).result == 3
+
+
+def wait_until(condition, timeout: float = 5) -> bool:
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_finished_runs_expire(fake):
+    poller = run_poller.RunPoller(None, min_interval=0.01, max_interval=0.05, timeout=5, finished_ttl=0.1)
+    try:
+        release = threading.Event()
+        fake.states[10] = [SUCCESS]
+        fake.outputs[10] = {"rows": 3}
+        fake.states[11] = [SUCCESS]
+        fake.outputs[11] = {}
+        fake.states[12] = [RUNNING]
+        poller.wait(poller.track(10).run_id, timeout=5)
+        pending_callback = poller.track(11, on_done=lambda run: release.wait(5))
+        poller.track(12)
+        assert wait_until(lambda: poller.status(10) is None)
+        # a run is kept while it is polled or its callbacks are running
+        assert poller.status(12) is not None
+        assert poller.status(11) is pending_callback
+        release.set()
+        assert wait_until(lambda: poller.status(11) is None)
+    finally:
+        poller.stop()
+
+
+def test_forget_drops_a_collected_run(fake, poller):
+    fake.states[13] = [SUCCESS]
+    fake.outputs[13] = {}
+    poller.wait(poller.track(13).run_id, timeout=5)
+    poller.forget(13)
+    assert poller.status(13) is None
+    assert poller.runs() == []
@@ -0,0 +1,92 @@
+import urllib.request
+
+import geopandas as gpd
+import numpy as np
+import pytest
+import shapely
+import utils.tile_server as tile_server
+
+mapbox_vector_tile = pytest.importorskip("mapbox_vector_tile")
+
+Z, X, Y = 12, 2046, 1362     # tile over central London
+
+
+def tile_box(fraction: float = 0.5) -> tuple[float, float, float, float]:
+    min_x, min_y, max_x, max_y = tile_server.tile_bounds(Z, X, Y)
+    size = (max_x - min_x) * fraction
+    return min_x, max_y - size, min_x + size, max_y
+
+
+def register(name: str, geometries: list, session_id: str, **columns) -> gpd.GeoDataFrame:
+    gdf = gpd.GeoDataFrame({"GISID": np.arange(len(geometries)), **columns}, geometry=geometries, crs="EPSG:3857")
+    gdf.attrs['layer_version'] = f'{name}-{len(geometries)}'
+    tile_server.register_layer(name, gdf, properties=['GISID', *columns], session_id=session_id)
+    return gdf
+
+
+def decode(tile: bytes) -> dict:
+    # y_coord_down keeps the raw tile coordinates of the encoded rings
+    return mapbox_vector_tile.decode(tile, default_options={'y_coord_down': True})
+
+
+def ring_area(ring: list) -> float:
+    coords = np.asarray(ring[:-1] if ring[0] == ring[-1] else ring, dtype=float)
+    x, y = coords[:, 0], coords[:, 1]
+    return 0.5 * float(np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y))
+
+
+def test_varints_match_scalar_encoding():
+    values = [0, 1, 127, 128, 300, 16383, 16384, 2**31, 2**35 + 5]
+    assert tile_server._varints(values) == b''.join(tile_server._varint(v) for v in values)
+
+
+def test_polygon_winding_in_tile_space():
+    min_x, min_y, max_x, max_y = tile_box()
+    shell = shapely.box(min_x, min_y, max_x, max_y, ccw=True)
+    hole = shapely.box(*shapely.affinity.scale(shell, 0.4, 0.4).bounds)
+    square = shapely.box(min_x, min_y, max_x, max_y, ccw=False)
+    register('polygons', [shapely.Polygon(shell.exterior, [hole.exterior]), square], 'winding')
+    features = decode(tile_server.render_tile(tile_server.session_key('winding'), 'polygons', Z, X, Y))['polygons']['features']
+    assert len(features) == 2
+    for feature in features:
+        rings = feature['geometry']['coordinates']
+        assert ring_area(rings[0]) > 0
+        assert all(ring_area(ring) < 0 for ring in rings[1:])
+    assert len(features[0]['geometry']['coordinates']) == 2
+
+
+def test_lines_points_and_properties_round_trip():
+    min_x, min_y, max_x, max_y = tile_box()
+    line = shapely.LineString([(min_x, min_y), ((min_x + max_x) / 2, max_y), (max_x, min_y)])
+    point = shapely.Point((min_x + max_x) / 2, (min_y + max_y) / 2)
+    register('mixed', [line, point], 'round-trip', FMZCODE=['ZSEWRD', 'ZDARNH'])
+    layer = decode(tile_server.render_tile(tile_server.session_key('round-trip'), 'mixed', Z, X, Y))['mixed']
+    assert layer['extent'] == tile_server.TILE_EXTENT
+    by_id = {feature['id']: feature for feature in layer['features']}
+    assert by_id[0]['geometry']['type'] == 'LineString'
+    assert len(by_id[0]['geometry']['coordinates']) == 3
+    assert by_id[0]['properties'] == {'GISID': 0, 'FMZCODE': 'ZSEWRD'}
+    assert by_id[1]['geometry'] == {'type': 'Point', 'coordinates': [1024, 1024]}
+
+
+def test_layers_are_kept_per_session():
+    register('meters', [shapely.Point(*tile_box()[:2])], 'session-a')
+    assert 'meters' in tile_server.registered_layers('session-a')
+    assert 'meters' not in tile_server.registered_layers('session-b')
+    assert tile_server.render_tile(tile_server.session_key('session-b'), 'meters', Z, X, Y) is None
+
+
+def test_server_binds_a_free_port():
+    register('served', [shapely.box(*tile_box())], 'served-session')
+    server = tile_server.start_tile_server(port=0)
+    assert server.server_address[1] != 0
+    url = tile_server.tile_url('served', session_id='served-session').format(z=Z, x=X, y=Y)
+    with urllib.request.urlopen(url) as response:
+        assert decode(response.read())['served']['features']
+
+
+def test_tile_url_on_the_public_base_url(monkeypatch):
+    tile_server.start_tile_server(port=0)
+    monkeypatch.setattr(tile_server, 'TILE_SERVER_PUBLIC_URL', 'https://gis.example.com/tile-service/')
+    assert tile_server.tile_url('mains', session_id='session-a') == (
+        f"https://gis.example.com/tile-service/tiles/{tile_server.session_key('session-a')}/mains/{{z}}/{{x}}/{{y}}.pbf")
@@ -0,0 +1,35 @@
+from collections import OrderedDict
+
+import geopandas as gpd
+import pytest
+import shapely
+
+import utils.viewport as viewport
+
+
+def layer(version: str | None = "v1", fmz: list[str] | None = None) -> gpd.GeoDataFrame:
+    fmz = fmz or ["ZSEWRD", "ZDARNH", "ZSEWRD"]
+    gdf = gpd.GeoDataFrame({"FMZ1CODE": fmz},
+                           geometry=shapely.points([530000.0, 530100.0, 540000.0], [180000.0, 180100.0, 190000.0]),
+                           crs="EPSG:27700")
+    if version is not None:
+        gdf.attrs['layer_version'] = version
+    return gdf
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(viewport, "_layer_trees", OrderedDict())
+
+
+def test_viewport_index_is_cached_per_version():
+    tree = viewport.get_layer_index(layer("v1"))
+    assert viewport.get_layer_index(layer("v1")) is tree
+    assert viewport.get_layer_index(layer("v2")) is not tree
+    assert viewport.get_layer_index(layer(None)) is not viewport.get_layer_index(layer(None))
+
+
+def test_culled_layer_drops_the_version():
+    culled = viewport.cull_to_viewport(layer("v1"), (529000.0, 179000.0, 531000.0, 181000.0), margin=0)
+    assert len(culled) == 2
+    assert 'layer_version' not in culled.attrs
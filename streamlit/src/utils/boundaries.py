@@ -0,0 +1,159 @@
+"""_summary_
+
+FMZ / DMA / PMA boundary polygons built from the mains layer.
+Every zone is outlined with the convex hull, or a tighter concave hull, of the vertices of its mains.
+The zones are independent so they are built in a process pool, once per layer version, and the result
+is kept as a small GeoParquet layer next to the cached layers, so the boundaries render without any geometry work.
+
+"""
+import os
+import hashlib
+import json
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import shapely
+import streamlit as st
+from geopandas import GeoDataFrame
+import utils.layer_cache as layer_cache
+import utils.partition as partition
+
+BOUNDARY_LEVELS = {"FMZ": "FMZCODE", "DMA": "DMACODE", "PMA": "PMACODE"}
+HULL_METHODS = ["concave", "convex"]
+CONCAVE_RATIO = 0.3             # 0 is the tightest concave hull, 1 the convex hull
+PARALLEL_MIN_FEATURES = 20_000  # below this the groups are built in process, a pool does not pay off
+MAX_CACHED_BOUNDARIES = 8
+BOUNDARY_FOLDER = layer_cache.LAYER_CACHE_FOLDER
+
+_boundaries: OrderedDict = OrderedDict()
+_boundaries_lock = threading.Lock()
+
+
+def zone_hull(task: tuple[str, bytes, str, float]) -> tuple[str, bytes]:
+    """_summary_
+    Outline of one zone, run in the worker processes so the geometries are passed as WKB
+    Args:
+        task (tuple[str, bytes, str, float]): zone code, WKB of the zone's vertices as a MultiPoint, hull method, concave ratio
+
+    Returns:
+        tuple[str, bytes]: zone code and WKB of the hull
+    """
+    code, vertices_wkb, method, ratio = task
+    vertices = shapely.from_wkb(vertices_wkb)
+    if method == "concave":
+        hull = shapely.concave_hull(vertices, ratio=ratio)
+        if shapely.get_type_id(hull) != 3:
+            # too few or collinear vertices for a concave polygon
+            hull = shapely.convex_hull(vertices)
+    else:
+        hull = shapely.convex_hull(vertices)
+    return code, shapely.to_wkb(hull)
+
+
+def build_boundaries(gdf: GeoDataFrame, level: str = "FMZ", method: str = "concave",
+                     ratio: float = CONCAVE_RATIO, workers: int | None = None) -> GeoDataFrame:
+    """_summary_
+    Build the boundary polygon of every zone of a level
+    Args:
+        gdf (GeoDataFrame): the mains layer
+        level (str, optional): "FMZ", "DMA" or "PMA". Defaults to "FMZ".
+        method (str, optional): "concave" or "convex" hulls. Defaults to "concave".
+        ratio (float, optional): concave hull ratio. Defaults to CONCAVE_RATIO.
+        workers (int | None, optional): worker processes, 1 builds every zone in process. Defaults to the cpu count.
+
+    Returns:
+        GeoDataFrame: one row per zone with the zone code, the number of mains and the boundary, in the crs of the layer
+    """
+    code_column = BOUNDARY_LEVELS[level]
+    geometries = np.asarray(gdf.geometry.values)
+    tasks = []
+    counts = {}
+    for code, positions in sorted(partition.get_partition_index(gdf, code_column).items()):
+        counts[code] = len(positions)
+        # the hull only depends on the vertices, so the zone is reduced to one MultiPoint instead of a union of its mains
+        coords = shapely.get_coordinates(geometries[positions])
+        vertices = shapely.multipoints(np.unique(coords, axis=0))
+        tasks.append((code, shapely.to_wkb(vertices), method, ratio))
+
+    if workers != 1 and len(gdf) >= PARALLEL_MIN_FEATURES and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            hulls = list(executor.map(zone_hull, tasks))
+    else:
+        hulls = [zone_hull(task) for task in tasks]
+
+    return gpd.GeoDataFrame({code_column: [code for code, _ in hulls],
+                             "count": [counts[code] for code, _ in hulls]},
+                            geometry=shapely.from_wkb([hull for _, hull in hulls]), crs=gdf.crs)
+
+
+def _boundary_path(key: tuple) -> str:
+    name = hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]
+    return os.path.join(BOUNDARY_FOLDER, f'{name}.boundaries.parquet')
+
+
+def get_boundaries(gdf: GeoDataFrame, level: str = "FMZ", method: str = "concave",
+                   ratio: float = CONCAVE_RATIO) -> GeoDataFrame:
+    """_summary_
+    Returns the boundaries of a layer, built on first use and cached by gdf.attrs['layer_version']
+    in memory and on disk. Layers without a version are built on every call
+    Args:
+        gdf (GeoDataFrame): the mains layer
+        level (str, optional): "FMZ", "DMA" or "PMA". Defaults to "FMZ".
+        method (str, optional): "concave" or "convex" hulls. Defaults to "concave".
+        ratio (float, optional): concave hull ratio. Defaults to CONCAVE_RATIO.
+
+    Returns:
+        GeoDataFrame: see build_boundaries, with its own layer version
+    """
+    version = gdf.attrs.get('layer_version')
+    if version is None:
+        return build_boundaries(gdf, level, method, ratio)
+
+    key = (version, len(gdf), level, method, ratio if method == "concave" else None)
+    with _boundaries_lock:
+        if key in _boundaries:
+            _boundaries.move_to_end(key)
+            return _boundaries[key]
+
+    path = _boundary_path(key)
+    if os.path.exists(path):
+        boundaries = gpd.read_parquet(path)
+    else:
+        boundaries = build_boundaries(gdf, level, method, ratio)
+        os.makedirs(BOUNDARY_FOLDER, exist_ok=True)
+        # a temp file of its own, sessions building the same boundaries at once never share one
+        fd, tmp_path = tempfile.mkstemp(dir=BOUNDARY_FOLDER, prefix=os.path.basename(path) + '.', suffix='.tmp')
+        os.close(fd)
+        try:
+            boundaries.to_parquet(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    boundaries.attrs['layer_version'] = f"{version}-{level.lower()}-{method}"
+
+    with _boundaries_lock:
+        _boundaries[key] = boundaries
+        while len(_boundaries) > MAX_CACHED_BOUNDARIES:
+            _boundaries.popitem(last=False)
+    return boundaries
+
+
+def boundary_controls() -> tuple[bool, str]:
+    """
+    Sidebar controls for the FMZ boundaries layer, returns (show the boundaries, hull method)
+    """
+    show = st.sidebar.checkbox("FMZ boundaries", value=False, help="Outline every FMZ with the hull of its mains")
+    method = st.sidebar.selectbox("Boundary shape", HULL_METHODS, index=0, disabled=not show,
+                                  help="Concave hulls follow the mains closely, convex hulls are the old outline")
+    return show, method
+
+
+def clear_boundary_cache():
+    with _boundaries_lock:
+        _boundaries.clear()
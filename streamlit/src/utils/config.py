@@ -6,6 +6,7 @@ from typing import Any
 LAST_JOB_ID = 641964054544138
 DATA_FOLDER = '../data'
 OUTPUT_FOLDER = '../output'
+CACHE_FOLDER = '../cache'
 
 
 def check_data_output_folder(): 
@@ -13,6 +14,8 @@ def check_data_output_folder():
         os.mkdir(DATA_FOLDER)
     if not os.path.exists(OUTPUT_FOLDER):
         os.mkdir(OUTPUT_FOLDER)
+    if not os.path.exists(CACHE_FOLDER):
+        os.mkdir(CACHE_FOLDER)
         
 def save_json_data(data: Any, file_name: str): 
     print("Save the data to the output folder")
@@ -0,0 +1,242 @@
+"""_summary_
+
+Parallel conversion of csv GIS layers to FlatGeobuf and GeoJSON.
+The layers are listed in a JSON manifest:
+
+    {"output_folder": "../data/converted",
+     "layers": [{"name": "gis_mains", "path": "../data/gis_mains.csv", "geo_type": "MultiLineString",
+                 "columns": ["GISID", "FMZCODE", ..., "geometry"], "split_by": "FMZCODE"}]}
+
+Every layer is converted in a process pool. Layers over SPLIT_MIN_ROWS rows with a split_by column are split by FMZ:
+the FMZ codes are balanced over the workers, each worker streams the csv, keeps the rows of its codes and writes
+one file per FMZ, so no worker holds more than its share of the layer.
+
+FlatGeobuf files are written with their packed Hilbert R-tree (SPATIAL_INDEX=YES), so a bounding box read
+(read_layer_bbox, or gpd.read_file(path, bbox=...)) only reads the features it needs. The output folder gets a
+conversion.json listing every written part with its row count and bounds.
+Run from the streamlit/src directory: `python -m utils.convert_layers manifest.json --workers 4`
+
+"""
+import os
+import sys
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+import argparse
+import json
+import time as t
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from geopandas import GeoDataFrame
+import utils.data_processor as proc
+import utils.projection as projection
+
+SPLIT_MIN_ROWS = 250_000        # smaller layers are converted whole by one worker
+READ_CHUNK_ROWS = 100_000
+OUTPUT_FORMATS = {"fgb": ("FlatGeobuf", {"SPATIAL_INDEX": "YES"}), "geojson": ("GeoJSON", {})}
+DEFAULT_FORMATS = ["fgb", "geojson"]
+CONVERSION_FILE = 'conversion.json'
+NO_ZONE = 'None'                # part of the rows without an FMZ code, the extracts spell it the same way
+
+
+def read_manifest(manifest_path: str) -> dict:
+    """
+    Read a conversion manifest, relative layer paths are resolved against the folder of the manifest
+    """
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+    base = os.path.dirname(os.path.abspath(manifest_path))
+    for layer in manifest['layers']:
+        layer['path'] = os.path.join(base, layer['path'])
+    manifest['output_folder'] = os.path.join(base, manifest.get('output_folder', 'converted'))
+    return manifest
+
+
+def zone_counts(path: str, split_by: str) -> pd.Series:
+    """
+    Rows per FMZ code of a layer, only the split column is read
+    """
+    codes = pd.read_csv(path, usecols=[split_by], dtype=str)[split_by]
+    return codes.fillna(NO_ZONE).value_counts()
+
+
+def balance_zones(counts: pd.Series, n_buckets: int) -> list[list[str]]:
+    """
+    Spread the codes over n_buckets with close row totals, largest codes first into the lightest bucket
+    """
+    buckets = [[] for _ in range(max(1, min(n_buckets, len(counts))))]
+    totals = np.zeros(len(buckets), dtype=np.int64)
+    for code, count in counts.sort_values(ascending=False).items():
+        lightest = int(np.argmin(totals))
+        buckets[lightest].append(str(code))
+        totals[lightest] += count
+    return buckets
+
+
+def plan_tasks(layer: dict, workers: int) -> list[dict]:
+    """_summary_
+    Split a layer into conversion tasks, one per group of FMZs for large layers with a split column
+    Args:
+        layer (dict): layer entry of the manifest
+        workers (int): size of the process pool
+
+    Returns:
+        list[dict]: the layer entry with the "zones" of the task, None for the whole layer
+    """
+    split_by = layer.get('split_by')
+    if not split_by:
+        return [{**layer, "zones": None}]
+    counts = zone_counts(layer['path'], split_by)
+    if counts.sum() < SPLIT_MIN_ROWS:
+        return [{**layer, "zones": None}]
+    return [{**layer, "zones": zones} for zones in balance_zones(counts, workers)]
+
+
+def read_task_rows(task: dict) -> pd.DataFrame:
+    """
+    Stream the csv of a task and keep the rows of its zones
+    """
+    columns = task.get('columns')
+    split_by = task.get('split_by')
+    if columns and split_by and split_by not in columns:
+        columns = columns + [split_by]
+    parts = []
+    for chunk in pd.read_csv(task['path'], usecols=columns, chunksize=READ_CHUNK_ROWS):
+        if task['zones'] is not None:
+            codes = chunk[split_by].astype(str).where(chunk[split_by].notna(), NO_ZONE)
+            chunk = chunk[codes.isin(task['zones'])]
+        parts.append(chunk)
+    return pd.concat(parts, ignore_index=True)
+
+
+def write_part(gdf: GeoDataFrame, output_base: str, formats: list[str]) -> dict:
+    """_summary_
+    Write one part of a layer in every requested format
+    Args:
+        gdf (GeoDataFrame): the part, in EPSG:4326
+        output_base (str): output path without the extension
+        formats (list[str]): keys of OUTPUT_FORMATS
+
+    Returns:
+        dict: the files written, row count and bounds of the part
+    """
+    os.makedirs(os.path.dirname(output_base), exist_ok=True)
+    files = []
+    for fmt in formats:
+        driver, options = OUTPUT_FORMATS[fmt]
+        path = f'{output_base}.{fmt}'
+        if os.path.exists(path):
+            os.remove(path)
+        gdf.to_file(path, driver=driver, **options)
+        files.append(path)
+    return {"files": files, "rows": len(gdf),
+            "bounds": [float(v) for v in gdf.total_bounds] if len(gdf) else None}
+
+
+def convert_task(task: dict) -> list[dict]:
+    """_summary_
+    Worker of the process pool, convert the rows of a task and write one part per zone, or one for the whole layer
+    Args:
+        task (dict): from plan_tasks, with the output_folder and formats of the manifest
+
+    Returns:
+        list[dict]: one entry per written part, see write_part
+    """
+    start = t.perf_counter()
+    plain_df = read_task_rows(task)
+    if task['zones'] is not None:
+        split_by = task['split_by']
+        codes = plain_df[split_by].astype(str).where(plain_df[split_by].notna(), NO_ZONE).to_numpy()
+    # the columns were already selected by read_task_rows
+    gdf = proc.df_to_gdf(plain_df, task['geo_type'])
+    del plain_df
+    gdf.crs = task.get('src_crs', "EPSG:27700")
+    gdf = projection.project_layer(gdf, "EPSG:4326")
+
+    name = task['name']
+    if task['zones'] is None:
+        parts = {None: gdf}
+    else:
+        parts = {zone: gdf[codes == zone] for zone in task['zones']}
+
+    written = []
+    for zone, part in parts.items():
+        output_base = (os.path.join(task['output_folder'], name) if zone is None
+                       else os.path.join(task['output_folder'], name, f'{name}_{zone}'))
+        written.append({"layer": name, "zone": zone, **write_part(part, output_base, task['formats'])})
+    for entry in written:
+        entry["seconds"] = round(t.perf_counter() - start, 3)
+    return written
+
+
+def convert_manifest(manifest: dict, workers: int | None = None) -> dict:
+    """_summary_
+    Convert every layer of a manifest in a process pool and write the conversion.json of the output folder
+    Args:
+        manifest (dict): from read_manifest
+        workers (int | None, optional): worker processes. Defaults to the cpu count.
+
+    Returns:
+        dict: the conversion summary, every written part with its files, rows and bounds
+    """
+    workers = workers or os.cpu_count() or 1
+    output_folder = manifest['output_folder']
+    formats = manifest.get('formats', DEFAULT_FORMATS)
+    start = t.perf_counter()
+    tasks = [{**task, "output_folder": output_folder, "formats": task.get('formats', formats)}
+             for layer in manifest['layers'] for task in plan_tasks(layer, workers)]
+
+    parts = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(convert_task, task): task for task in tasks}
+        for future in as_completed(futures):
+            task_parts = future.result()
+            parts.extend(task_parts)
+            print(f"{futures[future]['name']}: {sum(p['rows'] for p in task_parts)} rows in {len(task_parts)} parts")
+
+    summary = {"created": t.time(), "seconds": round(t.perf_counter() - start, 3), "workers": workers,
+               "parts": sorted(parts, key=lambda p: (p['layer'], p['zone'] or ''))}
+    os.makedirs(output_folder, exist_ok=True)
+    with open(os.path.join(output_folder, CONVERSION_FILE), 'w') as f:
+        json.dump(summary, f, indent=4)
+    return summary
+
+
+def read_layer_bbox(output_folder: str, layer: str, bbox: tuple[float, float, float, float]) -> GeoDataFrame:
+    """_summary_
+    Read the features of a converted layer inside a bounding box. Parts whose bounds miss the box are not opened,
+    the others are read through their FlatGeobuf spatial index
+    Args:
+        output_folder (str): output folder of the conversion
+        layer (str): layer name
+        bbox (tuple[float, float, float, float]): min lon, min lat, max lon, max lat
+
+    Returns:
+        GeoDataFrame: the features in the box
+    """
+    with open(os.path.join(output_folder, CONVERSION_FILE), 'r') as f:
+        parts = json.load(f)['parts']
+    frames = []
+    for part in parts:
+        bounds = part['bounds']
+        if part['layer'] != layer or bounds is None:
+            continue
+        if bounds[0] > bbox[2] or bounds[2] < bbox[0] or bounds[1] > bbox[3] or bounds[3] < bbox[1]:
+            continue
+        path = next((path for path in part['files'] if path.endswith('.fgb')), part['files'][0])
+        frames.append(gpd.read_file(path, bbox=bbox))
+    if not frames:
+        return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+    return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=frames[0].crs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Convert the csv GIS layers of a manifest to FlatGeobuf and GeoJSON")
+    parser.add_argument('manifest', help="JSON manifest of the layers")
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    conversion = convert_manifest(read_manifest(args.manifest), workers=args.workers)
+    print(f"{len(conversion['parts'])} parts written in {conversion['seconds']}s")
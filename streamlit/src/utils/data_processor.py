@@ -19,15 +19,39 @@ from dotenv import load_dotenv
 from databricks_api import DatabricksAPI
 import utils.databricks as dbutils
 import utils.config as configutils
+import utils.instrumentation as instrumentation
+import utils.projection as projection
 import pandas as pd
 import geopandas as gpd
+import numpy as np
+import shapely
 import ast
 import json
 
 import time as t
 from typing import Any
+try:
+    # orjson is optional, it parses the notebook output several times faster than the json module
+    import orjson
+except ImportError:
+    orjson = None
 load_dotenv()
 
+# marker of the column oriented notebook output, {"format": "columns", "columns": {"GISID": [...], ...}}
+COLUMNS_FORMAT = "columns"
+GEOJSON_CHUNK_ROWS = 50_000     # rows converted at a time by csv_to_geojson
+NDJSON_EXTENSIONS = ('.ndjson', '.geojsonl', '.geojsons')
+
+
+def _json_loads(json_str: str) -> Any:
+    if orjson is not None:
+        try:
+            return orjson.loads(json_str)
+        except orjson.JSONDecodeError:
+            # orjson is strict JSON, the json module also accepts NaN and Infinity
+            pass
+    return json.loads(json_str)
+
 
 def string_to_dict(input_str: str) -> list[str]:
     """_summary_
@@ -41,15 +65,49 @@ def string_to_dict(input_str: str) -> list[str]:
     }
     The function returns a list of dictionaries. 
     """
-    # remove the brackets
-    # input_str = input_str.strip("[]")
-    # convert the string to a list of dictionaries
+    # only the outer list is a python literal, its elements are JSON documents that are joined
+    # into one JSON array and parsed in a single call instead of one literal_eval per row
     input_list = ast.literal_eval(input_str)
-    # convert the list of dictionaries to a list of dictionaries
-    input_list = [ast.literal_eval(el) for el in input_list]
-    # print(input_list)
+    try:
+        return _json_loads('[' + ','.join(input_list) + ']')
+    except ValueError:
+        # elements that are python dict literals rather than JSON
+        return [ast.literal_eval(el) for el in input_list]
+
+
+@instrumentation.timed_stage("notebook_decode")
+def decode_notebook_output(output_str: str) -> DataFrame:
+    """_summary_
+    Decode the result string of a notebook run into a dataframe, the format is detected from the string:
+        - column oriented JSON, {"format": "columns", "columns": {"GISID": [...], ...}}, maps one array per column
+          straight into the dataframe without building a dictionary per row
+        - a JSON array of records, [{"GISID": 1, ...}, ...]
+        - the python list of JSON strings returned by the current notebooks, see string_to_dict
+    Args:
+        output_str (str): notebook_output.result of the get_run_output response
+
+    Returns:
+        DataFrame: _description_
+    """
+    stripped = output_str.lstrip()
+    if stripped.startswith('{'):
+        payload = _json_loads(stripped)
+        if payload.get("format") != COLUMNS_FORMAT:
+            raise ValueError(f"Unknown notebook output format: {payload.get('format')}")
+        return pd.DataFrame(payload["columns"])
+
+    if stripped.startswith('[{'):
+        return pd.DataFrame.from_records(_json_loads(stripped))
+
+    return pd.DataFrame.from_records(string_to_dict(stripped))
 
-    return input_list
+
+def run_output_to_df(run_output: dict) -> DataFrame:
+    """
+    Convert the output of a finished notebook run (the get_run_output response) into a dataframe
+    """
+    output_str = run_output["notebook_output"]["result"]
+    return decode_notebook_output(output_str)
 
 
 def string_to_geometry(geometry_string: str, geo_type: str | None = None) -> Any:
@@ -76,18 +134,55 @@ def string_to_geometry(geometry_string: str, geo_type: str | None = None) -> Any
         return point
 
 
+def strings_to_geometries(geometry_strings: Any, geo_type: str | None = None) -> np.ndarray:
+    """
+    Convert a whole column of WKT strings to shapely objects in a single vectorized pass. 
+    Supports Point, LineString and MultiLineString, multi-part MultiLineStrings keep every part 
+    (string_to_geometry merges them into one part). 
+    Args:
+        geometry_strings (Any): a Series, list or array of WKT strings
+        geo_type (str | None, optional): "MultiLineString" promotes any LineString to a single part MultiLineString, 
+            "Point" rounds the coordinates to 2 decimal places to match string_to_geometry. Defaults to None.
+
+    Returns:
+        np.ndarray: array of shapely geometries
+    """
+    wkt_array = np.asarray(geometry_strings, dtype=object)
+    # missing values are passed through as None (a missing geometry in the GeoDataFrame) rather than failing the whole column
+    wkt_array = np.where(pd.isna(wkt_array), None, wkt_array)
+    geometries = shapely.from_wkt(wkt_array)
+
+    if geo_type == "MultiLineString":
+        line_mask = shapely.get_type_id(geometries) == 1
+        if line_mask.any():
+            lines = geometries[line_mask]
+            geometries[line_mask] = shapely.multilinestrings(
+                lines, indices=np.arange(len(lines)))
+
+    if geo_type == "Point":
+        geometries = shapely.set_precision(geometries, grid_size=0.01)
+
+    return geometries
+
+
 def df_to_gdf(plain_df: DataFrame, geo_type: str, layer_columns: list[str] = None) -> GeoDataFrame:
     """
     Convert a dataframe to a geodataframe
     """
-    # extract relevant content from the dataframe
-    map_contents = plain_df.copy()
-    if layer_columns:
-        map_contents = plain_df[layer_columns].copy()
-    
-    map_contents = map_contents.dropna(axis=1, how='all')
-    map_contents['geometry'] = map_contents['geometry'].apply(
-        lambda x: string_to_geometry(x, geo_type=geo_type))
+    # extract relevant content from the dataframe, the columns are selected and the empty ones dropped in one step
+    # so the frame is copied at most once, and only a shallow copy is made when every column is kept
+    columns = layer_columns or list(plain_df.columns)
+    empty = plain_df[columns].isna().all() if len(plain_df) else pd.Series(False, index=columns)
+    kept = [c for c in columns if not empty[c] or c == 'geometry']
+    if kept == list(plain_df.columns):
+        map_contents = plain_df.copy(deep=False)
+    else:
+        # the column selection already holds its own arrays, the shallow copy detaches it from plain_df so the
+        # geometry assignment below is not a chained assignment (SettingWithCopyWarning without copy-on-write)
+        map_contents = plain_df[kept].copy(deep=False)
+    with instrumentation.stage("wkt_parse"):
+        map_contents['geometry'] = strings_to_geometries(
+            map_contents['geometry'], geo_type=geo_type)
     # print(map_contents.head())
     return gpd.GeoDataFrame(map_contents, geometry='geometry')
 
@@ -107,50 +202,93 @@ def load_gdf_from_csv(path: str) -> Any:
 # this is where we create a base class for our app and then we can create a subclass for each service layer
 
 
-def csv_to_geojson(path: str, output_path: str, geo_type: str, layer_columns: list[str] = None) -> Any:
-    """_summary_
+def _feature_strings(gdf: GeoDataFrame, property_columns: list[str]) -> list[str]:
+    """
+    One GeoJSON Feature string per row, the geometries and the properties are each serialized in a single vectorized call
+    """
+    geometries = shapely.to_geojson(np.asarray(gdf.geometry.values))
+    properties = gdf.reindex(columns=property_columns).to_json(orient='records', lines=True, date_format='iso')
+    return [f'{{"type":"Feature","properties":{props},"geometry":{geom}}}'
+            for props, geom in zip(properties.splitlines(), geometries)]
 
+
+def csv_to_geojson(path: str, output_path: str, geo_type: str, layer_columns: list[str] = None,
+                   chunk_rows: int = GEOJSON_CHUNK_ROWS, ndjson: bool | None = None,
+                   src_crs: str = "EPSG:27700") -> dict:
+    """_summary_
+    Convert a csv layer to GeoJSON in EPSG:4326, streaming.
+    The csv is read, parsed and reprojected chunk_rows rows at a time and every chunk is appended to the output
+    before the next one is read, so the peak memory depends on the chunk size and not on the size of the file.
+    The output is a GeoJSON FeatureCollection, or newline delimited GeoJSON (one Feature per line) for .ndjson / .geojsonl paths
     Args:
-        path (str): _description_
-        output_path (str): _description_
-        geo_type (str): _description_
+        path (str): source csv file
+        output_path (str): GeoJSON or newline delimited GeoJSON file
+        geo_type (str): geometry type passed on to df_to_gdf
+        layer_columns (list[str], optional): columns to keep. Defaults to None.
+        chunk_rows (int, optional): rows held in memory at a time. Defaults to GEOJSON_CHUNK_ROWS.
+        ndjson (bool | None, optional): write one feature per line. Defaults to the extension of output_path.
+        src_crs (str, optional): crs of the source data. Defaults to "EPSG:27700".
 
     Returns:
-        Any: _description_
+        dict: summary of the conversion, output path, format, number of features and chunks, bounds and file size
     """
-    # read the file from csv into dataframe
-    df = pd.read_csv(path)
-    
-    for col in df.columns:
-        print(col)
-
-    gdf = df_to_gdf(df, geo_type, layer_columns)
-    # gdf = load_gdf_from_csv(path)
-    print(gdf.head())
-
-    # save the gdf to a file
-    gdf.crs = "EPSG:27700"
-    gdf = gdf.to_crs(epsg=4326)  # normalise the data
+    if ndjson is None:
+        ndjson = os.path.splitext(output_path)[1].lower() in NDJSON_EXTENSIONS
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    start = t.perf_counter()
+    features = 0
+    chunks = 0
+    bounds = None
+    tmp_path = f'{output_path}.{os.getpid()}.tmp'
+    try:
+        with open(tmp_path, 'w') as f:
+            if not ndjson:
+                f.write('{"type":"FeatureCollection","features":[\n')
+            reader = pd.read_csv(path, usecols=layer_columns, chunksize=chunk_rows)
+            for plain_df in instrumentation.timed_iter(reader, "csv_read"):
+                property_columns = [c for c in plain_df.columns if c != 'geometry']
+                chunk_gdf = df_to_gdf(plain_df, geo_type, layer_columns)
+                chunk_gdf.crs = src_crs
+                chunk_gdf = projection.project_layer(chunk_gdf, "EPSG:4326")
+                if len(chunk_gdf) == 0:
+                    continue
+                chunk_bounds = chunk_gdf.total_bounds
+                bounds = chunk_bounds if bounds is None else np.concatenate(
+                    [np.fmin(bounds[:2], chunk_bounds[:2]), np.fmax(bounds[2:], chunk_bounds[2:])])
 
-    gdf.to_file(output_path, driver='GeoJSON')
+                with instrumentation.stage("geojson_write"):
+                    feature_strings = _feature_strings(chunk_gdf, property_columns)
+                    if ndjson:
+                        f.write('\n'.join(feature_strings) + '\n')
+                    else:
+                        f.write((',\n' if features else '') + ',\n'.join(feature_strings))
+                features += len(feature_strings)
+                chunks += 1
+            if not ndjson:
+                f.write('\n]}\n')
+    except BaseException:
+        # a failed chunk leaves no partial output behind, the previous output file is kept
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, output_path)
 
-    return gdf.to_json()
+    return {"output_path": output_path, "format": "ndjson" if ndjson else "geojson", "features": features,
+            "chunks": chunks, "bounds": None if bounds is None else [float(v) for v in bounds],
+            "bytes": os.path.getsize(output_path), "seconds": round(t.perf_counter() - start, 3)}
 
 
 if __name__ == "__main__":
-    # path = "data/base_layer.csv"
-    # output_path = "data/base_layer.geojson"
-    # geo_type = "MultiLineString"
-    # csv_to_geojson(path, output_path, geo_type)
+    # convert the full GIS extracts, see utils/convert_layers.py for converting any manifest of layers
+    import utils.convert_layers as convert_layers
     ntwkm_cols = ["ENABLED", "GENID", "GISID", "GLOBALID", "SHORTGISID", "TWGUID", "DATECREATED", "DATEMODIFIED", "WATERTRACEWEIGHT", "GPSX", "GPSY", "GPSZ", "METERTYPE", "DIAMETER", "IMPERIALDIAMETER",
                   "METRICCALCULATED", "FMZ1CODE", "FMZ2CODE", "DMA1CODE", "DMA2CODE", "PMA1CODE", "PMA2CODE", "NETWORKCODE1", "NETWORKCODE2", "geometry", "METERSTATUS", "DATEPOSTED", "SHAPEX", "SHAPEY"]
     mains_cols = ["ENABLED", "CREATIONUSER", "DATECREATED", "DATEMODIFIED", "LASTUSER", "GENID", "GISID", "SHORTGISID", "TWGUID", "OPERATINGPRESSURE", "LIFECYCLESTATUS",
                   "MEASUREDLENGTH", "WATERTRACEWEIGHT", "METRICCALCULATED", "FMZCODE", "DMACODE", "PMACODE", "NETWORKCODE", "WATERTYPE", "geometry", "layer", "OPERATION", "PRESSURETYPE", "GLOBALID"]
-    mains_path = '../data/gis_mains.csv'
-    ntwkm_path = '../data/gis_wnetworkmeter.csv'
-
-    json_1 = csv_to_geojson(
-        mains_path, '../data/GeoJSONs/gis_mains.geojson', 'MultiLineString', mains_cols)
-    json_2 = csv_to_geojson(
-        ntwkm_path, '../data/GeoJSONs/gis_wnetworkmeter.geojson', 'Point', ntwkm_cols)
-    # pass
+    manifest = {"output_folder": os.path.join(configutils.DATA_FOLDER, 'GeoJSONs'),
+                "layers": [{"name": "gis_mains", "path": os.path.join(configutils.DATA_FOLDER, 'gis_mains.csv'),
+                            "geo_type": "MultiLineString", "columns": mains_cols, "split_by": "FMZCODE"},
+                           {"name": "gis_wnetworkmeter", "path": os.path.join(configutils.DATA_FOLDER, 'gis_wnetworkmeter.csv'),
+                            "geo_type": "Point", "columns": ntwkm_cols, "split_by": "FMZ1CODE"}]}
+    conversion = convert_layers.convert_manifest(manifest)
+    print(f"{len(conversion['parts'])} parts written in {conversion['seconds']}s")
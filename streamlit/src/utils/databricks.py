@@ -27,11 +27,13 @@ Columns of note:
 from databricks_api import DatabricksAPI
 import os
 from dotenv import load_dotenv
-from typing import Any
+from typing import Any, Iterable, Iterator
 import pandas as pd
 from datetime import datetime
 import json
+import threading
 import time as t
+import utils.instrumentation as instrumentation
 
 load_dotenv()
 
@@ -39,6 +41,13 @@ load_dotenv()
 LAST_JOB_ID = 641964054544138
 DATA_FOLDER = '../data'
 OUTPUT_FOLDER = '../output'
+JOBS_PAGE_SIZE = 25     # largest page the jobs list api returns
+JOBS_INDEX_TTL = 60     # seconds the jobs index is reused before the jobs are listed again
+JOB_COLUMNS = ["job_id", "creator", "job_name", "created_time", "cluster_id", "notebook_path",
+               "notebook_source", "max_retries", "timeout_seconds"]
+
+_jobs_index: dict = {}
+_jobs_index_lock = threading.Lock()
 
 if not os.path.exists(DATA_FOLDER):
     os.mkdir(DATA_FOLDER)
@@ -134,52 +143,91 @@ def create_job(db_connection: DatabricksAPI,
         raise ConnectionError("Error creating the job!")
 
 
+def iter_jobs(db_connection: DatabricksAPI, page_size: int = JOBS_PAGE_SIZE) -> Iterator[dict]:
+    """_summary_
+    Yield every job of the workspace, page by page. 
+    Follows next_page_token when the api returns one, and offset/limit paging while has_more is set otherwise
+    Args:
+        db_connection (DatabricksAPI): _description_
+        page_size (int, optional): jobs requested per call. Defaults to JOBS_PAGE_SIZE.
+
+    Yields:
+        Iterator[dict]: the job settings as returned by the jobs list api
+    """
+    offset = 0
+    page_token = None
+    while True:
+        if page_token:
+            # list_jobs does not take a page token, the query is sent through the client directly
+            jobs_page = db_connection.jobs.client.perform_query(
+                'GET', '/jobs/list', data={"limit": page_size, "page_token": page_token})
+        else:
+            jobs_page = db_connection.jobs.list_jobs(limit=page_size, offset=offset)
+        jobs = jobs_page.get('jobs', [])
+        yield from jobs
+        page_token = jobs_page.get('next_page_token')
+        if not jobs or not (page_token or jobs_page.get('has_more')):
+            return
+        offset += len(jobs)
+
+
+def jobs_to_df(jobs: Iterable[dict]) -> pd.DataFrame:
+    """
+    Flatten the job settings into a dataframe, the rows are collected first and the dataframe is built once
+    """
+    rows = []
+    for job in jobs:
+        settings = job.get('settings', {})
+        notebook_task = settings.get('notebook_task', {})
+        rows.append({"job_id": job['job_id'], "creator": job.get('creator_user_name'),
+                     "job_name": settings.get('name'), "created_time": job.get('created_time'),
+                     "cluster_id": settings.get('existing_cluster_id'),
+                     "notebook_path": notebook_task.get('notebook_path'),
+                     "notebook_source": notebook_task.get('source'),
+                     "max_retries": settings.get('max_retries'),
+                     "timeout_seconds": settings.get('timeout_seconds')})
+    return pd.DataFrame(rows, columns=JOB_COLUMNS)
+
+
+def get_jobs_index(db_connection: DatabricksAPI, ttl: float = JOBS_INDEX_TTL, refresh: bool = False) -> dict:
+    """_summary_
+    Returns the jobs of the workspace with an index of row positions by creator and by notebook path.
+    The index is kept in memory for ttl seconds, so repeated lookups do not call the REST API
+    Args:
+        db_connection (DatabricksAPI): _description_
+        ttl (float, optional): seconds the index is reused for. Defaults to JOBS_INDEX_TTL.
+        refresh (bool, optional): rebuild the index even if it has not expired. Defaults to False.
+
+    Returns:
+        dict: {"jobs": DataFrame, "by_creator": {creator: positions}, "by_path": {notebook path: positions}, "built": time}
+    """
+    with _jobs_index_lock:
+        if not refresh and _jobs_index and t.time() - _jobs_index['built'] < ttl:
+            return _jobs_index
+    jobs_df = jobs_to_df(iter_jobs(db_connection))
+    index = {"jobs": jobs_df,
+             "by_creator": jobs_df.groupby('creator').indices,
+             "by_path": jobs_df.groupby('notebook_path').indices,
+             "built": t.time()}
+    with _jobs_index_lock:
+        _jobs_index.clear()
+        _jobs_index.update(index)
+    return index
+
+
 def get_jobs_by_user(db_connection: DatabricksAPI, user_name: str) -> Any:
-    # list all the jobs
-    jobs_list = db_connection.jobs.list_jobs()
-    print(f'USER NAME: {user_name}')
-    # transform the json data into dataframes
-    user_jobs = pd.DataFrame()
-    for job in jobs_list['jobs']:
-        if job['creator_user_name'] == user_name:
-            # check if we have the matching user name
-            # append the job to the dataframe
-            nb_row = {"job_id": [job['job_id']], "creator": [job['creator_user_name']],
-                      "job_name": [job['settings']['name']], "created_time": [job['created_time']],
-                      "cluster_id": [job['settings']['existing_cluster_id']],
-                      "notebook_path": [job['settings']['notebook_task']['notebook_path']],
-                      "notebook_source": [job['settings']['notebook_task']['source']], }
-            nb_row_df = pd.DataFrame(nb_row)
-            user_jobs = pd.concat([user_jobs, nb_row_df], ignore_index=True)
-
-    return user_jobs
+    # jobs created by the user, from the in memory jobs index
+    index = get_jobs_index(db_connection)
+    positions = index['by_creator'].get(user_name, [])
+    user_jobs = index['jobs'].iloc[positions].reset_index(drop=True)
+    return user_jobs[JOB_COLUMNS[:7]]
 
 
 def get_jobs_by_path(db_connection: DatabricksAPI, nb_path: str) -> Any:
-    # list all the jobs
-    jobs_list = db_connection.jobs.list_jobs()
-    print(f'NOTEBOOK PATH: {nb_path}')
-    # transform the json data into dataframes
-    notebook_jobs = pd.DataFrame()
-    for job in jobs_list['jobs']:
-        if 'notebook_task' in job['settings']:
-            # check if we have the matching notebook path
-            if job['settings']['notebook_task']['notebook_path'] == nb_path:
-                # append the job to the dataframe
-                nb_row = {"job_id": [job['job_id']], "creator": [job['creator_user_name']],
-                          "job_name": [job['settings']['name']], "created_time": [job['created_time']],
-                          "cluster_id": [job['settings']['existing_cluster_id']],
-                          "notebook_path": [job['settings']['notebook_task']['notebook_path']],
-                          "notebook_source": [job['settings']['notebook_task']['source']],
-                          "max_retries": [job['settings']['max_retries']],
-                          "timeout_seconds": [job['settings']['timeout_seconds']]}
-
-                nb_row_df = pd.DataFrame(nb_row)
-                print(nb_row_df)
-                notebook_jobs = pd.concat(
-                    [notebook_jobs, nb_row_df], ignore_index=True)
-
-    print(f"Our Notebook Jobs: \n{notebook_jobs}")
+    # jobs that run the notebook, from the in memory jobs index
+    index = get_jobs_index(db_connection)
+    positions = index['by_path'].get(nb_path, [])
+    notebook_jobs = index['jobs'].iloc[positions].reset_index(drop=True)
     return notebook_jobs
 
 
@@ -209,6 +257,7 @@ def run_job_id(db_connection: DatabricksAPI, job_id: str, params: dict | None =
     return db_connection.jobs.run_now(job_id)
 
 
+@instrumentation.timed_stage("databricks_output")
 def get_job_output(db_connection: DatabricksAPI, run_id: int) -> Any:
     """_summary_
     Gets the output from a job run, the connection and the run id are required 
@@ -223,6 +272,22 @@ def get_job_output(db_connection: DatabricksAPI, run_id: int) -> Any:
     return db_connection.jobs.get_run_output(run_id)
 
 
+@instrumentation.timed_stage("databricks_poll")
+def get_run_state(db_connection: DatabricksAPI, run_id: int) -> dict:
+    """_summary_
+    Lightweight status call for a run, returns only the state block 
+    (life_cycle_state, result_state, state_message) without the notebook output
+    Args:
+        db_connection (DatabricksAPI): _description_
+        run_id (int): _description_
+
+    Returns:
+        dict: _description_
+    """
+    return db_connection.jobs.get_run(run_id)['state']
+
+
+@instrumentation.timed_stage("databricks_submit")
 def get_one_time_run(db_connection: DatabricksAPI,
                      cluster_id: str, run_name: str,
                      max_retries: int | None = None, timeout_seconds: int | None = None,
@@ -256,13 +321,27 @@ def clear_active_jobs(db_connection: DatabricksAPI, job_id: int | None = None):
     print("Clear all active jobs and job runs")
     return db_connection.jobs.delete_job(job_id=job_id)
 
-# :TODO Read from DBFS to view/read larger files 
-# db.dbfs.read(
-#     path,
-#     offset=None,
-#     length=None,
-#     headers=None,
-# )
+
+def get_dbfs_status(db_connection: DatabricksAPI, path: str) -> dict:
+    # file information (path, is_dir, file_size, modification_time) of a DBFS path
+    return db_connection.dbfs.get_status(path)
+
+
+@instrumentation.timed_stage("dbfs_read")
+def read_dbfs(db_connection: DatabricksAPI, path: str, offset: int = 0, length: int = 1 << 20) -> dict:
+    """_summary_
+    Read a range of a DBFS file, used to fetch results that are too large for the notebook output. 
+    The API returns at most 1MB per call, see utils.dbfs_reader for the chunked reader
+    Args:
+        db_connection (DatabricksAPI): _description_
+        path (str): _description_
+        offset (int, optional): _description_. Defaults to 0.
+        length (int, optional): _description_. Defaults to 1MB.
+
+    Returns:
+        dict: bytes_read and the base64 encoded data
+    """
+    return db_connection.dbfs.read(path, offset=offset, length=length)
 
 
 """ Main Functions to test out the module"""
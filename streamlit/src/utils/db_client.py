@@ -0,0 +1,135 @@
+"""_summary_
+
+Process wide Databricks client shared by every session and page.
+One DatabricksAPI is built per streamlit process (st.cache_resource), its HTTP session keeps a pool of
+keep-alive connections so TLS handshakes are not repeated for every user and page load.
+
+Every REST call goes through a global token bucket rate limiter and is retried with exponential backoff
+and full jitter on 429 and 5xx responses, so concurrent sessions back off at different times instead of together.
+
+"""
+import os
+import random
+import threading
+import time as t
+from functools import wraps
+
+import requests
+import streamlit as st
+from databricks_api import DatabricksAPI
+from databricks_cli.sdk.api_client import TlsV1HttpAdapter
+from urllib3.util.retry import Retry
+import utils.databricks as dbutils
+
+DB_POOL_SIZE = int(os.environ.get('AZ_DB_POOL_SIZE', 10))       # keep-alive connections to the workspace
+DB_RATE_LIMIT = float(os.environ.get('AZ_DB_RATE_LIMIT', 10))   # requests per second across all sessions
+DB_RATE_BURST = int(os.environ.get('AZ_DB_RATE_BURST', 20))
+DB_MAX_RETRIES = 5
+RETRY_BASE_DELAY = 0.5      # seconds, the backoff ceiling doubles on every attempt
+RETRY_MAX_DELAY = 30.0
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# a POST that failed with one of these statuses was not processed, other 5xx may have submitted the run already
+POST_RETRY_STATUSES = {429, 503}
+
+
+class RateLimiter:
+    """_summary_
+    Thread safe token bucket, acquire blocks until a request may be sent
+    Args:
+        rate (float): requests per second
+        burst (int): largest number of requests sent back to back
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = t.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = t.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            t.sleep(wait)
+
+
+def retry_delay(attempt: int, retry_after: str | None = None) -> float:
+    """
+    Backoff before the given retry attempt, full jitter below an exponential ceiling, at least the Retry-After header
+    """
+    delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+    if retry_after:
+        try:
+            delay = max(delay, float(retry_after))
+        except ValueError:
+            pass
+    return delay
+
+
+def _should_retry(method: str, status: int | None) -> bool:
+    if status is None:
+        # connection errors, only requests without side effects are sent again
+        return method == 'GET'
+    return status in (RETRY_STATUSES if method == 'GET' else POST_RETRY_STATUSES)
+
+
+def _with_retries(perform_query, rate_limiter: RateLimiter, max_retries: int):
+
+    @wraps(perform_query)
+    def perform_query_with_retries(method, path, data={}, headers=None, files=None, version=None):
+        for attempt in range(max_retries + 1):
+            rate_limiter.acquire()
+            try:
+                return perform_query(method, path, data=data, headers=headers, files=files, version=version)
+            except requests.exceptions.HTTPError as e:
+                response = e.response
+                status = response.status_code if response is not None else None
+                retry_after = response.headers.get('Retry-After') if response is not None else None
+                if attempt == max_retries or status is None or not _should_retry(method, status):
+                    raise
+            except requests.exceptions.ConnectionError:
+                retry_after = None
+                if attempt == max_retries or not _should_retry(method, None):
+                    raise
+            t.sleep(retry_delay(attempt, retry_after))
+
+    return perform_query_with_retries
+
+
+def configure_client(db_connection: DatabricksAPI, pool_size: int = DB_POOL_SIZE,
+                     rate_limiter: RateLimiter | None = None, max_retries: int = DB_MAX_RETRIES) -> DatabricksAPI:
+    """_summary_
+    Give a connection a pooled keep-alive HTTP adapter and route its calls through the rate limiter and retries
+    Args:
+        db_connection (DatabricksAPI): connection from dbutils.init_db_connection
+        pool_size (int, optional): connections kept open to the workspace. Defaults to DB_POOL_SIZE.
+        rate_limiter (RateLimiter | None, optional): limiter shared by the connection users. Defaults to a new one.
+        max_retries (int, optional): retries of a failed call. Defaults to DB_MAX_RETRIES.
+
+    Returns:
+        DatabricksAPI: the same connection
+    """
+    rate_limiter = rate_limiter or RateLimiter(DB_RATE_LIMIT, DB_RATE_BURST)
+    client = db_connection.client
+    # status retries are handled with jitter in perform_query, the adapter only retries failed connects
+    adapter = TlsV1HttpAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True,
+                               max_retries=Retry(total=None, connect=2, read=0, status=0, redirect=0, backoff_factor=0.2))
+    client.session.mount('https://', adapter)
+    client.perform_query = _with_retries(client.perform_query, rate_limiter, max_retries)
+    return db_connection
+
+
+@st.cache_resource()
+def get_db_client(pool_size: int = DB_POOL_SIZE, rate_limit: float = DB_RATE_LIMIT) -> DatabricksAPI:
+    """
+    The Databricks connection shared by every session of this streamlit process
+    """
+    db_connection = dbutils.init_db_connection(host=os.environ.get("AZ_DB_HOST"), token=os.environ.get("AZ_DB_TOKEN"))
+    return configure_client(db_connection, pool_size=pool_size, rate_limiter=RateLimiter(rate_limit, DB_RATE_BURST))
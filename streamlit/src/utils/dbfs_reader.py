@@ -0,0 +1,256 @@
+"""_summary_
+
+Chunked reader for result files written to DBFS by the notebooks.
+notebook_output.result is capped in size, so large layers (e.g. the full GIS mains) are written to DBFS
+and fetched here with the dbfs read API, which returns at most 1MB of base64 encoded data per call.
+
+The file is pulled in fixed size chunks, optionally over several concurrent ranges, each chunk is decoded
+on arrival and appended to a .part file, so only a few chunks are ever held in memory.
+An interrupted transfer resumes from the size of the .part file. The downloaded csv or parquet file
+is then parsed chunk by chunk into the local layer cache.
+
+LocalDBFS serves a local folder through the same read/get_status calls, to try and test the reader without a workspace,
+it can fail given blocks and delay reads to exercise retries, resuming and the ordering of concurrent ranges.
+
+"""
+import os
+import base64
+import hashlib
+import json
+import threading
+import time as t
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator
+
+from databricks_api import DatabricksAPI
+from geopandas import GeoDataFrame
+import utils.config as configutils
+import utils.databricks as dbutils
+import utils.layer_cache as layer_cache
+from utils.layer_schema import LayerSchema
+
+DBFS_CHUNK_SIZE = 1 << 20       # the read api returns at most 1MB per call
+DBFS_DOWNLOAD_FOLDER = os.path.join(configutils.CACHE_FOLDER, 'dbfs')
+DEFAULT_WORKERS = 4
+MAX_CHUNK_RETRIES = 3
+RETRY_DELAY = 1.0               # seconds, doubled on every retry of a chunk
+
+
+def _read_range(db_connection: DatabricksAPI, dbfs_path: str, offset: int, length: int) -> bytes:
+    for attempt in range(MAX_CHUNK_RETRIES + 1):
+        try:
+            response = dbutils.read_dbfs(db_connection, dbfs_path, offset=offset, length=length)
+            if not response.get('bytes_read'):
+                return b''
+            return base64.b64decode(response['data'])
+        except Exception:
+            if attempt == MAX_CHUNK_RETRIES:
+                raise
+            t.sleep(RETRY_DELAY * 2 ** attempt)
+
+
+def read_chunk(db_connection: DatabricksAPI, dbfs_path: str, offset: int, length: int = DBFS_CHUNK_SIZE) -> bytes:
+    """
+    Read and decode one range of a DBFS file, short reads are continued until the range or the file ends
+    and transient failures are retried with a growing delay
+    """
+    parts = []
+    remaining = length
+    while remaining > 0:
+        data = _read_range(db_connection, dbfs_path, offset + length - remaining, remaining)
+        if not data:
+            break
+        parts.append(data)
+        remaining -= len(data)
+    return b''.join(parts)
+
+
+def iter_chunks(db_connection: DatabricksAPI, dbfs_path: str, file_size: int, offset: int = 0,
+                chunk_size: int = DBFS_CHUNK_SIZE, workers: int = 1) -> Iterator[bytes]:
+    """_summary_
+    Yield the decoded chunks of a DBFS file in order, starting at offset
+    Args:
+        db_connection (DatabricksAPI): _description_
+        dbfs_path (str): path of the file on DBFS
+        file_size (int): size of the file, from get_dbfs_status
+        offset (int, optional): byte offset to start from. Defaults to 0.
+        chunk_size (int, optional): bytes per read call, at most 1MB. Defaults to DBFS_CHUNK_SIZE.
+        workers (int, optional): number of ranges read concurrently. Defaults to 1.
+
+    Yields:
+        Iterator[bytes]: the decoded chunks
+    """
+    offsets = range(offset, file_size, chunk_size)
+    if workers <= 1:
+        for chunk_offset in offsets:
+            yield read_chunk(db_connection, dbfs_path, chunk_offset, min(chunk_size, file_size - chunk_offset))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='dbfs-reader') as executor:
+        # only a window of chunks is in flight, they are yielded in order so the .part file stays contiguous
+        pending = deque()
+        for chunk_offset in offsets:
+            # the final block is clamped to the file size, the read ends there without probing past the end
+            pending.append(executor.submit(read_chunk, db_connection, dbfs_path, chunk_offset,
+                                           min(chunk_size, file_size - chunk_offset)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def local_download_path(dbfs_path: str) -> str:
+    """
+    Local file a DBFS path is downloaded to, the file extension is kept so the layer cache can pick the parser
+    """
+    prefix = hashlib.sha1(dbfs_path.encode()).hexdigest()[:8]
+    return os.path.join(DBFS_DOWNLOAD_FOLDER, f'{prefix}_{os.path.basename(dbfs_path)}')
+
+
+def _read_meta(meta_path: str) -> dict | None:
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+
+def _write_meta(meta_path: str, meta: dict):
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f, indent=4)
+
+
+def download(db_connection: DatabricksAPI, dbfs_path: str, local_path: str | None = None,
+             chunk_size: int = DBFS_CHUNK_SIZE, workers: int = DEFAULT_WORKERS,
+             progress: Callable[[int, int], None] | None = None) -> str:
+    """_summary_
+    Download a DBFS file to disk, resuming an interrupted transfer from its .part file.
+    A file that is already downloaded and unchanged on DBFS is not read again
+    Args:
+        db_connection (DatabricksAPI): _description_
+        dbfs_path (str): path of the file on DBFS
+        local_path (str | None, optional): destination file. Defaults to local_download_path(dbfs_path).
+        chunk_size (int, optional): bytes per read call. Defaults to DBFS_CHUNK_SIZE.
+        workers (int, optional): number of ranges read concurrently. Defaults to DEFAULT_WORKERS.
+        progress (Callable[[int, int], None] | None, optional): called with (bytes done, file size) after every chunk.
+
+    Returns:
+        str: path of the downloaded file
+    """
+    status = dbutils.get_dbfs_status(db_connection, dbfs_path)
+    if status.get('is_dir'):
+        raise IsADirectoryError(f"{dbfs_path} is a directory")
+    remote = {"path": dbfs_path, "file_size": status['file_size'], "modification_time": status.get('modification_time')}
+
+    local_path = local_path or local_download_path(dbfs_path)
+    os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+    meta_path = local_path + '.json'
+    part_path = local_path + '.part'
+    part_meta_path = part_path + '.json'
+
+    if os.path.exists(local_path) and _read_meta(meta_path) == remote:
+        return local_path
+
+    offset = 0
+    if os.path.exists(part_path) and _read_meta(part_meta_path) == remote:
+        # resume, the .part file only ever holds a contiguous prefix of the file
+        offset = min(os.path.getsize(part_path), remote['file_size'])
+    else:
+        _write_meta(part_meta_path, remote)
+        open(part_path, 'wb').close()
+
+    with open(part_path, 'r+b') as f:
+        f.truncate(offset)
+        f.seek(offset)
+        for chunk in iter_chunks(db_connection, dbfs_path, remote['file_size'], offset, chunk_size, workers):
+            if not chunk:
+                break
+            f.write(chunk)
+            offset += len(chunk)
+            if progress is not None:
+                progress(offset, remote['file_size'])
+
+    if offset != remote['file_size']:
+        raise IOError(f"Read {offset} of {remote['file_size']} bytes of {dbfs_path}, call again to resume")
+    os.replace(part_path, local_path)
+    os.replace(part_meta_path, meta_path)
+    return local_path
+
+
+def load_dbfs_layer(db_connection: DatabricksAPI, dbfs_path: str, geo_type: str | None = None, layer_columns: list[str] | None = None,
+                    src_crs: str = "EPSG:27700", dst_crs: str = "EPSG:4326", workers: int = DEFAULT_WORKERS,
+                    progress: Callable[[int, int], None] | None = None, schema: LayerSchema | None = None) -> GeoDataFrame:
+    """_summary_
+    Download a csv or parquet result file from DBFS and load it through the layer cache
+    Args:
+        db_connection (DatabricksAPI): _description_
+        dbfs_path (str): path of the result file on DBFS
+        geo_type (str | None, optional): geometry type passed on to df_to_gdf. Defaults to the geo_type of the schema.
+        layer_columns (list[str] | None, optional): columns to keep. Defaults to None.
+        src_crs (str, optional): crs of the source data. Defaults to "EPSG:27700".
+        dst_crs (str, optional): crs the cached layer is stored in. Defaults to "EPSG:4326".
+        workers (int, optional): number of ranges read concurrently. Defaults to DEFAULT_WORKERS.
+        progress (Callable[[int, int], None] | None, optional): download progress callback.
+        schema (LayerSchema | None, optional): columns and dtypes of the layer. Defaults to None.
+
+    Returns:
+        GeoDataFrame: the projected layer, with gdf.attrs['layer_version'] set
+    """
+    local_path = download(db_connection, dbfs_path, workers=workers, progress=progress)
+    return layer_cache.load_layer(local_path, geo_type=geo_type, layer_columns=layer_columns,
+                                  src_crs=src_crs, dst_crs=dst_crs, schema=schema)
+
+
+class LocalDBFS:
+    """_summary_
+    Serves a local folder through the dbfs read/get_status calls, pass it in place of the DatabricksAPI connection
+    Args:
+        root (str): local folder that stands in for the DBFS root
+        max_read (int, optional): largest range returned by one read call. Defaults to DBFS_CHUNK_SIZE.
+        fail_after (int | None, optional): number of reads after which every read fails, to try resuming. Defaults to None.
+        fail_offsets (Iterable[int], optional): offsets whose first read fails, to try the retries. Defaults to ().
+        latency (Callable[[int], float] | None, optional): seconds a read at an offset takes. Defaults to None.
+    """
+
+    def __init__(self, root: str, max_read: int = DBFS_CHUNK_SIZE, fail_after: int | None = None,
+                 fail_offsets: Iterable[int] = (), latency: Callable[[int], float] | None = None):
+        self.root = root
+        self.max_read = max_read
+        self.fail_after = fail_after
+        self.fail_offsets = set(fail_offsets)
+        self.latency = latency
+        self.reads = 0
+        self.offsets_read: list[int] = []
+        self._lock = threading.Lock()
+
+    @property
+    def dbfs(self) -> "LocalDBFS":
+        return self
+
+    def _local(self, path: str) -> str:
+        return os.path.join(self.root, path.removeprefix('dbfs:').lstrip('/'))
+
+    def get_status(self, path: str, headers=None) -> dict:
+        local = self._local(path)
+        if not os.path.exists(local):
+            raise FileNotFoundError(f"RESOURCE_DOES_NOT_EXIST: {path}")
+        stat = os.stat(local)
+        return {"path": path, "is_dir": os.path.isdir(local), "file_size": stat.st_size,
+                "modification_time": int(stat.st_mtime * 1000)}
+
+    def read(self, path: str, offset: int | None = None, length: int | None = None, headers=None) -> dict:
+        offset = offset or 0
+        with self._lock:
+            self.reads += 1
+            if self.fail_after is not None and self.reads > self.fail_after:
+                raise ConnectionError("Simulated DBFS read failure")
+            if offset in self.fail_offsets:
+                self.fail_offsets.discard(offset)
+                raise ConnectionError(f"Simulated DBFS read failure at {offset}")
+            self.offsets_read.append(offset)
+        if self.latency is not None:
+            t.sleep(self.latency(offset))
+        with open(self._local(path), 'rb') as f:
+            f.seek(offset)
+            data = f.read(min(length or self.max_read, self.max_read))
+        return {"bytes_read": len(data), "data": base64.b64encode(data).decode()}
@@ -0,0 +1,239 @@
+"""_summary_
+
+Incremental sync of the GIS layers requested per FMZ, driven by their DATEMODIFIED column.
+The synced rows of every layer and FMZ are kept as parquet under ../cache/sync, with a high-water mark: the latest
+DATEMODIFIED received. A sync asks the notebook only for the rows modified since the mark (the ModifiedSince
+parameter, the notebook returns the rows with DATEMODIFIED >= ModifiedSince) and upserts them by GISID into the
+synced rows, so the refresh time and the cluster cost follow the churn of the layer instead of its size.
+
+Deleted features never show up in a delta, so an FMZ is fetched in full again (reconciled) when:
+    - it has never been synced, or its synced rows have no DATEMODIFIED
+    - the columns returned by the notebook changed, a delta cannot be upserted into rows of another schema
+    - its last full fetch is older than AZ_SYNC_FULL_EVERY seconds
+    - AZ_SYNC_FULL_AFTER delta syncs were applied since its last full fetch
+    - a full reconciliation is forced from the page
+
+The mark is taken from the data and not from the clock, so a clock skew between the app and the cluster does not
+lose rows. Rows modified at the mark are requested again by the next sync, the upsert makes this harmless.
+
+"""
+import os
+import json
+import tempfile
+import threading
+import time as t
+
+import pandas as pd
+from pandas import DataFrame
+import utils.config as configutils
+import utils.instrumentation as instrumentation
+from utils.fmz_fanout import DEFAULT_MAX_RETRIES, DEFAULT_PARALLELISM, FMZFanOut
+from utils.run_poller import RunPoller
+
+SYNC_FOLDER = os.path.join(configutils.CACHE_FOLDER, 'sync')
+SYNC_STATE_FILE = 'sync_state.json'
+SYNC_FULL_EVERY = float(os.environ.get('AZ_SYNC_FULL_EVERY', 24 * 3600))     # seconds
+SYNC_FULL_AFTER = int(os.environ.get('AZ_SYNC_FULL_AFTER', 48))              # delta syncs
+MODIFIED_COLUMN = 'DATEMODIFIED'
+KEY_COLUMN = 'GISID'
+
+_state_lock = threading.Lock()      # the FMZs of a sync finish concurrently on the callback executor of the poller
+
+
+def _state_path(folder: str) -> str:
+    return os.path.join(folder, SYNC_STATE_FILE)
+
+
+def _rows_path(layer: str, fmz: str, folder: str) -> str:
+    return os.path.join(folder, layer, f'{layer}_{fmz}.parquet')
+
+
+def read_state(folder: str = SYNC_FOLDER) -> dict:
+    """
+    Sync state of every layer and FMZ: {layer: {fmz: {"high_water", "last_full", "deltas_since_full", ...}}}
+    """
+    try:
+        with open(_state_path(folder), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_atomically(path: str, write):
+    """
+    Write a file through a temp file of its own in the same folder, a failed or interrupted write leaves the
+    previous file in place and no temp file behind
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def update_state(layer: str, fmz: str, entry: dict, folder: str = SYNC_FOLDER):
+    """
+    Replace the state of one layer and FMZ, the state file is rewritten atomically
+    """
+    with _state_lock:
+        state = read_state(folder)
+        state.setdefault(layer, {})[fmz] = entry
+
+        def write(tmp_path: str):
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f, indent=4)
+        _write_atomically(_state_path(folder), write)
+
+
+def read_rows(layer: str, fmz: str, folder: str = SYNC_FOLDER) -> DataFrame | None:
+    """
+    The synced rows of a layer and FMZ, None before its first full fetch
+    """
+    path = _rows_path(layer, fmz, folder)
+    return pd.read_parquet(path) if os.path.exists(path) else None
+
+
+def write_rows(df: DataFrame, layer: str, fmz: str, folder: str = SYNC_FOLDER):
+    _write_atomically(_rows_path(layer, fmz, folder), lambda tmp_path: df.to_parquet(tmp_path, index=False))
+
+
+def high_water_mark(df: DataFrame, column: str = MODIFIED_COLUMN) -> str | None:
+    """
+    Latest modification time of the rows as an ISO string, None when the column is missing or empty
+    """
+    if column not in df.columns or df.empty:
+        return None
+    latest = pd.to_datetime(df[column], errors='coerce').max()
+    return None if pd.isna(latest) else latest.isoformat(sep=' ')
+
+
+def upsert(base: DataFrame, delta: DataFrame, key: str = KEY_COLUMN) -> DataFrame:
+    """_summary_
+    Replace the rows of base found in delta by their key and append the new ones, the other rows keep their order
+    Args:
+        base (DataFrame): the synced rows
+        delta (DataFrame): rows modified since the last sync
+        key (str, optional): feature id column. Defaults to KEY_COLUMN.
+
+    Returns:
+        DataFrame: the updated rows
+    """
+    if delta.empty:
+        return base
+    # the keys are compared as strings, a delta decoded from JSON may not carry the dtype of the parquet rows
+    delta = delta.drop_duplicates(subset=key, keep='last')
+    kept = base[~base[key].astype(str).isin(delta[key].astype(str))]
+    return pd.concat([kept, delta], ignore_index=True)
+
+
+def needs_full(entry: dict | None, now: float | None = None, columns: list[str] | None = None) -> bool:
+    """
+    Whether an FMZ must be fetched in full, from its sync state and the columns expected from the notebook,
+    see the module docstring
+    """
+    if not entry or not entry.get('high_water') or entry.get('schema_changed'):
+        return True
+    if columns is not None and entry.get('columns') is not None and list(columns) != entry['columns']:
+        return True
+    now = t.time() if now is None else now
+    return (now - entry.get('last_full', 0) > SYNC_FULL_EVERY
+            or entry.get('deltas_since_full', 0) >= SYNC_FULL_AFTER)
+
+
+def sync_status(layer: str, folder: str = SYNC_FOLDER) -> DataFrame:
+    """
+    One row per synced FMZ of a layer with its high-water mark, rows and the size of its last sync
+    """
+    now = t.time()
+    rows = [{"FMZ": fmz, "high_water": entry.get('high_water'), "rows": entry.get('rows'),
+             "last_mode": entry.get('last_mode'), "last_changed": entry.get('last_changed'),
+             "last_removed": entry.get('last_removed'), "deltas_since_full": entry.get('deltas_since_full'),
+             "full_age_h": round((now - entry.get('last_full', now)) / 3600, 1)}
+            for fmz, entry in sorted(read_state(folder).get(layer, {}).items())]
+    return pd.DataFrame(rows, columns=["FMZ", "high_water", "rows", "last_mode", "last_changed", "last_removed",
+                                       "deltas_since_full", "full_age_h"])
+
+
+class DeltaSync(FMZFanOut):
+    """_summary_
+    Per FMZ fan-out requesting only the rows modified since the high-water mark of every FMZ, the result of an FMZ is
+    its synced rows with the delta upserted. The run cache is bypassed, a sync always asks the cluster for fresh rows
+    Args:
+        poller (RunPoller): the shared background poller
+        notebook_path (str): absolute path of the notebook
+        cluster_id (str): cluster the runs are submitted to
+        fmz_list (list[str]): FMZs to sync
+        layer (str): layer name the synced rows and the state are kept under, e.g. "ntwk_meter"
+        full (bool, optional): reconcile every FMZ with a full fetch. Defaults to False.
+        parallelism (int, optional): maximum number of runs in flight. Defaults to DEFAULT_PARALLELISM.
+        max_retries (int, optional): resubmissions of a failed FMZ. Defaults to DEFAULT_MAX_RETRIES.
+        since_param (str, optional): notebook parameter holding the high-water mark. Defaults to "ModifiedSince".
+        folder (str, optional): folder of the synced rows and state. Defaults to SYNC_FOLDER.
+        columns (list[str] | None, optional): columns expected from the notebook, an FMZ synced with other
+            columns is fetched in full. Defaults to None.
+    """
+
+    def __init__(self, poller: RunPoller, notebook_path: str, cluster_id: str, fmz_list: list[str], layer: str,
+                 full: bool = False, parallelism: int = DEFAULT_PARALLELISM, max_retries: int = DEFAULT_MAX_RETRIES,
+                 run_name: str = "Sync Network Meter Data", param_name: str = "FMZCode",
+                 since_param: str = "ModifiedSince", folder: str = SYNC_FOLDER, columns: list[str] | None = None):
+        super().__init__(poller, notebook_path, cluster_id, fmz_list, parallelism=parallelism,
+                         max_retries=max_retries, run_name=run_name, param_name=param_name, use_cache=False)
+        self.layer = layer
+        self.since_param = since_param
+        self.folder = folder
+        state = read_state(folder).get(layer, {})
+        now = t.time()
+        self.sync_state = {fmz: state.get(fmz) for fmz in fmz_list}
+        self.modes = {fmz: "full" if full or needs_full(state.get(fmz), now, columns)
+                      or not os.path.exists(_rows_path(layer, fmz, folder)) else "delta" for fmz in fmz_list}
+        self.changed: dict[str, int] = {}
+
+    def _params(self, fmz: str) -> dict:
+        params = super()._params(fmz)
+        if self.modes[fmz] == "delta":
+            params[self.since_param] = self.sync_state[fmz]['high_water']
+        return params
+
+    def _result(self, fmz: str, fmz_df: DataFrame) -> DataFrame:
+        with instrumentation.stage("delta_sync_apply"):
+            entry = dict(self.sync_state[fmz] or {})
+            previous = read_rows(self.layer, fmz, self.folder)
+            if self.modes[fmz] == "full":
+                # the synced rows missing from a full fetch were deleted at the source
+                removed = 0
+                if previous is not None and KEY_COLUMN in previous.columns and KEY_COLUMN in fmz_df.columns:
+                    removed = int((~previous[KEY_COLUMN].astype(str).isin(fmz_df[KEY_COLUMN].astype(str))).sum())
+                rows = fmz_df
+                entry.update(high_water=high_water_mark(fmz_df), last_full=t.time(), deltas_since_full=0,
+                             last_mode="full", last_removed=removed, schema_changed=False)
+            else:
+                # a delta with other columns is still applied, the rows of the previous schema are reconciled by
+                # the full fetch the next sync makes
+                if not fmz_df.empty and list(fmz_df.columns) != list(previous.columns):
+                    entry['schema_changed'] = True
+                rows = upsert(previous, fmz_df)
+                marks = [mark for mark in (entry.get('high_water'), high_water_mark(fmz_df)) if mark]
+                entry.update(high_water=max(marks, key=pd.Timestamp) if marks else None, last_mode="delta",
+                             deltas_since_full=entry.get('deltas_since_full', 0) + 1, last_removed=0)
+            write_rows(rows, self.layer, fmz, self.folder)
+            entry.update(rows=len(rows), columns=list(rows.columns), last_changed=len(fmz_df), last_sync=t.time())
+            update_state(self.layer, fmz, entry, self.folder)
+        with self._lock:
+            self.changed[fmz] = len(fmz_df)
+        return rows
+
+    def progress(self) -> DataFrame:
+        """
+        The fan-out progress with the sync mode of every FMZ and the rows its sync changed
+        """
+        progress = super().progress()
+        with self._lock:
+            progress.insert(2, "mode", progress["FMZ"].map(self.modes))
+            progress.insert(5, "changed", progress["FMZ"].map(self.changed))
+        return progress
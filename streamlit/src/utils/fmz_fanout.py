@@ -0,0 +1,168 @@
+"""_summary_
+
+Per FMZ fan-out of a notebook request.
+Instead of one run for every selected FMZ, one run is submitted per FMZ with at most `parallelism`
+runs in flight. Every FMZ result is available as soon as its run finishes and the partial results
+are merged into a single layer, failed FMZs are retried on their own.
+FMZs found in the persistent run cache are not submitted at all.
+
+"""
+import logging
+import threading
+
+import pandas as pd
+import utils.data_processor as proc
+import utils.run_cache as run_cache
+from utils.run_poller import RunPoller, TrackedRun
+
+DEFAULT_PARALLELISM = 3
+DEFAULT_MAX_RETRIES = 2
+
+logger = logging.getLogger(__name__)
+
+
+class FMZFanOut:
+    """_summary_
+    Submits and follows one notebook run per FMZ through the shared RunPoller
+    Args:
+        poller (RunPoller): the shared background poller
+        notebook_path (str): absolute path of the notebook
+        cluster_id (str): cluster the runs are submitted to
+        fmz_list (list[str]): FMZs to request
+        parallelism (int, optional): maximum number of runs in flight. Defaults to DEFAULT_PARALLELISM.
+        max_retries (int, optional): resubmissions of a failed FMZ. Defaults to DEFAULT_MAX_RETRIES.
+        run_name (str, optional): name prefix of the runs. Defaults to "Get Network Meter Data".
+        param_name (str, optional): notebook parameter holding the FMZ code. Defaults to "FMZCode".
+        use_cache (bool, optional): serve FMZs from the run cache and cache new results. Defaults to True.
+    """
+
+    def __init__(self, poller: RunPoller, notebook_path: str, cluster_id: str, fmz_list: list[str],
+                 parallelism: int = DEFAULT_PARALLELISM, max_retries: int = DEFAULT_MAX_RETRIES,
+                 run_name: str = "Get Network Meter Data", param_name: str = "FMZCode", use_cache: bool = True):
+        self.poller = poller
+        self.notebook_path = notebook_path
+        self.cluster_id = cluster_id
+        self.parallelism = max(1, parallelism)
+        self.max_retries = max_retries
+        self.run_name = run_name
+        self.param_name = param_name
+        self.use_cache = use_cache
+        self.states = {fmz: "QUEUED" for fmz in fmz_list}
+        self.attempts = {fmz: 0 for fmz in fmz_list}
+        self.run_ids: dict[str, int] = {}
+        self.errors: dict[str, str] = {}
+        self.results: dict[str, pd.DataFrame] = {}
+        self._queue = list(fmz_list)
+        self._lock = threading.RLock()
+        self._merged_key = None
+        self._merged = None
+
+    def start(self) -> "FMZFanOut":
+        self._fill_slots()
+        return self
+
+    @property
+    def done(self) -> bool:
+        with self._lock:
+            return all(state in ("SUCCESS", "FAILED") for state in self.states.values())
+
+    def progress(self) -> pd.DataFrame:
+        """
+        One row per FMZ with its state, attempts, run id and rows received
+        """
+        with self._lock:
+            return pd.DataFrame([{"FMZ": fmz, "state": state, "attempts": self.attempts[fmz],
+                                  "run_id": self.run_ids.get(fmz),
+                                  "rows": len(self.results[fmz]) if fmz in self.results else None,
+                                  "error": self.errors.get(fmz)} for fmz, state in self.states.items()])
+
+    def merged(self) -> pd.DataFrame | None:
+        """
+        The results of every finished FMZ merged into one dataframe, rebuilt only when another FMZ has finished
+        """
+        with self._lock:
+            key = tuple(sorted(self.results))
+            if not key:
+                return None
+            if key != self._merged_key:
+                self._merged = pd.concat([self.results[fmz] for fmz in key], ignore_index=True)
+                self._merged_key = key
+            return self._merged
+
+    def _fill_slots(self):
+        with self._lock:
+            in_flight = sum(state == "RUNNING" for state in self.states.values())
+            to_submit = []
+            while self._queue and in_flight + len(to_submit) < self.parallelism:
+                fmz = self._queue.pop(0)
+                self.states[fmz] = "RUNNING"
+                self.attempts[fmz] += 1
+                to_submit.append(fmz)
+        for fmz in to_submit:
+            self._submit(fmz)
+
+    def _params(self, fmz: str) -> dict:
+        """
+        Notebook parameters of the run of an FMZ
+        """
+        return {self.param_name: fmz}
+
+    def _result(self, fmz: str, fmz_df: pd.DataFrame) -> pd.DataFrame:
+        """
+        The result kept for an FMZ from the decoded output of its run, called on the callback executor of the poller
+        """
+        return fmz_df
+
+    def _cache_key(self, fmz: str) -> str:
+        return run_cache.cache_key(self.notebook_path, self._params(fmz))
+
+    def _submit(self, fmz: str):
+        cached_df = run_cache.get_result(self._cache_key(fmz)) if self.use_cache else None
+        if cached_df is not None:
+            with self._lock:
+                self.results[fmz] = cached_df
+                self.states[fmz] = "SUCCESS"
+            self._fill_slots()
+            return
+        try:
+            run = self.poller.submit(run_name=f"{self.run_name} {fmz}", cluster_id=self.cluster_id,
+                                     workspace_path=self.notebook_path, notebook_params=self._params(fmz),
+                                     timeout_seconds=3600,
+                                     on_done=lambda run, fmz=fmz: self._on_done(fmz, run))
+            with self._lock:
+                self.run_ids[fmz] = run.run_id
+        except Exception as e:
+            self._failed(fmz, f"Submitting the run failed: {e}")
+            self._fill_slots()
+
+    def _on_done(self, fmz: str, run: TrackedRun):
+        # called on the callback executor of the poller when the run of an FMZ terminates
+        if run.succeeded:
+            try:
+                fmz_df = proc.run_output_to_df(run.output)
+                if self.use_cache:
+                    run_cache.put_result(self._cache_key(fmz), fmz_df, notebook_path=self.notebook_path,
+                                         params=self._params(fmz), run_id=run.run_id)
+                fmz_df = self._result(fmz, fmz_df)
+                with self._lock:
+                    self.results[fmz] = fmz_df
+                    self.states[fmz] = "SUCCESS"
+                    self.errors.pop(fmz, None)
+            except Exception as e:
+                logger.exception("Processing the output of FMZ %s (run %s) failed", fmz, run.run_id)
+                self._failed(fmz, f"Processing the output failed: {e}")
+        else:
+            self._failed(fmz, run.error or str(run.result_state))
+        # the fan-out keeps the result of the FMZ, the poller does not have to keep the run and its output
+        self.poller.forget(run.run_id)
+        self._fill_slots()
+
+    def _failed(self, fmz: str, error: str):
+        with self._lock:
+            self.errors[fmz] = error
+            if self.attempts[fmz] <= self.max_retries:
+                # retry the FMZ on its own, at the back of the queue
+                self.states[fmz] = "QUEUED"
+                self._queue.append(fmz)
+            else:
+                self.states[fmz] = "FAILED"
@@ -2,7 +2,7 @@
 import os 
 import streamlit as st 
 import utils.data_processor as proc 
-import utils.databricks as dbutils
+import utils.db_client as db_client
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -13,7 +13,8 @@ def app_setup_on_load():
     # initialise the databricks connection with the environment variables 
 
 def init_db_connection(): 
-    db_connection =  dbutils.init_db_connection(host=os.environ.get("AZ_DB_HOST"), token=os.environ.get("AZ_DB_TOKEN"))
+    # every session shares the pooled, rate limited connection of the streamlit process
+    db_connection = db_client.get_db_client()
     st.session_state['databricks_connection'] = db_connection
     # st.write(type(db_connection))
 
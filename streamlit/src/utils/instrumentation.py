@@ -0,0 +1,236 @@
+"""_summary_
+
+Lightweight per-stage timing and memory instrumentation of the data path.
+The slow stages (csv read, WKT parsing, reprojection, folium build, HTML serialization, Databricks requests)
+are wrapped in `with stage("name"):` blocks. Every stage adds its duration to process wide totals, and the stages
+run by the script thread of a page are also collected into the breakdown of the current rerun.
+
+Memory is measured with tracemalloc only while it is turned on from the sidebar, the peak of a stage is the
+highest traced memory above the memory traced when the stage started. tracemalloc is process wide so the peaks are
+approximate when several sessions rerun at the same time.
+
+The totals are written to ../output/metrics/az_gis.prom in the Prometheus text format at the end of every rerun,
+for a node exporter textfile collector or any other scraper.
+
+"""
+import os
+import logging
+import threading
+import time as t
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+import pandas as pd
+import streamlit as st
+import utils.config as configutils
+
+METRICS_FOLDER = os.path.join(configutils.OUTPUT_FOLDER, 'metrics')
+METRICS_FILE = 'az_gis.prom'
+METRIC_PREFIX = 'az_gis'
+
+_totals: dict[str, dict] = {}
+_totals_lock = threading.Lock()
+_local = threading.local()     # records and tracemalloc stack of the rerun running in this thread
+_tracing_threads: set[int] = set()
+_metrics_error: str | None = None      # last metrics write failure, logged once and not on every rerun
+
+logger = logging.getLogger(__name__)
+
+
+def _rerun_records() -> list[dict] | None:
+    return getattr(_local, 'records', None)
+
+
+@contextmanager
+def stage(name: str):
+    """_summary_
+    Time a block of code, and measure its peak memory when the rerun of the thread traces memory
+    Args:
+        name (str): stage name, e.g. "wkt_parse"
+    """
+    records = _rerun_records()
+    trace = records is not None and getattr(_local, 'trace_memory', False) and tracemalloc.is_tracing()
+    if trace:
+        current, peak = tracemalloc.get_traced_memory()
+        stack = _local.memory_stack
+        if stack:
+            # the peak of the enclosing stage so far is kept before the peak is reset for this one
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        tracemalloc.reset_peak()
+        stack.append({'start': current, 'peak': 0})
+    start = t.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = t.perf_counter() - start
+        peak_bytes = None
+        if trace:
+            entry = _local.memory_stack.pop()
+            peak = max(entry['peak'], tracemalloc.get_traced_memory()[1])
+            peak_bytes = max(0, peak - entry['start'])
+            if _local.memory_stack:
+                _local.memory_stack[-1]['peak'] = max(_local.memory_stack[-1]['peak'], peak)
+        _add(name, seconds, peak_bytes)
+        if records is not None:
+            records.append({"stage": name, "seconds": seconds, "peak_bytes": peak_bytes})
+
+
+def timed_stage(name: str):
+    """
+    Decorator form of stage
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def timed_iter(iterable, name: str):
+    """
+    Yield the items of an iterable, timing the production of every item as a stage, e.g. the chunks of a csv reader
+    """
+    iterator = iter(iterable)
+    while True:
+        with stage(name):
+            item = next(iterator, StopIteration)
+        if item is StopIteration:
+            return
+        yield item
+
+
+def _add(name: str, seconds: float, peak_bytes: int | None):
+    with _totals_lock:
+        totals = _totals.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0, "peak_bytes": 0})
+        totals["count"] += 1
+        totals["sum"] += seconds
+        totals["max"] = max(totals["max"], seconds)
+        if peak_bytes is not None:
+            totals["peak_bytes"] = max(totals["peak_bytes"], peak_bytes)
+
+
+def start_rerun(trace_memory: bool = False):
+    """_summary_
+    Start collecting the stages of a page rerun in this thread
+    Args:
+        trace_memory (bool, optional): measure the peak memory of the stages with tracemalloc. Defaults to False.
+    """
+    _local.records = []
+    _local.memory_stack = []
+    _local.trace_memory = trace_memory
+    _local.started = t.perf_counter()
+    with _totals_lock:
+        if trace_memory:
+            _tracing_threads.add(threading.get_ident())
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+        else:
+            _tracing_threads.discard(threading.get_ident())
+            # tracing slows every allocation down, it is stopped once no rerun asks for it
+            if not _tracing_threads and tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+
+def end_rerun(page: str) -> pd.DataFrame:
+    """_summary_
+    Stop collecting, keep the breakdown of the rerun in the session state and write the metrics file
+    Args:
+        page (str): page name the rerun is recorded under
+
+    Returns:
+        pd.DataFrame: breakdown of the rerun, one row per stage
+    """
+    records = _rerun_records() or []
+    total = t.perf_counter() - getattr(_local, 'started', t.perf_counter())
+    _local.records = None
+    _add(f'rerun_{page}', total, None)
+
+    breakdown = summarize(records)
+    st.session_state['last_rerun_stages'] = {"page": page, "seconds": total, "breakdown": breakdown}
+    global _metrics_error
+    try:
+        write_metrics()
+        _metrics_error = None
+    except OSError as e:
+        if str(e) != _metrics_error:
+            logger.warning("Metrics file not written: %s", e)
+        _metrics_error = str(e)
+    return breakdown
+
+
+def summarize(records: list[dict]) -> pd.DataFrame:
+    """
+    Total time, calls and largest memory peak per stage, slowest stage first
+    """
+    if not records:
+        return pd.DataFrame(columns=["stage", "calls", "seconds", "peak_mb"])
+    frame = pd.DataFrame(records)
+    breakdown = frame.groupby("stage", sort=False).agg(calls=("seconds", "size"), seconds=("seconds", "sum"),
+                                                       peak_mb=("peak_bytes", "max")).reset_index()
+    breakdown["seconds"] = breakdown["seconds"].round(4)
+    breakdown["peak_mb"] = (breakdown["peak_mb"].astype(float) / 2**20).round(2)
+    return breakdown.sort_values("seconds", ascending=False, ignore_index=True)
+
+
+def metrics_text() -> str:
+    """
+    The stage totals in the Prometheus text exposition format
+    """
+    with _totals_lock:
+        totals = {name: dict(values) for name, values in _totals.items()}
+    lines = [f"# HELP {METRIC_PREFIX}_stage_seconds Time spent in a stage of the data path",
+             f"# TYPE {METRIC_PREFIX}_stage_seconds summary"]
+    for name, values in sorted(totals.items()):
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{name}"}} {values["sum"]:.6f}')
+        lines.append(f'{METRIC_PREFIX}_stage_seconds_count{{stage="{name}"}} {values["count"]}')
+    lines += [f"# HELP {METRIC_PREFIX}_stage_seconds_max Slowest single call of a stage",
+              f"# TYPE {METRIC_PREFIX}_stage_seconds_max gauge"]
+    lines += [f'{METRIC_PREFIX}_stage_seconds_max{{stage="{name}"}} {values["max"]:.6f}'
+              for name, values in sorted(totals.items())]
+    lines += [f"# HELP {METRIC_PREFIX}_stage_peak_bytes Largest traced memory peak of a stage",
+              f"# TYPE {METRIC_PREFIX}_stage_peak_bytes gauge"]
+    lines += [f'{METRIC_PREFIX}_stage_peak_bytes{{stage="{name}"}} {values["peak_bytes"]}'
+              for name, values in sorted(totals.items()) if values["peak_bytes"]]
+    return '\n'.join(lines) + '\n'
+
+
+def write_metrics(folder: str = METRICS_FOLDER) -> str:
+    """
+    Write the metrics file atomically, a scraper never reads a partial file. Returns its path
+    """
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, METRICS_FILE)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(metrics_text())
+    os.replace(tmp_path, path)
+    return path
+
+
+def clear_metrics():
+    with _totals_lock:
+        _totals.clear()
+
+
+def instrumentation_controls() -> tuple[bool, bool]:
+    """
+    Sidebar controls of the instrumentation, returns (show the stage timings, trace memory)
+    """
+    show = st.sidebar.checkbox("Stage timings", value=False, help="Show where the time of the last rerun went")
+    trace_memory = st.sidebar.checkbox("Trace memory", value=False, disabled=not show,
+                                       help="Measure the memory peak of every stage, slows the app down")
+    return show, show and trace_memory
+
+
+def render_stage_panel():
+    """
+    Sidebar panel with the stage breakdown of the last rerun of the session
+    """
+    last_rerun = st.session_state.get('last_rerun_stages')
+    if not last_rerun:
+        return
+    with st.sidebar.expander(f"Last rerun: {last_rerun['seconds']:.2f}s", expanded=True):
+        st.dataframe(last_rerun['breakdown'].set_index("stage"), use_container_width=True)
@@ -0,0 +1,252 @@
+"""_summary_
+
+Persistent disk cache for the GIS layers that are loaded from local csv (or parquet) files.
+Each layer is stored as GeoParquet with the geometry already parsed and projected to EPSG:4326,
+so a warm start reads binary columns instead of re-tokenizing the WKT text.
+
+Entries are keyed by the source file path, its mtime and a hash of its contents,
+and are rebuilt automatically when the source file changes.
+
+"""
+import os
+import hashlib
+import json
+import tempfile
+
+import geopandas as gpd
+import pandas as pd
+import pyarrow.parquet as pq
+from geopandas import GeoDataFrame
+import utils.config as configutils
+import utils.data_processor as proc
+import utils.instrumentation as instrumentation
+import utils.layer_schema as layer_schema
+from utils.layer_schema import LayerSchema
+
+LAYER_CACHE_FOLDER = os.path.join(configutils.CACHE_FOLDER, 'layers')
+HASH_CHUNK_SIZE = 1 << 20   # read the source file in 1MB blocks when hashing
+PARSE_CHUNK_ROWS = 100_000  # rows parsed and projected at a time, the raw text of the whole file is never held in memory
+PARSER_VERSION = 2          # bump when df_to_gdf or the cached layout changes, every entry and layer version is renewed
+
+
+def content_hash(path: str) -> str:
+    """
+    Returns the sha256 hash of a file, read in fixed size blocks so large csv files are not held in memory
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def entry_name(path: str, geo_type: str, layer_columns: list[str] | None = None, dst_crs: str = "EPSG:4326",
+               schema: LayerSchema | None = None) -> str:
+    """
+    Name of the cache entry for a given source file and the options used to build the layer
+    """
+    key = json.dumps({"source": os.path.abspath(path), "geo_type": geo_type, "layer_columns": layer_columns,
+                      "crs": dst_crs, "parser": PARSER_VERSION}, sort_keys=True)
+    if schema is not None:
+        key += schema.key()
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+def _entry_paths(name: str) -> tuple[str, str]:
+    return (os.path.join(LAYER_CACHE_FOLDER, f'{name}.parquet'),
+            os.path.join(LAYER_CACHE_FOLDER, f'{name}.json'))
+
+
+def _read_manifest(manifest_path: str) -> dict | None:
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, 'r') as f:
+        return json.load(f)
+
+
+def _replace_atomically(path: str, write):
+    """
+    Write a file through a temp file of its own in the same folder, concurrent builders never share a temp file
+    and a failed write leaves the previous file in place
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _write_manifest(manifest_path: str, manifest: dict):
+    def write(tmp_path: str):
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=4)
+    _replace_atomically(manifest_path, write)
+
+
+def lookup_entry(path: str, name: str) -> dict | None:
+    """_summary_
+    Returns the manifest of a valid cache entry for the source file, or None if it has to be rebuilt.
+    A changed mtime only invalidates the entry if the content hash has changed as well.
+    Args:
+        path (str): path of the source csv or parquet file
+        name (str): name of the cache entry
+
+    Returns:
+        dict | None: the manifest of the cache entry
+    """
+    parquet_path, manifest_path = _entry_paths(name)
+    manifest = _read_manifest(manifest_path)
+    if manifest is None or not os.path.exists(parquet_path):
+        return None
+
+    stat = os.stat(path)
+    if manifest['mtime_ns'] == stat.st_mtime_ns and manifest['size'] == stat.st_size:
+        return manifest
+    # the file was touched, only rebuild if the contents changed
+    if manifest['size'] == stat.st_size and manifest['content_hash'] == content_hash(path):
+        manifest['mtime_ns'] = stat.st_mtime_ns
+        _write_manifest(manifest_path, manifest)
+        return manifest
+    return None
+
+
+def read_source_chunks(path: str, layer_columns: list[str] | None = None, chunk_rows: int = PARSE_CHUNK_ROWS,
+                       schema: LayerSchema | None = None):
+    """
+    Yield the source file as dataframes of at most chunk_rows rows, parquet files are read by record batch.
+    With a schema only its columns are read, csv columns are parsed straight to their dtypes and the null strings read as nulls
+    """
+    if schema is not None:
+        layer_columns = schema.columns
+    if path.endswith('.parquet'):
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=layer_columns):
+            yield batch.to_pandas()
+        return
+    if schema is None:
+        yield from pd.read_csv(path, usecols=layer_columns, chunksize=chunk_rows)
+        return
+    yield from pd.read_csv(path, usecols=layer_columns, dtype=schema.read_dtypes(), na_values=layer_schema.NULL_VALUES,
+                           keep_default_na=False, chunksize=chunk_rows)
+
+
+def _empty_layer(path: str, layer_columns: list[str] | None, schema: LayerSchema | None, crs: str) -> GeoDataFrame:
+    """
+    Layer without rows with the columns of the source, for sources that yield no chunk at all
+    """
+    if schema is not None:
+        columns = schema.columns
+    elif layer_columns:
+        columns = layer_columns
+    elif path.endswith('.parquet'):
+        columns = pq.read_schema(path).names
+    else:
+        columns = list(pd.read_csv(path, nrows=0).columns)
+    plain_df = pd.DataFrame({c: pd.Series(dtype=object) for c in columns if c != 'geometry'})
+    return GeoDataFrame(plain_df, geometry=gpd.GeoSeries([], crs=crs), crs=crs)
+
+
+def build_entry(path: str, name: str, geo_type: str, layer_columns: list[str] | None = None,
+                src_crs: str = "EPSG:27700", dst_crs: str = "EPSG:4326", schema: LayerSchema | None = None) -> GeoDataFrame:
+    """_summary_
+    Parse and project the source file chunk by chunk and write it to the cache as GeoParquet
+    Args:
+        path (str): path of the source csv or parquet file
+        name (str): name of the cache entry
+        geo_type (str): geometry type passed on to df_to_gdf
+        layer_columns (list[str] | None, optional): columns to keep. Defaults to None.
+        src_crs (str, optional): crs of the source data. Defaults to "EPSG:27700".
+        dst_crs (str, optional): crs the cached layer is stored in. Defaults to "EPSG:4326".
+        schema (LayerSchema | None, optional): columns and dtypes of the layer, replaces layer_columns. Defaults to None.
+
+    Returns:
+        GeoDataFrame: the projected layer
+    """
+    configutils.check_data_output_folder()
+    os.makedirs(LAYER_CACHE_FOLDER, exist_ok=True)
+    stat = os.stat(path)
+    source_hash = content_hash(path)
+
+    chunks = []
+    for plain_df in instrumentation.timed_iter(read_source_chunks(path, layer_columns, schema=schema), "csv_read"):
+        chunk_gdf = proc.df_to_gdf(plain_df, geo_type=geo_type, layer_columns=layer_columns)
+        chunk_gdf.crs = src_crs
+        with instrumentation.stage("reproject"):
+            chunks.append(chunk_gdf.to_crs(dst_crs))
+    if chunks:
+        gdf = GeoDataFrame(pd.concat(chunks, ignore_index=True), geometry='geometry', crs=dst_crs)
+    else:
+        gdf = _empty_layer(path, layer_columns, schema, dst_crs)
+    del chunks
+    if schema is not None:
+        # the categories are built once over the whole layer
+        gdf = GeoDataFrame(schema.apply(gdf), geometry='geometry', crs=dst_crs)
+
+    parquet_path, manifest_path = _entry_paths(name)
+    with instrumentation.stage("layer_cache_write"):
+        _replace_atomically(parquet_path, gdf.to_parquet)
+    _write_manifest(manifest_path, {"source": os.path.abspath(path), "mtime_ns": stat.st_mtime_ns,
+                                    "size": stat.st_size, "content_hash": source_hash,
+                                    "geo_type": geo_type, "layer_columns": layer_columns,
+                                    "src_crs": src_crs, "crs": dst_crs, "rows": len(gdf),
+                                    "schema": schema.key() if schema is not None else None,
+                                    "parser": PARSER_VERSION,
+                                    "memory": layer_schema.memory_usage(gdf)})
+    return gdf
+
+
+def layer_version(manifest: dict) -> str:
+    """
+    Short identifier of the cached layer contents, changes whenever the source file contents change and differs
+    between layers of the same file built with other columns, geometry type, crs, schema or parser version
+    """
+    options = json.dumps({key: manifest.get(key) for key in ("geo_type", "layer_columns", "src_crs", "crs",
+                                                            "schema", "parser")}, sort_keys=True)
+    options_hash = hashlib.sha1(options.encode()).hexdigest()[:8]
+    return f"{manifest['content_hash'][:16]}-{options_hash}"
+
+
+def load_layer(path: str, geo_type: str | None = None, layer_columns: list[str] | None = None,
+               src_crs: str = "EPSG:27700", dst_crs: str = "EPSG:4326", schema: LayerSchema | None = None) -> GeoDataFrame:
+    """_summary_
+    Load a layer from a local csv or parquet file through the disk cache.
+    The returned GeoDataFrame is already in dst_crs and carries its layer version in gdf.attrs['layer_version']
+    Args:
+        path (str): path of the source csv or parquet file
+        geo_type (str | None, optional): geometry type passed on to df_to_gdf. Defaults to the geo_type of the schema.
+        layer_columns (list[str] | None, optional): columns to keep. Defaults to None.
+        src_crs (str, optional): crs of the source data. Defaults to "EPSG:27700".
+        dst_crs (str, optional): crs the cached layer is stored in. Defaults to "EPSG:4326".
+        schema (LayerSchema | None, optional): columns and dtypes of the layer, see utils.layer_schema. Defaults to None.
+
+    Returns:
+        GeoDataFrame: the projected layer
+    """
+    geo_type = geo_type or schema.geo_type
+    name = entry_name(path, geo_type, layer_columns, dst_crs, schema)
+    manifest = lookup_entry(path, name)
+    if manifest is not None:
+        gdf = gpd.read_parquet(_entry_paths(name)[0])
+    else:
+        gdf = build_entry(path, name, geo_type, layer_columns, src_crs, dst_crs, schema)
+        manifest = _read_manifest(_entry_paths(name)[1])
+
+    gdf.attrs['layer_version'] = layer_version(manifest)
+    return gdf
+
+
+def clear_layer_cache() -> int:
+    """
+    Remove every cached layer, returns the number of files deleted
+    """
+    if not os.path.exists(LAYER_CACHE_FOLDER):
+        return 0
+    removed = 0
+    for f_name in os.listdir(LAYER_CACHE_FOLDER):
+        os.remove(os.path.join(LAYER_CACHE_FOLDER, f_name))
+        removed += 1
+    return removed
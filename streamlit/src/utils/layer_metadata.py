@@ -0,0 +1,178 @@
+"""_summary_
+
+Layer metadata computed once per layer version.
+The centroid, bounds, feature and geometry type counts and the extent of every FMZ are computed
+in a single vectorized pass when a layer is loaded or fetched, kept in memory, and written next to the
+cached layers so a restarted server reads them back instead of recomputing them. Selections and fetched layers
+get a new version with every change, so only the MAX_METADATA_FILES most recently used files are kept on disk.
+Layers without a version are computed on every call as the result could not be reused.
+
+"""
+import os
+import hashlib
+import json
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import shapely
+from geopandas import GeoDataFrame
+import utils.layer_cache as layer_cache
+import utils.projection as projection
+
+METADATA_FOLDER = layer_cache.LAYER_CACHE_FOLDER
+GROUP_COLUMNS = ['FMZCODE', 'FMZ1CODE']     # the FMZ column of the mains and of the network meter layers
+MAX_CACHED_METADATA = 64
+MAX_METADATA_FILES = 256
+
+_metadata: OrderedDict = OrderedDict()
+_metadata_lock = threading.Lock()
+
+
+def _group_column(gdf: GeoDataFrame, group_column: str | None) -> str | None:
+    if group_column is not None:
+        return group_column
+    return next((c for c in GROUP_COLUMNS if c in gdf.columns), None)
+
+
+def _lat_lon(x: float, y: float) -> list[float] | None:
+    if np.isnan(x) or np.isnan(y):
+        return None
+    return [round(float(y), 4), round(float(x), 4)]
+
+
+def compute_metadata(gdf: GeoDataFrame, group_column: str | None = None) -> dict:
+    """_summary_
+    Compute the metadata of a layer
+    The centroid is the average of the feature centroids, which are calculated on an equal area projection
+    and converted back to the crs of the layer. Points are their own centroid and are not projected
+    Args:
+        gdf (GeoDataFrame): the layer
+        group_column (str | None, optional): column the extents are grouped by. Defaults to the FMZ column of the layer.
+
+    Returns:
+        dict: count, geometry type counts, bounds (min x, min y, max x, max y), centroid [lat, lon] and
+            the count, bounds and centroid of every group under "extents"
+    """
+    group_column = _group_column(gdf, group_column)
+    metadata = {"count": len(gdf), "geom_types": {}, "bounds": None, "centroid": None,
+                "group_column": group_column, "extents": {}}
+    if len(gdf) == 0:
+        return metadata
+
+    geometries = np.asarray(gdf.geometry.values)
+    bounds = shapely.bounds(geometries)
+    x_arr, y_arr = shapely.get_x(geometries), shapely.get_y(geometries)
+    others = shapely.get_type_id(geometries) != 0
+    if others.any():
+        # the other geometries are projected to an equal area crs for their centroids only, the projected copy is
+        # not kept, and the centroids are transformed back
+        cea_geometries = shapely.transform(geometries[others], lambda coords: np.column_stack(
+            projection.transform(coords[:, 0], coords[:, 1], gdf.crs, '+proj=cea')))
+        centroids = shapely.centroid(cea_geometries)
+        x_arr[others], y_arr[others] = projection.transform(shapely.get_x(centroids), shapely.get_y(centroids),
+                                                            '+proj=cea', gdf.crs)
+
+    metadata["geom_types"] = {k: int(v) for k, v in gdf.geom_type.value_counts().items()}
+    metadata["bounds"] = [float(v) for v in (np.nanmin(bounds[:, 0]), np.nanmin(bounds[:, 1]),
+                                             np.nanmax(bounds[:, 2]), np.nanmax(bounds[:, 3]))]
+    metadata["centroid"] = _lat_lon(np.nanmean(x_arr), np.nanmean(y_arr))
+
+    if group_column is not None:
+        frame = pd.DataFrame({"minx": bounds[:, 0], "miny": bounds[:, 1], "maxx": bounds[:, 2], "maxy": bounds[:, 3],
+                              "x": x_arr, "y": y_arr})
+        extents = frame.groupby(gdf[group_column].to_numpy(), sort=True).agg(
+            count=("x", "size"), minx=("minx", "min"), miny=("miny", "min"),
+            maxx=("maxx", "max"), maxy=("maxy", "max"), x=("x", "mean"), y=("y", "mean"))
+        metadata["extents"] = {str(group): {"count": int(row.count),
+                                            "bounds": [float(row.minx), float(row.miny), float(row.maxx), float(row.maxy)],
+                                            "centroid": _lat_lon(row.x, row.y)}
+                               for group, row in zip(extents.index, extents.itertuples(index=False))}
+    return metadata
+
+
+def _metadata_path(key: tuple) -> str:
+    name = hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]
+    return os.path.join(METADATA_FOLDER, f'{name}.meta.json')
+
+
+def get_metadata(gdf: GeoDataFrame, group_column: str | None = None) -> dict:
+    """_summary_
+    Returns the metadata of a layer, computed on first use and cached by gdf.attrs['layer_version']
+    in memory and on disk
+    Args:
+        gdf (GeoDataFrame): the layer
+        group_column (str | None, optional): column the extents are grouped by. Defaults to the FMZ column of the layer.
+
+    Returns:
+        dict: see compute_metadata
+    """
+    version = gdf.attrs.get('layer_version')
+    group_column = _group_column(gdf, group_column)
+    if version is None:
+        return compute_metadata(gdf, group_column)
+
+    key = (version, len(gdf), group_column)
+    with _metadata_lock:
+        if key in _metadata:
+            _metadata.move_to_end(key)
+            return _metadata[key]
+
+    path = _metadata_path(key)
+    try:
+        with open(path, 'r') as f:
+            metadata = json.load(f)
+        # the file is used again, it is pruned after the ones that were not
+        os.utime(path)
+    except (OSError, ValueError):
+        metadata = compute_metadata(gdf, group_column)
+        _write_metadata(path, metadata)
+
+    with _metadata_lock:
+        _metadata[key] = metadata
+        while len(_metadata) > MAX_CACHED_METADATA:
+            _metadata.popitem(last=False)
+    return metadata
+
+
+def _write_metadata(path: str, metadata: dict):
+    os.makedirs(METADATA_FOLDER, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=METADATA_FOLDER, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(metadata, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    prune_metadata_files()
+
+
+def prune_metadata_files(max_files: int = MAX_METADATA_FILES) -> int:
+    """
+    Remove the least recently used metadata files above max_files, returns the number of files removed
+    """
+    paths = []
+    for f_name in os.listdir(METADATA_FOLDER):
+        if f_name.endswith('.meta.json'):
+            path = os.path.join(METADATA_FOLDER, f_name)
+            try:
+                paths.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+    removed = 0
+    for _, path in sorted(paths, reverse=True)[max_files:]:
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+def clear_metadata_cache():
+    with _metadata_lock:
+        _metadata.clear()
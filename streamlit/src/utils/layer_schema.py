@@ -0,0 +1,125 @@
+"""_summary_
+
+Column schemas of the local GIS layers.
+A schema declares the columns read from the source file and their in-memory dtypes, so only the needed columns are
+parsed and the layer is compact once loaded:
+    - zone and status codes (FMZ, DMA, network codes, meter type, lifecycle status) are categoricals
+    - the 'None' / 'null' / '<Null>' strings of the extracts are read as real nulls
+    - measured attributes (METRICCALCULATED) are float32, ids nullable integers. The SHAPEX / SHAPEY coordinates
+      stay float64, float32 would round British National Grid northings to about 0.06 m
+
+The code columns are read as strings and only turned into categoricals once the chunks of a layer are concatenated,
+so every chunk shares the same categories.
+
+"""
+import hashlib
+import json
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import shapely
+from pandas import DataFrame
+
+NULL_VALUES = ['None', 'null', 'NULL', '<Null>', '']
+READ_AS_STRING = ('category', 'str')       # read as strings, category is applied after the chunks are concatenated
+
+
+@dataclass(frozen=True)
+class LayerSchema:
+    """_summary_
+    Columns and dtypes of a layer, the geometry column is kept as WKT text until df_to_gdf parses it
+    Args:
+        name (str): layer name
+        geo_type (str): geometry type passed on to df_to_gdf
+        dtypes (dict[str, str]): dtype per column, "category", "str", "float32", "Int64", ... and "geometry"
+    """
+    name: str
+    geo_type: str
+    dtypes: dict
+
+    @property
+    def columns(self) -> list[str]:
+        return list(self.dtypes)
+
+    def read_dtypes(self) -> dict[str, str]:
+        """
+        dtypes passed to the csv reader
+        """
+        return {c: (str if d in READ_AS_STRING or d == 'geometry' else d) for c, d in self.dtypes.items()}
+
+    def key(self) -> str:
+        """
+        Short hash of the schema, part of the layer cache entry name so a changed schema rebuilds the cached layer
+        """
+        return hashlib.sha1(json.dumps([self.geo_type, self.dtypes]).encode()).hexdigest()[:12]
+
+    def apply(self, df: DataFrame) -> DataFrame:
+        """_summary_
+        Cast the columns of a loaded layer to the schema, columns missing from the layer are added as nulls
+        Args:
+            df (DataFrame): the layer, a GeoDataFrame keeps its geometry column
+
+        Returns:
+            DataFrame: the layer with the columns in the schema order
+        """
+        df = df.reindex(columns=self.columns)
+        casts = {c: d for c, d in self.dtypes.items() if d not in ('geometry', 'str') and str(df[c].dtype) != d}
+        return df.astype(casts) if casts else df
+
+
+MAINS_SCHEMA = LayerSchema("mains", "MultiLineString", {
+    "GISID": "Int64",
+    "FMZCODE": "category",
+    "DMACODE": "category",
+    "PMACODE": "category",
+    "MAINNAME": "category",
+    "geometry": "geometry",
+    "layer": "category",
+})
+
+NTWK_METER_SCHEMA = LayerSchema("ntwk_meter", "Point", {
+    "FMZ1CODE": "category",
+    "FMZ2CODE": "category",
+    "DMA1CODE": "category",
+    "DMA2CODE": "category",
+    "METRICCALCULATED": "float32",
+    "GISID": "Int64",
+    "TWGUID": "str",
+    "LIFECYCLESTATUS": "category",
+    "NETWORKCODE1": "category",
+    "NETWORKCODE2": "category",
+    "METERTYPE": "category",
+    "SHAPEX": "float64",
+    "SHAPEY": "float64",
+    "geometry": "geometry",
+})
+
+
+def memory_usage(df: DataFrame) -> dict:
+    """_summary_
+    Memory used by a layer. pandas only counts the pointers of a geometry column, the coordinates held by the
+    geometries are estimated at 16 bytes per xy coordinate
+    Args:
+        df (DataFrame): the layer
+
+    Returns:
+        dict: rows, bytes per column and total bytes
+    """
+    columns = {c: int(v) for c, v in df.memory_usage(deep=True, index=False).items()}
+    if 'geometry' in df.columns and len(df):
+        columns['geometry'] += int(shapely.get_num_coordinates(np.asarray(df['geometry'].values)).sum()) * 16
+    return {"rows": len(df), "columns": columns, "total_bytes": sum(columns.values())}
+
+
+def memory_report(layers: dict[str, DataFrame]) -> DataFrame:
+    """
+    Rows, memory and the largest column of every layer, in MB
+    """
+    report = []
+    for name, df in layers.items():
+        usage = memory_usage(df)
+        largest = max(usage['columns'], key=usage['columns'].get) if usage['columns'] else None
+        report.append({"layer": name, "rows": usage['rows'], "memory_mb": round(usage['total_bytes'] / 2**20, 2),
+                       "largest_column": largest})
+    return pd.DataFrame(report)
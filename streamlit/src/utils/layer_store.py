@@ -0,0 +1,297 @@
+"""_summary_
+
+Process wide, read-only store of the layers shared by every session.
+st.cache_data pickles its return value and hands every caller its own copy, and layers kept in st.session_state
+are held once per session, so 20 users viewing the same layer held 20 copies of it. The store keeps a single copy
+of each layer for the streamlit process:
+    - the column arrays of a stored layer are made read-only, an in-place write raises (or copies, with pandas
+      copy-on-write) instead of changing the layer under the other sessions
+    - sessions get shallow views (df.copy(deep=False)), they share the arrays of the stored layer without copying
+      them, and can still add their own columns to the view
+    - every session binds its layers to named slots (e.g. 'ntwk_meter'), the reference count of a layer is the
+      number of sessions bound to it, binding a slot to a new layer releases the previous one
+    - identical contents put by several sessions are stored once, a frame with a new layer version put under the
+      same key replaces the stored one
+    - the memory of every layer is accounted for, unreferenced layers are evicted least recently used first
+      once the store is over AZ_LAYER_STORE_MAX_MB
+
+Sessions that are closed do not say so, their bindings expire after SESSION_TTL seconds without a rerun.
+
+"""
+import os
+import threading
+import time as t
+from collections import OrderedDict
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from pandas import DataFrame
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import utils.layer_cache as layer_cache
+import utils.layer_schema as layer_schema
+from utils.layer_schema import LayerSchema
+
+STORE_MAX_BYTES = int(os.environ.get('AZ_LAYER_STORE_MAX_MB', 2048)) << 20
+SESSION_TTL = float(os.environ.get('AZ_LAYER_STORE_SESSION_TTL', 3600))   # seconds
+LOCAL_SESSION = 'local'         # outside of a streamlit session, e.g. scripts and benchmarks
+
+
+def current_session_id() -> str:
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx is not None else LOCAL_SESSION
+
+
+def freeze(df: DataFrame) -> DataFrame:
+    """
+    Make the column arrays of a frame read-only in place, extension arrays are frozen through their backing arrays
+    """
+    for block in df._mgr.blocks:
+        values = block.values
+        for name in ('_ndarray', '_data', '_mask', '_codes'):
+            backing = getattr(values, name, None)
+            if isinstance(backing, np.ndarray):
+                backing.flags.writeable = False
+        if isinstance(values, np.ndarray):
+            values.flags.writeable = False
+    return df
+
+
+class LayerStore:
+    """_summary_
+    Shared layers of the streamlit process, see the module docstring
+    Args:
+        max_bytes (int, optional): memory above which unreferenced layers are evicted. Defaults to STORE_MAX_BYTES.
+        session_ttl (float, optional): seconds after which the bindings of an idle session expire. Defaults to SESSION_TTL.
+    """
+
+    def __init__(self, max_bytes: int = STORE_MAX_BYTES, session_ttl: float = SESSION_TTL):
+        self.max_bytes = max_bytes
+        self.session_ttl = session_ttl
+        self._layers: OrderedDict = OrderedDict()     # key -> {"df", "bytes", "rows", "created"}, least recently used first
+        self._bindings: dict[str, dict[str, str]] = {}  # session id -> slot -> key
+        self._seen: dict[str, float] = {}
+        self._lock = threading.RLock()
+        self._loading: dict[str, threading.Lock] = {}
+
+    def put(self, key: str, df: DataFrame, replace: bool = False) -> DataFrame:
+        """_summary_
+        Store a layer under a key. A layer already stored under the key is kept and the new frame dropped, unless
+        replace is set or the new frame carries another df.attrs['layer_version'] than the stored one: the new frame
+        then takes its place and the sessions bound to the key see it on their next view.
+        Keys should change with the contents, e.g. include the layer version
+        Args:
+            key (str): _description_
+            df (DataFrame): the layer, it must not be modified by the caller afterwards
+            replace (bool, optional): replace a layer stored under the same key. Defaults to False.
+
+        Returns:
+            DataFrame: the stored layer, read-only
+        """
+        with self._lock:
+            entry = self._layers.get(key)
+            if entry is not None and (entry["df"] is df or not self._is_newer(entry["df"], df, replace)):
+                self._layers.move_to_end(key)
+                return entry["df"]
+        usage = layer_schema.memory_usage(df)
+        freeze(df)
+        with self._lock:
+            entry = self._layers.get(key)
+            if entry is None or self._is_newer(entry["df"], df, replace):
+                self._layers[key] = {"df": df, "bytes": usage['total_bytes'], "rows": usage['rows'],
+                                     "created": t.time()}
+            self._layers.move_to_end(key)
+            stored = self._layers[key]["df"]
+            self._evict(keep=key)
+        return stored
+
+    @staticmethod
+    def _is_newer(stored: DataFrame, df: DataFrame, replace: bool) -> bool:
+        if replace:
+            return stored is not df
+        version = df.attrs.get('layer_version')
+        return version is not None and version != stored.attrs.get('layer_version')
+
+    def get(self, key: str) -> DataFrame | None:
+        """
+        The stored layer of a key, read-only, or None
+        """
+        with self._lock:
+            entry = self._layers.get(key)
+            if entry is None:
+                return None
+            self._layers.move_to_end(key)
+            return entry["df"]
+
+    def get_or_load(self, key: str, loader: Callable[[], DataFrame]) -> DataFrame:
+        """
+        The stored layer of a key, loaded once by a single caller when it is missing while concurrent callers wait for it
+        """
+        stored = self.get(key)
+        if stored is not None:
+            return stored
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+        with key_lock:
+            stored = self.get(key)
+            if stored is None:
+                stored = self.put(key, loader())
+        with self._lock:
+            self._loading.pop(key, None)
+        return stored
+
+    def bind(self, slot: str, key: str, session_id: str | None = None) -> DataFrame | None:
+        """_summary_
+        Bind a slot of a session to a stored layer, the layer previously bound to the slot is released
+        Args:
+            slot (str): name of the slot, e.g. 'ntwk_meter'
+            key (str): key of a stored layer
+            session_id (str | None, optional): _description_. Defaults to the current session.
+
+        Returns:
+            DataFrame | None: a view of the layer, None if the key is not stored
+        """
+        session_id = session_id or current_session_id()
+        with self._lock:
+            self._expire_sessions()
+            if key not in self._layers:
+                return None
+            self._bindings.setdefault(session_id, {})[slot] = key
+            self._seen[session_id] = t.time()
+            self._layers.move_to_end(key)
+            stored = self._layers[key]["df"]
+            self._evict()
+        return stored.copy(deep=False)
+
+    def view(self, slot: str, session_id: str | None = None) -> DataFrame | None:
+        """
+        A view of the layer bound to a slot of the session, or None
+        """
+        session_id = session_id or current_session_id()
+        with self._lock:
+            key = self._bindings.get(session_id, {}).get(slot)
+            self._seen[session_id] = t.time()
+            stored = self.get(key) if key is not None else None
+        return stored.copy(deep=False) if stored is not None else None
+
+    def release(self, slot: str, session_id: str | None = None):
+        session_id = session_id or current_session_id()
+        with self._lock:
+            self._bindings.get(session_id, {}).pop(slot, None)
+            self._evict()
+
+    def release_session(self, session_id: str):
+        with self._lock:
+            self._bindings.pop(session_id, None)
+            self._seen.pop(session_id, None)
+            self._evict()
+
+    def refcounts(self) -> dict[str, int]:
+        """
+        Number of sessions bound to every stored layer
+        """
+        with self._lock:
+            counts = {key: 0 for key in self._layers}
+            for slots in self._bindings.values():
+                for key in set(slots.values()):
+                    if key in counts:
+                        counts[key] += 1
+        return counts
+
+    def stats(self) -> DataFrame:
+        """
+        Rows, memory, reference count and age of every stored layer, most recently used first
+        """
+        refcounts = self.refcounts()
+        with self._lock:
+            now = t.time()
+            rows = [{"key": key, "rows": entry["rows"], "memory_mb": round(entry["bytes"] / 2**20, 2),
+                     "refs": refcounts.get(key, 0), "age_s": round(now - entry["created"])}
+                    for key, entry in reversed(self._layers.items())]
+        return pd.DataFrame(rows, columns=["key", "rows", "memory_mb", "refs", "age_s"])
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            return sum(entry["bytes"] for entry in self._layers.values())
+
+    def clear(self):
+        with self._lock:
+            self._layers.clear()
+            self._bindings.clear()
+            self._seen.clear()
+
+    def _expire_sessions(self):
+        cutoff = t.time() - self.session_ttl
+        for session_id in [s for s, seen in self._seen.items() if seen < cutoff]:
+            self._bindings.pop(session_id, None)
+            self._seen.pop(session_id, None)
+
+    def _evict(self, keep: str | None = None):
+        total = sum(entry["bytes"] for entry in self._layers.values())
+        if total <= self.max_bytes:
+            return
+        bound = {key for slots in self._bindings.values() for key in slots.values()}
+        for key in [key for key in self._layers if key not in bound and key != keep]:
+            if total <= self.max_bytes:
+                break
+            total -= self._layers.pop(key)["bytes"]
+
+
+@st.cache_resource()
+def get_layer_store() -> LayerStore:
+    """
+    One layer store per streamlit process, shared by every session
+    """
+    return LayerStore()
+
+
+def shared_layer(key: str, loader: Callable[[], DataFrame], slot: str | None = None) -> DataFrame:
+    """_summary_
+    A view of a shared layer, loaded into the store on first use, the replacement for st.cache_data on layer loaders
+    Args:
+        key (str): key of the layer in the store
+        loader (Callable[[], DataFrame]): loads the layer when it is not stored
+        slot (str | None, optional): session slot the layer is bound to. Defaults to the key.
+
+    Returns:
+        DataFrame: read-only view of the layer
+    """
+    store = get_layer_store()
+    store.get_or_load(key, loader)
+    return store.bind(slot or key, key)
+
+
+def shared_file_layer(path: str, schema: LayerSchema, slot: str | None = None) -> DataFrame:
+    """_summary_
+    A view of a local layer file loaded through the layer cache and shared by every session.
+    The key follows the mtime and size of the file, so a changed file is loaded again and the old layer released
+    Args:
+        path (str): csv or parquet file
+        schema (LayerSchema): columns and dtypes of the layer
+        slot (str | None, optional): session slot the layer is bound to. Defaults to the schema name.
+
+    Returns:
+        DataFrame: read-only view of the layer
+    """
+    stat = os.stat(path)
+    key = f"{os.path.basename(path)}-{schema.key()}-{stat.st_mtime_ns}-{stat.st_size}"
+    return shared_layer(key, lambda: layer_cache.load_layer(path, schema=schema), slot=slot or schema.name)
+
+
+def render_store_panel():
+    """
+    Sidebar panel with the layers of the store, their memory and reference counts
+    """
+    store = get_layer_store()
+    with st.sidebar.expander(f"Shared layers: {store.total_bytes / 2**20:.1f} MB", expanded=False):
+        st.dataframe(store.stats().set_index("key"), use_container_width=True)
+
+
+def render_memory_panel(layers: dict[str, DataFrame]):
+    """
+    Sidebar panel with the memory used by the loaded layers of the page
+    """
+    with st.sidebar.expander("Layer memory", expanded=False):
+        st.dataframe(layer_schema.memory_report(layers).set_index("layer"), use_container_width=True)
@@ -0,0 +1,134 @@
+"""_summary_
+
+Zoom dependent level of detail for line layers (the mains).
+A pyramid of simplified copies is built once per layer version with topology preserving simplification,
+each level is simplified to half a screen pixel at its zoom level, so the rendered map looks the same
+while most of the sub-pixel vertices are dropped from the GeoJSON at low zooms.
+
+"""
+import math
+import threading
+from collections import OrderedDict
+
+import shapely
+import streamlit as st
+from geopandas import GeoDataFrame
+
+# zoom levels that get a simplified copy, above the last one the full resolution layer is used
+LOD_ZOOM_LEVELS = [8, 10, 12, 14]
+TILE_SIZE = 256
+PIXEL_TOLERANCE = 0.5
+MAX_CACHED_PYRAMIDS = 8
+
+_pyramids: OrderedDict = OrderedDict()
+_pyramids_lock = threading.Lock()
+
+
+def zoom_tolerance(zoom: int, pixel_tolerance: float = PIXEL_TOLERANCE) -> float:
+    """
+    Simplification tolerance in degrees that matches the given fraction of a screen pixel at a web mercator zoom level
+    """
+    degrees_per_pixel = 360 / (TILE_SIZE * 2 ** zoom)
+    return degrees_per_pixel * pixel_tolerance
+
+
+def fit_zoom(bounds: list[float], width: int, height: int) -> int:
+    """
+    Zoom level at which the bounds (min lon, min lat, max lon, max lat) fill a map of the given size in pixels,
+    used as the opening zoom before the map has reported its own
+    """
+    min_x, min_y, max_x, max_y = bounds
+    lon_span = max(max_x - min_x, 1e-9)
+    # latitude span in mercator units, scaled to degrees of longitude
+    merc_span = max(math.degrees(math.log(math.tan(math.pi / 4 + math.radians(max_y) / 2)) -
+                                 math.log(math.tan(math.pi / 4 + math.radians(min_y) / 2))), 1e-9)
+    zoom_x = math.log2(360 * width / (TILE_SIZE * lon_span))
+    zoom_y = math.log2(360 * height / (TILE_SIZE * merc_span))
+    return max(0, math.floor(min(zoom_x, zoom_y)))
+
+
+def build_lod_pyramid(gdf: GeoDataFrame, zoom_levels: list[int] | None = None) -> dict[int, GeoDataFrame]:
+    """_summary_
+    Build the simplified copies of a layer, one per zoom level
+    Args:
+        gdf (GeoDataFrame): layer in EPSG:4326
+        zoom_levels (list[int] | None, optional): zoom levels to build. Defaults to LOD_ZOOM_LEVELS.
+
+    Returns:
+        dict[int, GeoDataFrame]: simplified layer per zoom level
+    """
+    zoom_levels = zoom_levels or LOD_ZOOM_LEVELS
+    geometries = gdf.geometry.values
+    pyramid = {}
+    for zoom in sorted(zoom_levels):
+        # the attribute columns are shared with the layer, only the geometry column of a level is new
+        level = gdf.copy(deep=False)
+        tolerance = zoom_tolerance(zoom)
+        simplified = shapely.simplify(geometries, tolerance, preserve_topology=True)
+        # snapping the coordinates to a decimal grid well below the tolerance also shortens every number written to the GeoJSON
+        grid_size = 10 ** math.floor(math.log10(tolerance / 10))
+        level['geometry'] = shapely.set_precision(simplified, grid_size=grid_size, mode='pointwise')
+        if 'layer_version' in gdf.attrs:
+            # every level is a layer of its own for the projection and viewport caches
+            level.attrs['layer_version'] = f"{gdf.attrs['layer_version']}-lod{zoom}"
+        pyramid[zoom] = level
+    return pyramid
+
+
+def get_lod_pyramid(gdf: GeoDataFrame, zoom_levels: list[int] | None = None) -> dict[int, GeoDataFrame] | None:
+    """
+    Returns the pyramid of a layer, built on first use and cached by gdf.attrs['layer_version'].
+    Layers without a version are not simplified as the pyramid could not be reused
+    """
+    version = gdf.attrs.get('layer_version')
+    if version is None:
+        return None
+    key = (version, len(gdf), tuple(zoom_levels or LOD_ZOOM_LEVELS))
+    with _pyramids_lock:
+        if key in _pyramids:
+            _pyramids.move_to_end(key)
+            return _pyramids[key]
+
+    pyramid = build_lod_pyramid(gdf, zoom_levels)
+    with _pyramids_lock:
+        _pyramids[key] = pyramid
+        while len(_pyramids) > MAX_CACHED_PYRAMIDS:
+            _pyramids.popitem(last=False)
+    return pyramid
+
+
+def select_lod(gdf: GeoDataFrame, zoom: int | float | None, zoom_levels: list[int] | None = None) -> GeoDataFrame:
+    """_summary_
+    Returns the copy of the layer to render at the given zoom, the coarsest level that is still
+    accurate to half a pixel at that zoom, or the full resolution layer when zoomed in past the pyramid
+    Args:
+        gdf (GeoDataFrame): full resolution layer in EPSG:4326
+        zoom (int | float | None): current zoom level of the map
+        zoom_levels (list[int] | None, optional): zoom levels of the pyramid. Defaults to LOD_ZOOM_LEVELS.
+
+    Returns:
+        GeoDataFrame: the layer to render
+    """
+    if zoom is None:
+        return gdf
+    pyramid = get_lod_pyramid(gdf, zoom_levels)
+    if pyramid is None:
+        return gdf
+    for level_zoom in sorted(pyramid):
+        if level_zoom >= zoom:
+            return pyramid[level_zoom]
+    return gdf
+
+
+def lod_controls() -> bool:
+    """
+    Sidebar switch for the zoom dependent level of detail of the mains layer
+    """
+    return st.sidebar.checkbox("Mains level of detail", value=False,
+                               help="Render simplified mains at low zoom levels, the map is refreshed after zooming "
+                                    "but not after panning")
+
+
+def clear_lod_cache():
+    with _pyramids_lock:
+        _pyramids.clear()
@@ -0,0 +1,166 @@
+"""_summary_
+
+Shared rendering helpers for the map layers of both pages.
+Network meters can be rendered as exact folium Markers (one DOM element per meter) or in a fast mode
+that builds the layer in bulk from coordinate arrays:
+    cluster: client side clustering with FastMarkerCluster
+    canvas: circle markers drawn on a canvas renderer through a single GeoJson layer
+Layers served by the local tile service (utils/tile_server.py) are added with VectorTileLayer.
+
+"""
+import folium
+import pandas as pd
+import streamlit as st
+from folium.elements import JSCSSMixin
+from folium.map import Layer
+from folium.plugins import FastMarkerCluster
+from folium.features import GeoJsonPopup
+from geopandas import GeoDataFrame
+from jinja2 import Template
+
+# above this number of selected meters the 'auto' mode switches to a fast mode
+FAST_MARKER_THRESHOLD = 500
+RENDER_MODES = ['auto', 'exact', 'cluster', 'canvas']
+
+# css values of the folium.Icon colour names used for the meter markers
+MARKER_CSS_COLORS = {
+    "cadetblue": "#436978",
+    "purple": "#D252B9",
+    "darkgreen": "#728224",
+    "lightgreen": "#BBF970",
+    "pink": "#FF91EA",
+    "lightred": "#FF8E7F",
+    "lightblue": "#8ADAFF",
+    "darkred": "#A23336",
+    "darkpurple": "#5B396B",
+}
+
+CIRCLE_MARKER_CALLBACK = """
+    function (row) {
+        var marker = L.circleMarker(new L.LatLng(row[0], row[1]),
+            {radius: 6, color: row[3], fillColor: row[3], fillOpacity: 0.8, weight: 1});
+        marker.bindPopup(row[2]);
+        return marker;
+    }
+"""
+
+
+def resolve_render_mode(mode: str, n_points: int, threshold: int = FAST_MARKER_THRESHOLD) -> str:
+    """
+    Returns the rendering mode to use, 'auto' picks exact markers below the threshold and clustering above it
+    """
+    if mode not in RENDER_MODES:
+        raise ValueError(f"Unknown render mode {mode}, expected one of {RENDER_MODES}")
+    if mode == 'auto':
+        return 'cluster' if n_points > threshold else 'exact'
+    return mode
+
+
+def meter_popups(ntwkm_gdf: GeoDataFrame) -> pd.Series:
+    """
+    Builds the popup html of every meter in one vectorized string operation
+    """
+    return ("<h4>Network ID: " + ntwkm_gdf['NETWORKCODE1'].astype(str) +
+            " </h4><p>LifeCycle Status: " + ntwkm_gdf['LIFECYCLESTATUS'].astype(str) +
+            "</p><p>Metric: " + ntwkm_gdf['METRICCALCULATED'].astype(str) + "</p>")
+
+
+def build_meter_cluster(fmz_gdf: GeoDataFrame, icon_color: str) -> FastMarkerCluster:
+    """_summary_
+    Builds a client side clustered layer of circle markers from the coordinate arrays of the layer
+    Args:
+        fmz_gdf (GeoDataFrame): meters of a single FMZ in EPSG:4326
+        icon_color (str): folium.Icon colour name of the FMZ
+
+    Returns:
+        FastMarkerCluster: the clustered marker layer
+    """
+    css_color = MARKER_CSS_COLORS.get(icon_color, icon_color)
+    data = pd.DataFrame({"lat": fmz_gdf.geometry.y.values, "lon": fmz_gdf.geometry.x.values,
+                         "popup": meter_popups(fmz_gdf).values, "color": css_color})
+    return FastMarkerCluster(data=data.values.tolist(), callback=CIRCLE_MARKER_CALLBACK)
+
+
+def build_meter_canvas(fmz_gdf: GeoDataFrame, icon_color: str) -> folium.GeoJson:
+    """_summary_
+    Builds a single GeoJson layer of circle markers, drawn on a canvas when the map is created with prefer_canvas=True
+    Args:
+        fmz_gdf (GeoDataFrame): meters of a single FMZ in EPSG:4326
+        icon_color (str): folium.Icon colour name of the FMZ
+
+    Returns:
+        folium.GeoJson: the circle marker layer
+    """
+    css_color = MARKER_CSS_COLORS.get(icon_color, icon_color)
+    popup_fields = ['NETWORKCODE1', 'LIFECYCLESTATUS', 'METRICCALCULATED']
+    # only the popup fields are serialised into the GeoJSON properties
+    points = fmz_gdf[popup_fields + ['geometry']].copy()
+    points[popup_fields] = points[popup_fields].astype(str)
+    return folium.GeoJson(points,
+                          marker=folium.CircleMarker(radius=5, fill=True, fill_opacity=0.8, weight=1),
+                          style_function=lambda x: {"color": css_color, "fillColor": css_color},
+                          popup=GeoJsonPopup(fields=popup_fields, aliases=['Network ID', 'LifeCycle Status', 'Metric'], labels=True))
+
+
+def meter_render_controls() -> tuple[str, int]:
+    """
+    Sidebar switch between exact markers and the fast rendering modes, returns the mode and the auto threshold
+    """
+    st.sidebar.markdown("**Network Meter Rendering**")
+    mode = st.sidebar.radio("Marker mode", RENDER_MODES, index=0,
+                            help="'auto' uses exact markers below the threshold and clustering above it")
+    threshold = int(st.sidebar.number_input("Fast mode threshold (points)", min_value=0,
+                                            value=FAST_MARKER_THRESHOLD, step=100))
+    return mode, threshold
+
+
+class VectorTileLayer(JSCSSMixin, Layer):
+    """_summary_
+    Leaflet.VectorGrid layer that reads Mapbox Vector Tiles from the local tile service.
+    Args:
+        url (str): tile url template, e.g. tile_server.tile_url('mains')
+        layer_name (str): name of the MVT layer inside the tiles
+        style (dict): Leaflet path options of the features, points use 'radius' as circle markers
+        popup_fields (list[str] | None, optional): properties shown when a feature is clicked. Defaults to None.
+        name (str | None, optional): name in the layer control. Defaults to None.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+            var {{ this.get_name() }} = L.vectorGrid.protobuf({{ this.url|tojson }}, {
+                rendererFactory: L.canvas.tile,
+                interactive: true,
+                maxNativeZoom: 18,
+                vectorTileLayerStyles: { {{ this.mvt_layer|tojson }}: {{ this.style|tojson }} }
+            });
+            {%- if this.popup_fields %}
+            {{ this.get_name() }}.on('click', function (e) {
+                var props = e.layer.properties;
+                var fields = {{ this.popup_fields|tojson }};
+                var html = fields.map(function (f) { return '<b>' + f + '</b>: ' + props[f]; }).join('<br>');
+                L.popup().setContent(html).setLatLng(e.latlng).openOn({{ this._parent.get_name() }});
+            });
+            {%- endif %}
+            {{ this.get_name() }}.addTo({{ this._parent.get_name() }});
+        {% endmacro %}""")
+
+    default_js = [("leaflet.vectorgrid",
+                   "https://unpkg.com/leaflet.vectorgrid@1.3.0/dist/Leaflet.VectorGrid.bundled.min.js")]
+
+    def __init__(self, url: str, layer_name: str, style: dict, popup_fields: list[str] | None = None,
+                 name: str | None = None, overlay: bool = True, control: bool = True, show: bool = True):
+        super().__init__(name=name, overlay=overlay, control=control, show=show)
+        self._name = "VectorTileLayer"
+        self.url = url
+        self.mvt_layer = layer_name
+        self.style = style
+        self.popup_fields = popup_fields or []
+
+
+def vector_tile_controls() -> bool:
+    """
+    Sidebar switch that serves the mains and meters from the local vector tile service instead of inline GeoJSON
+    """
+    return st.sidebar.checkbox("Vector tiles", value=False,
+                               help="Stream the layers as vector tiles from a local tile service, for layers too large to inline in the page. "
+                                    "The browser loads the tiles from the server host, set TILE_SERVER_PUBLIC_URL to the proxied "
+                                    "tile service url when the app is opened from another machine")
@@ -0,0 +1,114 @@
+"""_summary_
+
+Partition index of a layer by zone code (FMZ, DMA, PMA).
+One groupby pass maps every code of a column to the positions of its rows, the index is cached per layer version.
+Selecting any combination of codes is then a concatenation of precomputed position arrays
+instead of a full column scan per code.
+
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from geopandas import GeoDataFrame
+
+MAX_CACHED_INDEXES = 32
+
+_indexes: OrderedDict = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def build_partition_index(gdf: GeoDataFrame, column: str) -> dict[str, np.ndarray]:
+    """
+    Positions of the rows of every code in the column, rows without a code are left out
+    """
+    return {str(code): positions for code, positions in gdf.groupby(column, sort=False, observed=True).indices.items()}
+
+
+def get_partition_index(gdf: GeoDataFrame, column: str) -> dict[str, np.ndarray]:
+    """_summary_
+    Returns the partition index of a layer column, built on first use and cached by gdf.attrs['layer_version'].
+    Layers without a version are indexed on every call
+    Args:
+        gdf (GeoDataFrame): the layer
+        column (str): code column, e.g. 'FMZCODE' or 'FMZ1CODE'
+
+    Returns:
+        dict[str, np.ndarray]: row positions per code
+    """
+    version = gdf.attrs.get('layer_version')
+    if version is None:
+        return build_partition_index(gdf, column)
+
+    key = (version, len(gdf), column)
+    with _indexes_lock:
+        if key in _indexes:
+            _indexes.move_to_end(key)
+            return _indexes[key]
+
+    index = build_partition_index(gdf, column)
+    with _indexes_lock:
+        _indexes[key] = index
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def select_positions(gdf: GeoDataFrame, column: str, codes: list[str]) -> np.ndarray:
+    """
+    Row positions of the given codes, grouped by code in the order of the codes
+    """
+    index = get_partition_index(gdf, column)
+    parts = [index[code] for code in dict.fromkeys(codes) if code in index]
+    if not parts:
+        return np.empty(0, dtype=np.intp)
+    return np.concatenate(parts)
+
+
+def select(gdf: GeoDataFrame, column: str, codes: list[str]) -> GeoDataFrame:
+    """_summary_
+    Rows of the given codes, like gdf[gdf[column].isin(codes)] without scanning the column.
+    The selection is a layer of its own for the version keyed caches
+    Args:
+        gdf (GeoDataFrame): the layer
+        column (str): code column
+        codes (list[str]): codes to keep
+
+    Returns:
+        GeoDataFrame: the selected rows
+    """
+    selected = gdf.take(select_positions(gdf, column, codes))
+    version = gdf.attrs.get('layer_version')
+    if version is not None:
+        selected.attrs['layer_version'] = f"{version}-{','.join(sorted(set(codes)))}"
+    return selected
+
+
+def partitions(gdf: GeoDataFrame, column: str, codes: list[str] | None = None) -> dict[str, GeoDataFrame]:
+    """_summary_
+    One layer per code, every code of the column when no codes are given.
+    Codes without rows get an empty layer
+    Args:
+        gdf (GeoDataFrame): the layer
+        column (str): code column
+        codes (list[str] | None, optional): codes to split out. Defaults to None.
+
+    Returns:
+        dict[str, GeoDataFrame]: layer per code, each with its own layer version
+    """
+    index = get_partition_index(gdf, column)
+    version = gdf.attrs.get('layer_version')
+    parts = {}
+    for code in (codes if codes is not None else index):
+        part = gdf.take(index.get(code, np.empty(0, dtype=np.intp)))
+        if version is not None:
+            part.attrs['layer_version'] = f"{version}-{code}"
+        else:
+            part.attrs.pop('layer_version', None)
+        parts[code] = part
+    return parts
+
+
+def clear_partition_cache():
+    with _indexes_lock:
+        _indexes.clear()
@@ -0,0 +1,179 @@
+"""_summary_
+
+Projection stage for the map layers.
+Keeps one pyproj Transformer per (source crs, target crs) pair and caches reprojected layers
+by layer version and target crs, so a Streamlit rerun does not reproject a layer it has already seen.
+Point layers can skip building shapely geometries from WKT and go through transform() on the raw coordinate arrays.
+
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Any
+
+import numpy as np
+import pandas as pd
+import shapely
+import geopandas as gpd
+from geopandas import GeoDataFrame
+from pyproj import CRS, Transformer
+import utils.instrumentation as instrumentation
+
+MAX_CACHED_LAYERS = 16      # number of projected layers kept in memory
+
+_projected_layers: OrderedDict = OrderedDict()
+_projected_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def get_transformer(src_crs: str, dst_crs: str) -> Transformer:
+    """
+    Returns a reusable transformer between two crs, coordinates are always in (x, y) / (lon, lat) order
+    """
+    return Transformer.from_crs(CRS.from_user_input(src_crs), CRS.from_user_input(dst_crs), always_xy=True)
+
+
+def transform(x: Any, y: Any, src_crs: str = "EPSG:27700", dst_crs: str = "EPSG:4326") -> tuple[np.ndarray, np.ndarray]:
+    """_summary_
+    Vectorized transform of coordinate arrays, no geometry objects are created
+    Args:
+        x (Any): array of x coordinates (eastings / longitudes)
+        y (Any): array of y coordinates (northings / latitudes)
+        src_crs (str, optional): crs of the input coordinates. Defaults to "EPSG:27700".
+        dst_crs (str, optional): crs of the output coordinates. Defaults to "EPSG:4326".
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the transformed x and y arrays
+    """
+    transformer = get_transformer(_crs_key(src_crs), _crs_key(dst_crs))
+    x_out, y_out = transformer.transform(np.asarray(x, dtype='float64'), np.asarray(y, dtype='float64'))
+    return np.asarray(x_out), np.asarray(y_out)
+
+
+def _crs_key(crs: Any) -> str:
+    # hashable representation of a crs so it can be used as a cache key
+    if isinstance(crs, str):
+        return crs
+    return CRS.from_user_input(crs).to_string()
+
+
+def frame_version(df: pd.DataFrame, columns: list[str] | None = None) -> str:
+    """
+    Content based version for a dataframe that did not come from the layer cache (e.g. a Databricks response).
+    The digest runs over the column names and the row hashes in order, so any changed value, column or row order
+    gives a new version
+    """
+    subset = df[columns] if columns else df
+    try:
+        hashed = pd.util.hash_pandas_object(subset, index=False)
+    except TypeError:
+        # object columns holding unhashable values (e.g. lists) are hashed through their text
+        hashed = pd.util.hash_pandas_object(subset.astype(str), index=False)
+    digest = hashlib.sha1('\x1f'.join(map(str, subset.columns)).encode())
+    digest.update(hashed.to_numpy().tobytes())
+    return f'{len(subset)}-{digest.hexdigest()[:16]}'
+
+
+@instrumentation.timed_stage("reproject")
+def _project_geometries(gdf: GeoDataFrame, dst_crs: str) -> GeoDataFrame:
+    src_crs = _crs_key(gdf.crs)
+    geometries = gdf.geometry.values
+    if len(gdf) and (shapely.get_type_id(np.asarray(geometries)) == 0).all():
+        # point layers only need their coordinate arrays transformed
+        coords = shapely.get_coordinates(np.asarray(geometries))
+        x, y = transform(coords[:, 0], coords[:, 1], src_crs, dst_crs)
+        projected = gdf.copy()
+        projected['geometry'] = gpd.GeoSeries(shapely.points(x, y), index=gdf.index, crs=dst_crs)
+        return projected.set_crs(dst_crs, allow_override=True)
+    return gdf.to_crs(dst_crs)
+
+
+def project_layer(gdf: GeoDataFrame, dst_crs: str = "EPSG:4326", layer_version: str | None = None) -> GeoDataFrame:
+    """_summary_
+    Reproject a layer, reusing the cached result for the same layer version and target crs.
+    Without a layer version (argument or gdf.attrs['layer_version']) the layer is projected but not cached.
+    Args:
+        gdf (GeoDataFrame): layer with its crs set
+        dst_crs (str, optional): target crs. Defaults to "EPSG:4326".
+        layer_version (str | None, optional): version of the layer contents. Defaults to None.
+
+    Returns:
+        GeoDataFrame: the layer in the target crs, treat it as read only as it is shared between reruns
+    """
+    if gdf.crs is None:
+        raise ValueError("The layer has no crs set, set it before projecting")
+    if gdf.crs == CRS.from_user_input(dst_crs):
+        return gdf
+
+    version = layer_version or gdf.attrs.get('layer_version')
+    if version is None:
+        return _project_geometries(gdf, dst_crs)
+
+    key = (version, len(gdf), _crs_key(gdf.crs), _crs_key(dst_crs))
+    projected = _cache_get(key)
+    if projected is None:
+        projected = _project_geometries(gdf, dst_crs)
+        projected.attrs['layer_version'] = version
+        _cache_put(key, projected)
+    return projected
+
+
+def _cache_get(key: tuple) -> GeoDataFrame | None:
+    with _projected_lock:
+        if key in _projected_layers:
+            _projected_layers.move_to_end(key)
+            return _projected_layers[key]
+    return None
+
+
+def _cache_put(key: tuple, gdf: GeoDataFrame):
+    with _projected_lock:
+        _projected_layers[key] = gdf
+        while len(_projected_layers) > MAX_CACHED_LAYERS:
+            _projected_layers.popitem(last=False)
+
+
+def points_from_xy(df: pd.DataFrame, x_col: str = 'SHAPEX', y_col: str = 'SHAPEY',
+                   layer_columns: list[str] | None = None,
+                   src_crs: str = "EPSG:27700", dst_crs: str = "EPSG:4326",
+                   layer_version: str | None = None) -> GeoDataFrame | None:
+    """_summary_
+    Build a projected point layer straight from its coordinate columns, without parsing the WKT geometry column.
+    Returns None if any coordinate is missing so the caller can fall back to data_processor.df_to_gdf
+    Args:
+        df (pd.DataFrame): dataframe holding the coordinate columns
+        x_col (str, optional): column of x coordinates. Defaults to 'SHAPEX'.
+        y_col (str, optional): column of y coordinates. Defaults to 'SHAPEY'.
+        layer_columns (list[str] | None, optional): columns to keep, the geometry column is replaced. Defaults to None.
+        src_crs (str, optional): crs of the coordinate columns. Defaults to "EPSG:27700".
+        dst_crs (str, optional): crs of the returned layer. Defaults to "EPSG:4326".
+        layer_version (str | None, optional): version of the dataframe, caches the result when given. Defaults to None.
+
+    Returns:
+        GeoDataFrame | None: the projected point layer
+    """
+    key = (layer_version, 'xy', _crs_key(src_crs), _crs_key(dst_crs))
+    if layer_version is not None:
+        cached = _cache_get(key)
+        if cached is not None:
+            return cached
+
+    x = pd.to_numeric(df[x_col], errors='coerce').to_numpy(dtype='float64')
+    y = pd.to_numeric(df[y_col], errors='coerce').to_numpy(dtype='float64')
+    if np.isnan(x).any() or np.isnan(y).any():
+        return None
+
+    columns = [c for c in (layer_columns or df.columns) if c != 'geometry']
+    attributes = df[columns].dropna(axis=1, how='all')
+    lon, lat = transform(x, y, src_crs, dst_crs)
+    gdf = GeoDataFrame(attributes, geometry=shapely.points(lon, lat), crs=dst_crs)
+    if layer_version is not None:
+        gdf.attrs['layer_version'] = layer_version
+        _cache_put(key, gdf)
+    return gdf
+
+
+def clear_projection_cache():
+    with _projected_lock:
+        _projected_layers.clear()
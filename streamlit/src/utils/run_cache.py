@@ -0,0 +1,180 @@
+"""_summary_
+
+Persistent cache of notebook run results.
+The decoded dataframe of a successful run is stored as parquet under a canonical hash of
+(notebook path, sorted notebook parameters, source version), so the same request is served from disk
+after a server restart or by another server replica sharing the cache folder instead of being submitted again.
+
+Entries expire after a TTL, and the least recently used entries are evicted once the folder grows over a size limit.
+Bump AZ_GIS_SOURCE_VERSION when the GIS source tables are refreshed to invalidate every entry at once.
+
+"""
+import os
+import hashlib
+import json
+import logging
+import tempfile
+import time as t
+
+import pandas as pd
+from pandas import DataFrame
+import utils.config as configutils
+
+RUN_CACHE_FOLDER = os.path.join(configutils.CACHE_FOLDER, 'runs')
+RUN_CACHE_TTL = float(os.environ.get('AZ_RUN_CACHE_TTL', 24 * 3600))        # seconds
+RUN_CACHE_MAX_BYTES = int(os.environ.get('AZ_RUN_CACHE_MAX_MB', 512)) << 20
+SOURCE_VERSION = os.environ.get('AZ_GIS_SOURCE_VERSION', '')
+
+logger = logging.getLogger(__name__)
+
+
+def cache_key(notebook_path: str, params: dict | None = None, source_version: str | None = None) -> str:
+    """
+    Canonical hash of a notebook request, the order of the parameters does not matter
+    """
+    key = json.dumps({"notebook": notebook_path,
+                      "params": sorted((str(k), str(v)) for k, v in (params or {}).items()),
+                      "source_version": SOURCE_VERSION if source_version is None else source_version},
+                     sort_keys=True)
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+def _entry_paths(key: str) -> tuple[str, str]:
+    return (os.path.join(RUN_CACHE_FOLDER, f'{key}.parquet'),
+            os.path.join(RUN_CACHE_FOLDER, f'{key}.json'))
+
+
+def _remove_entry(key: str):
+    for path in _entry_paths(key):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def get_result(key: str, ttl: float = RUN_CACHE_TTL) -> DataFrame | None:
+    """_summary_
+    Returns the cached result of a request, or None if there is no entry or it is older than the ttl
+    Args:
+        key (str): from cache_key
+        ttl (float, optional): maximum age of the entry in seconds. Defaults to RUN_CACHE_TTL.
+
+    Returns:
+        DataFrame | None: the cached dataframe
+    """
+    parquet_path, manifest_path = _entry_paths(key)
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+        if t.time() - manifest['created'] > ttl:
+            _remove_entry(key)
+            return None
+        result_df = pd.read_parquet(parquet_path)
+    except (OSError, ValueError, KeyError):
+        # missing, partially written or removed by another replica
+        return None
+    # the manifest mtime is the last access time used for eviction
+    os.utime(manifest_path)
+    return result_df
+
+
+def put_result(key: str, result_df: DataFrame, notebook_path: str, params: dict | None = None,
+               source_version: str | None = None, run_id: int | None = None) -> bool:
+    """_summary_
+    Store the result of a successful run, returns False if the dataframe cannot be written as parquet
+    Args:
+        key (str): from cache_key
+        result_df (DataFrame): decoded run output
+        notebook_path (str): _description_
+        params (dict | None, optional): _description_. Defaults to None.
+        source_version (str | None, optional): _description_. Defaults to SOURCE_VERSION.
+        run_id (int | None, optional): run the result came from. Defaults to None.
+
+    Returns:
+        bool: whether the result was cached
+    """
+    configutils.check_data_output_folder()
+    os.makedirs(RUN_CACHE_FOLDER, exist_ok=True)
+    parquet_path, manifest_path = _entry_paths(key)
+    try:
+        _replace_atomically(parquet_path, result_df.to_parquet)
+    except (ValueError, TypeError) as e:
+        # mixed type object columns can not be written, the request is simply not cached
+        logger.warning("Run result of %s not cached: %s", notebook_path, e)
+        return False
+
+    manifest = {"notebook": notebook_path, "params": params, "run_id": run_id, "rows": len(result_df),
+                "source_version": SOURCE_VERSION if source_version is None else source_version, "created": t.time()}
+
+    def write_manifest(tmp_path: str):
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=4)
+    _replace_atomically(manifest_path, write_manifest)
+    evict()
+    return True
+
+
+def _replace_atomically(path: str, write):
+    """
+    Write a file through a temp file of its own in the same folder, the runs of several threads writing the same
+    entry never share a temp file and a failed write leaves the previous file in place
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + '.', suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def evict(max_bytes: int = RUN_CACHE_MAX_BYTES, ttl: float = RUN_CACHE_TTL) -> int:
+    """
+    Remove expired entries, then the least recently used ones until the cache fits in max_bytes. Returns the entries removed
+    """
+    if not os.path.exists(RUN_CACHE_FOLDER):
+        return 0
+    now = t.time()
+    entries = []
+    for f_name in os.listdir(RUN_CACHE_FOLDER):
+        if not f_name.endswith('.json'):
+            continue
+        key = f_name[:-len('.json')]
+        parquet_path, manifest_path = _entry_paths(key)
+        try:
+            with open(manifest_path, 'r') as f:
+                created = json.load(f)['created']
+            entries.append((os.path.getmtime(manifest_path), key, created, os.path.getsize(parquet_path)))
+        except (OSError, ValueError, KeyError):
+            continue
+
+    removed = 0
+    total = 0
+    kept = []
+    for last_used, key, created, size in sorted(entries):
+        if now - created > ttl:
+            _remove_entry(key)
+            removed += 1
+        else:
+            kept.append((key, size))
+            total += size
+    for key, size in kept:
+        if total <= max_bytes:
+            break
+        _remove_entry(key)
+        total -= size
+        removed += 1
+    return removed
+
+
+def clear_run_cache() -> int:
+    """
+    Remove every cached run result, returns the number of files deleted
+    """
+    if not os.path.exists(RUN_CACHE_FOLDER):
+        return 0
+    removed = 0
+    for f_name in os.listdir(RUN_CACHE_FOLDER):
+        os.remove(os.path.join(RUN_CACHE_FOLDER, f_name))
+        removed += 1
+    return removed
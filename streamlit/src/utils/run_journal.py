@@ -0,0 +1,211 @@
+"""_summary_
+
+Append-only journal of the Databricks runs.
+Every state change of a tracked run is appended as one compact JSON line to ../output/runs/journal.ndjson,
+and the final run response is written once, gzip compressed, to a file named after its run id.
+The writes happen on a background writer thread so the poller never blocks on disk, and concurrent
+sessions or replicas never overwrite each other's files.
+
+read_history rebuilds the latest state of the most recent runs from the tail of the journal alone, the file is read
+backwards from its end so the cost follows the number of runs shown and not the age of the journal, and the large
+payloads are only read on request with read_payload. The journal is rotated to journal.1.ndjson once it grows
+over AZ_RUN_JOURNAL_MAX_MB, a single rotated file is kept, and the payloads of the runs that leave both files
+with a rotation are deleted.
+
+"""
+import os
+import gzip
+import json
+import logging
+import queue
+import threading
+import time as t
+
+import pandas as pd
+import streamlit as st
+import utils.config as configutils
+
+JOURNAL_FOLDER = os.path.join(configutils.OUTPUT_FOLDER, 'runs')
+JOURNAL_FILE = 'journal.ndjson'
+ROTATED_JOURNAL_FILE = 'journal.1.ndjson'
+JOURNAL_MAX_BYTES = int(os.environ.get('AZ_RUN_JOURNAL_MAX_MB', 16)) << 20
+TAIL_BLOCK_SIZE = 1 << 16       # bytes read at a time from the end of the journal
+RECORDS_PER_RUN = 8             # journal lines scanned per run shown, a run records a handful of state changes
+
+logger = logging.getLogger(__name__)
+
+
+def payload_path(run_id: int, folder: str = JOURNAL_FOLDER) -> str:
+    return os.path.join(folder, f'run_{run_id}.json.gz')
+
+
+class RunJournal:
+    """_summary_
+    Writes run records and payloads from a background thread
+    Args:
+        folder (str, optional): folder of the journal and the payloads. Defaults to JOURNAL_FOLDER.
+    """
+
+    def __init__(self, folder: str = JOURNAL_FOLDER, max_bytes: int = JOURNAL_MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.journal_path = os.path.join(folder, JOURNAL_FILE)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._writer, name="run-journal-writer", daemon=True)
+        self._thread.start()
+
+    def record(self, summary: dict):
+        """
+        Append the state of a run, the summary is the TrackedRun.summary() of the run
+        """
+        self._queue.put(("record", {"ts": round(t.time(), 3), **summary}))
+
+    def save_payload(self, run_id: int, payload: dict):
+        """
+        Write the final response of a run, compressed, once per run
+        """
+        self._queue.put(("payload", run_id, payload))
+
+    def flush(self):
+        """
+        Block until everything queued so far is on disk
+        """
+        self._queue.join()
+
+    def _writer(self):
+        while True:
+            item = self._queue.get()
+            try:
+                os.makedirs(self.folder, exist_ok=True)
+                if item[0] == "record":
+                    line = json.dumps(item[1], separators=(',', ':'), default=str) + '\n'
+                    self._rotate()
+                    # a single write of one short line in append mode is not interleaved with other writers
+                    with open(self.journal_path, 'a') as f:
+                        f.write(line)
+                else:
+                    _, run_id, payload = item
+                    path = payload_path(run_id, self.folder)
+                    tmp_path = f'{path}.{os.getpid()}.tmp'
+                    with gzip.open(tmp_path, 'wt', compresslevel=6) as f:
+                        json.dump(payload, f, separators=(',', ':'))
+                    os.replace(tmp_path, path)
+            except Exception:
+                logger.exception("Run journal write failed")
+            finally:
+                self._queue.task_done()
+
+    def _rotate(self):
+        try:
+            size = os.path.getsize(self.journal_path)
+        except OSError:
+            return
+        if size < self.max_bytes:
+            return
+        rotated_path = os.path.join(self.folder, ROTATED_JOURNAL_FILE)
+        # the runs only found in the rotated file are dropped from the journal with it, and so are their payloads
+        dropped = _run_ids(rotated_path) - _run_ids(self.journal_path)
+        os.replace(self.journal_path, rotated_path)
+        for run_id in dropped:
+            path = payload_path(run_id, self.folder)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _run_ids(path: str) -> set:
+    if not os.path.exists(path):
+        return set()
+    with open(path, 'r') as f:
+        return {json.loads(line).get('run_id') for line in f if line.strip()}
+
+
+def tail_lines(path: str, n_lines: int, block_size: int = TAIL_BLOCK_SIZE) -> tuple[list[bytes], bool]:
+    """_summary_
+    The last lines of a file, read backwards block by block from its end
+    Args:
+        path (str): _description_
+        n_lines (int): number of complete lines wanted
+        block_size (int, optional): bytes read at a time. Defaults to TAIL_BLOCK_SIZE.
+
+    Returns:
+        tuple[list[bytes], bool]: the lines, oldest first, and whether they are every line of the file
+    """
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        data = b''
+        # one line more than wanted, the first line of a block may be cut
+        while end > 0 and data.count(b'\n') <= n_lines:
+            start = max(0, end - block_size)
+            f.seek(start)
+            data = f.read(end - start) + data
+            end = start
+    lines = data.splitlines()
+    if end > 0:
+        lines = lines[1:]
+    whole_file = end == 0 and len(lines) <= n_lines
+    return [line for line in lines[-n_lines:] if line.strip()], whole_file
+
+
+def read_history(folder: str = JOURNAL_FOLDER, limit: int | None = None) -> pd.DataFrame:
+    """_summary_
+    The latest state of every run in the journal, most recent first
+    Args:
+        folder (str, optional): _description_. Defaults to JOURNAL_FOLDER.
+        limit (int | None, optional): number of runs returned. Defaults to None.
+
+    Returns:
+        pd.DataFrame: one row per run
+    """
+    # oldest file first
+    paths = [path for path in (os.path.join(folder, ROTATED_JOURNAL_FILE), os.path.join(folder, JOURNAL_FILE))
+             if os.path.exists(path)]
+    if not paths:
+        return pd.DataFrame()
+    records = []
+    if limit:
+        # scan more lines until enough runs are found, into the rotated file when the journal is exhausted
+        for path in reversed(paths):
+            n_lines = limit * RECORDS_PER_RUN
+            while True:
+                lines, whole_file = tail_lines(path, n_lines)
+                found = [json.loads(line) for line in lines] + records
+                enough = len({record.get('run_id') for record in found}) >= limit
+                if whole_file or enough:
+                    break
+                n_lines *= 4
+            records = found
+            if enough:
+                break
+    else:
+        for path in paths:
+            with open(path, 'r') as f:
+                records += [json.loads(line) for line in f if line.strip()]
+    records = pd.DataFrame.from_records(records)
+    if records.empty:
+        return records
+    # records written within the same millisecond keep their journal order
+    records['line'] = range(len(records))
+    history = records.sort_values(['ts', 'line']).drop_duplicates('run_id', keep='last')
+    history = history.sort_values(['ts', 'line'], ascending=False).drop(columns='line').reset_index(drop=True)
+    history['ts'] = pd.to_datetime(history['ts'], unit='s')
+    history['payload'] = [os.path.exists(payload_path(run_id, folder)) for run_id in history['run_id']]
+    return history.head(limit) if limit else history
+
+
+def read_payload(run_id: int, folder: str = JOURNAL_FOLDER) -> dict | None:
+    """
+    The final response of a run, or None if it was not saved
+    """
+    path = payload_path(run_id, folder)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, 'rt') as f:
+        return json.load(f)
+
+
+@st.cache_resource()
+def get_run_journal() -> RunJournal:
+    """
+    One journal writer per streamlit process
+    """
+    return RunJournal()
@@ -0,0 +1,298 @@
+"""_summary_
+
+Background poller for Databricks one time runs.
+A single worker thread tracks any number of run ids, polls the lightweight run state call
+with an adaptive backoff, and fetches the heavy notebook output only once when a run terminates.
+Pages submit runs and read their status on every rerun, so the script thread is never blocked.
+The completion callbacks (decoding the output, caching it, resubmitting retries) run on a small executor,
+so a slow or failing callback never stalls the polling of the other runs. A run is only `done` once its callbacks
+have returned.
+State changes and the final responses are written to the run journal. Finished runs, with their output and result,
+are dropped once the caller has collected them (forget) or AZ_RUN_FINISHED_TTL seconds after they finished.
+
+"""
+import logging
+import os
+import threading
+import time as t
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+import streamlit as st
+from databricks_api import DatabricksAPI
+import utils.databricks as dbutils
+import utils.run_journal as run_journal
+
+TERMINAL_STATES = {"TERMINATED", "SKIPPED", "INTERNAL_ERROR"}
+MIN_POLL_INTERVAL = 2.0     # seconds between the first polls of a run
+MAX_POLL_INTERVAL = 30.0    # polls of long runs back off up to this interval
+BACKOFF_FACTOR = 1.5
+RUN_TIMEOUT = 3600          # a run that has not terminated after this many seconds is given up on
+MAX_POLL_ERRORS = 5         # consecutive failed polls before a run is marked as failed
+CALLBACK_WORKERS = int(os.environ.get('AZ_RUN_CALLBACK_WORKERS', 4))
+FINISHED_RUN_TTL = float(os.environ.get('AZ_RUN_FINISHED_TTL', 1800))     # seconds a finished run stays tracked
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TrackedRun:
+    run_id: int
+    name: str = ""
+    life_cycle_state: str = "PENDING"
+    result_state: str | None = None
+    state_message: str = ""
+    submitted_at: float = field(default_factory=t.time)
+    finished_at: float | None = None
+    output: dict | None = None
+    result: Any = None          # set by a completion callback, e.g. the decoded output
+    error: str | None = None
+    poll_count: int = 0
+    poll_errors: int = 0
+    interval: float = MIN_POLL_INTERVAL
+    next_poll: float = 0.0
+    callbacks: list = field(default_factory=list, repr=False)
+    done_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def done(self) -> bool:
+        return self.done_event.is_set()
+
+    @property
+    def succeeded(self) -> bool:
+        return self.done and self.result_state == "SUCCESS" and self.output is not None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished_at or t.time()) - self.submitted_at
+
+    def summary(self) -> dict:
+        return {"run_id": self.run_id, "name": self.name, "life_cycle_state": self.life_cycle_state,
+                "result_state": self.result_state, "state_message": self.state_message,
+                "elapsed_s": round(self.elapsed, 1), "polls": self.poll_count, "error": self.error}
+
+
+class RunPoller:
+    """_summary_
+    Tracks Databricks runs from a background worker thread
+    Args:
+        db_connection (DatabricksAPI): connection used for the state and output calls
+        min_interval (float, optional): first poll interval in seconds. Defaults to MIN_POLL_INTERVAL.
+        max_interval (float, optional): largest poll interval in seconds. Defaults to MAX_POLL_INTERVAL.
+        timeout (float, optional): seconds after which a run is given up on. Defaults to RUN_TIMEOUT.
+        journal (RunJournal | None, optional): journal the run states and responses are written to. Defaults to None.
+        callback_workers (int, optional): threads running the completion callbacks. Defaults to CALLBACK_WORKERS.
+        finished_ttl (float, optional): seconds a finished run is kept for its caller. Defaults to FINISHED_RUN_TTL.
+    """
+
+    def __init__(self, db_connection: DatabricksAPI, min_interval: float = MIN_POLL_INTERVAL,
+                 max_interval: float = MAX_POLL_INTERVAL, timeout: float = RUN_TIMEOUT,
+                 journal: run_journal.RunJournal | None = None, callback_workers: int = CALLBACK_WORKERS,
+                 finished_ttl: float = FINISHED_RUN_TTL):
+        self.db_connection = db_connection
+        self.journal = journal
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.timeout = timeout
+        self.finished_ttl = finished_ttl
+        self._runs: dict[int, TrackedRun] = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._stopped = False
+        self._callbacks = ThreadPoolExecutor(max_workers=max(1, callback_workers),
+                                             thread_name_prefix="databricks-run-callback")
+        self._thread = threading.Thread(target=self._loop, name="databricks-run-poller", daemon=True)
+        self._thread.start()
+
+    def track(self, run_id: int, name: str = "", on_done: Callable[[TrackedRun], Any] | None = None) -> TrackedRun:
+        """
+        Start tracking an already submitted run, tracking the same run twice returns the existing entry
+        """
+        with self._lock:
+            run = self._runs.get(run_id)
+            if run is None:
+                run = TrackedRun(run_id=run_id, name=name, interval=self.min_interval, next_poll=t.time())
+                self._runs[run_id] = run
+                self._journal(run)
+            if on_done is not None:
+                run.callbacks.append(on_done)
+            self._wakeup.notify()
+        return run
+
+    def submit(self, run_name: str, cluster_id: str, workspace_path: str, notebook_params: dict | None = None,
+               timeout_seconds: int = 3600, on_done: Callable[[TrackedRun], Any] | None = None) -> TrackedRun:
+        """
+        Submit a one time notebook run and track it, returns immediately
+        """
+        run_id = dbutils.get_one_time_run(db_connection=self.db_connection, cluster_id=cluster_id,
+                                          run_name=run_name, timeout_seconds=timeout_seconds,
+                                          workspace_path=workspace_path, notebook_params=notebook_params,
+                                          git=False)['run_id']
+        return self.track(run_id, name=run_name, on_done=on_done)
+
+    def status(self, run_id: int) -> TrackedRun | None:
+        with self._lock:
+            return self._runs.get(run_id)
+
+    def runs(self) -> list[TrackedRun]:
+        with self._lock:
+            return list(self._runs.values())
+
+    def wait(self, run_id: int, timeout: float | None = None) -> TrackedRun:
+        """
+        Block until a tracked run is done, only meant for scripts and callers that need the result synchronously
+        """
+        run = self.status(run_id)
+        if run is None:
+            raise KeyError(f"Run {run_id} is not tracked")
+        if not run.done_event.wait(timeout):
+            raise TimeoutError(f"Run {run_id} did not finish within {timeout} seconds")
+        return run
+
+    def forget(self, run_id: int):
+        """
+        Stop tracking a run once its caller has collected the result, the run is no longer returned by status
+        """
+        with self._lock:
+            self._runs.pop(run_id, None)
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+            self._wakeup.notify()
+        self._callbacks.shutdown(wait=False)
+
+    def _loop(self):
+        while True:
+            with self._lock:
+                if self._stopped:
+                    return
+                now = t.time()
+                self._expire_finished(now)
+                # runs whose callbacks are still running are finished and not polled again
+                pending = [run for run in self._runs.values() if run.finished_at is None]
+                due = [run for run in pending if run.next_poll <= now]
+                if not due:
+                    # sleep until the next run is due, a newly tracked run wakes the thread up
+                    next_poll = min((run.next_poll for run in pending), default=now + self.max_interval)
+                    self._wakeup.wait(timeout=max(next_poll - now, 0.05))
+                    continue
+            for run in due:
+                try:
+                    self._poll(run)
+                except Exception:
+                    # the poller thread is shared by every session, it must outlive any failure
+                    logger.exception("Polling run %s failed", run.run_id)
+                    with self._lock:
+                        run.error = "Polling failed, see the logs"
+                    self._finish(run, result_state="FAILED")
+
+    def _poll(self, run: TrackedRun):
+        # the Databricks calls are made without the lock, the run is updated under it as pages read it concurrently
+        try:
+            state = dbutils.get_run_state(self.db_connection, run.run_id)
+        except Exception as e:
+            with self._lock:
+                run.poll_errors += 1
+                run.error = f"Polling failed: {e}"
+                failed = run.poll_errors >= MAX_POLL_ERRORS
+                if not failed:
+                    self._schedule(run)
+            if failed:
+                self._finish(run, result_state="FAILED")
+            return
+
+        with self._lock:
+            run.poll_count += 1
+            run.poll_errors = 0
+            previous_state = run.life_cycle_state
+            run.life_cycle_state = state.get("life_cycle_state", run.life_cycle_state)
+            run.result_state = state.get("result_state")
+            run.state_message = state.get("state_message", "")
+
+        if run.life_cycle_state in TERMINAL_STATES:
+            output, error = None, None
+            if run.result_state == "SUCCESS":
+                try:
+                    # the heavy output is only fetched once the run has terminated
+                    output = dbutils.get_job_output(db_connection=self.db_connection, run_id=run.run_id)
+                except Exception as e:
+                    error = f"Fetching the output failed: {e}"
+            else:
+                error = run.state_message or f"Run ended with {run.result_state}"
+            with self._lock:
+                run.output = output
+                run.error = error
+            self._finish(run, result_state=run.result_state)
+            return
+
+        if t.time() - run.submitted_at > self.timeout:
+            with self._lock:
+                run.error = f"Run did not finish within {self.timeout} seconds"
+            self._finish(run, result_state="TIMEDOUT")
+            return
+
+        with self._lock:
+            changed = run.life_cycle_state != previous_state
+            if changed:
+                # poll quickly again after a state change, back off while the state stays the same
+                run.interval = self.min_interval
+            self._schedule(run)
+        if changed:
+            self._journal(run)
+
+    def _journal(self, run: TrackedRun):
+        if self.journal is not None:
+            self.journal.record(run.summary())
+
+    def _expire_finished(self, now: float):
+        # called with the lock held, runs whose callbacks are still running are kept
+        expired = [run_id for run_id, run in self._runs.items()
+                   if run.done and run.finished_at is not None and now - run.finished_at > self.finished_ttl]
+        for run_id in expired:
+            del self._runs[run_id]
+
+    def _schedule(self, run: TrackedRun):
+        # called with the lock held
+        run.next_poll = t.time() + run.interval
+        run.interval = min(run.interval * BACKOFF_FACTOR, self.max_interval)
+
+    def _finish(self, run: TrackedRun, result_state: str | None):
+        with self._lock:
+            run.result_state = result_state
+            run.finished_at = t.time()
+        try:
+            self._journal(run)
+            if self.journal is not None and run.output is not None:
+                self.journal.save_payload(run.run_id, run.output)
+        except Exception:
+            logger.exception("Journaling run %s failed", run.run_id)
+        if not run.callbacks:
+            run.done_event.set()
+            return
+        try:
+            self._callbacks.submit(self._complete, run)
+        except RuntimeError:
+            # the poller was stopped, the callbacks are run in this thread
+            self._complete(run)
+
+    def _complete(self, run: TrackedRun):
+        # called on the callback executor, the run is done once every callback has returned
+        try:
+            for callback in list(run.callbacks):
+                try:
+                    callback(run)
+                except Exception as e:
+                    logger.exception("Callback of run %s failed", run.run_id)
+                    run.error = f"Callback failed: {e}"
+        finally:
+            run.done_event.set()
+
+
+@st.cache_resource()
+def get_run_poller(_db_connection: DatabricksAPI) -> RunPoller:
+    """
+    One poller per streamlit process, shared by every session and page
+    """
+    return RunPoller(_db_connection, journal=run_journal.get_run_journal())
@@ -0,0 +1,407 @@
+"""_summary_
+
+Local Mapbox Vector Tile service for the cached map layers.
+Layers (as produced via data_processor.df_to_gdf / layer_cache.load_layer) are registered in memory per session,
+projected once to web mercator and indexed with an STRtree. Tiles are cut on demand for
+/tiles/<session>/<layer>/<z>/<x>/<y>.pbf, clipped and simplified to the tile resolution, encoded as MVT
+and kept in an LRU tile cache. The server runs in a daemon thread next to the Streamlit app and binds to localhost
+(TILE_SERVER_HOST), on a port picked by the OS unless TILE_SERVER_PORT is set, so several apps on one host do not collide.
+The tiles are fetched by the browser, so the localhost urls only work when it runs on the server host. A deployed app
+sets TILE_SERVER_PUBLIC_URL to the base url a reverse proxy forwards to the tile server (with a fixed TILE_SERVER_PORT),
+e.g. https://gis.example.com/tile-service, and the tile urls are built on it.
+The layers of a session are dropped once it has not registered a layer for SESSION_TTL seconds.
+
+The MVT protobuf is written directly (see https://github.com/mapbox/vector-tile-spec/tree/master/2.1)
+so the service does not need an extra encoding library.
+
+"""
+import os
+import re
+import math
+import hashlib
+import struct
+import threading
+import time as t
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from numbers import Integral, Real
+
+import numpy as np
+import shapely
+from geopandas import GeoDataFrame
+from shapely import STRtree
+import utils.projection as projection
+from utils.layer_store import SESSION_TTL, current_session_id
+
+TILE_SERVER_HOST = os.environ.get('TILE_SERVER_HOST', '127.0.0.1')
+TILE_SERVER_PORT = int(os.environ.get('TILE_SERVER_PORT', 0))      # 0 lets the OS pick a free port
+TILE_SERVER_PUBLIC_URL = os.environ.get('TILE_SERVER_PUBLIC_URL', '')  # base url of the tiles seen from the browser
+TILE_EXTENT = 4096
+TILE_BUFFER = 64            # tile units added on every side before clipping
+TILE_CACHE_SIZE = 2048      # number of encoded tiles kept in memory
+WEB_MERCATOR_HALF = 20037508.342789244
+
+TILE_PATH = re.compile(r'^/tiles/(?P<session>[0-9a-f]+)/(?P<layer>[\w-]+)/(?P<z>\d+)/(?P<x>\d+)/(?P<y>\d+)\.(pbf|mvt)$')
+
+_layers: dict = {}          # (session key, layer name) -> layer
+_sessions_seen: dict[str, float] = {}
+_layers_lock = threading.Lock()
+_tile_cache: OrderedDict = OrderedDict()
+_tile_cache_lock = threading.Lock()
+_server = None
+
+
+# ---------------------------------------------------------------------
+# protobuf / MVT encoding
+
+def _varint(value: int) -> bytes:
+    out = bytearray()
+    while True:
+        byte = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return bytes(out)
+
+
+def _field_key(field: int, wire_type: int) -> bytes:
+    return _varint((field << 3) | wire_type)
+
+
+def _len_field(field: int, payload: bytes) -> bytes:
+    return _field_key(field, 2) + _varint(len(payload)) + payload
+
+
+def _varints(values) -> bytes:
+    """
+    Varint encoding of an array of non-negative integers in one vectorized pass
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    if not len(values):
+        return b''
+    shifts = np.arange(10, dtype=np.uint64) * np.uint64(7)
+    groups = ((values[:, None] >> shifts) & np.uint64(0x7F)).astype(np.uint8)
+    n_bytes = 1 + (values[:, None] >= (np.uint64(1) << shifts[1:])).sum(axis=1)
+    positions = np.arange(10)
+    # the continuation bit is set on every byte of a value but its last
+    groups[positions < (n_bytes - 1)[:, None]] |= 0x80
+    return groups[positions < n_bytes[:, None]].tobytes()
+
+
+def _packed_field(field: int, values) -> bytes:
+    return _len_field(field, _varints(values))
+
+
+def _zigzag(value: int) -> int:
+    return (value << 1) ^ (value >> 63)
+
+
+def _zigzag_array(values: np.ndarray) -> np.ndarray:
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _command(command_id: int, count: int) -> int:
+    return (command_id & 0x7) | (count << 3)
+
+
+def _encode_value(value) -> bytes | None:
+    # Value message: string = 1, double = 3, sint = 6, bool = 7
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    if isinstance(value, (bool, np.bool_)):
+        return _field_key(7, 0) + _varint(int(value))
+    if isinstance(value, Integral):
+        return _field_key(6, 0) + _varint(_zigzag(int(value)))
+    if isinstance(value, Real):
+        return _field_key(3, 1) + struct.pack('<d', float(value))
+    return _len_field(1, str(value).encode('utf-8'))
+
+
+def _dedupe(coords: np.ndarray) -> np.ndarray:
+    # drop consecutive points that quantized to the same tile coordinate
+    if len(coords) < 2:
+        return coords
+    keep = np.ones(len(coords), dtype=bool)
+    keep[1:] = np.any(coords[1:] != coords[:-1], axis=1)
+    return coords[keep]
+
+
+def _ring_area(coords: np.ndarray) -> float:
+    """
+    Signed area of a ring in tile coordinates (y down), positive for the exterior rings of the MVT spec
+    """
+    x, y = coords[:, 0].astype(np.float64), coords[:, 1].astype(np.float64)
+    return 0.5 * float(np.sum(x * np.roll(y, -1) - np.roll(x, -1) * y))
+
+
+def _part_commands(coords: np.ndarray, cursor: np.ndarray, close: bool = False) -> list[np.ndarray]:
+    """
+    MoveTo the first point, LineTo the others and optionally ClosePath, the deltas are taken from the cursor
+    """
+    deltas = _zigzag_array(np.diff(coords, axis=0, prepend=cursor[None, :])).ravel()
+    commands = [np.array([_command(1, 1), deltas[0], deltas[1], _command(2, len(coords) - 1)], dtype=np.uint64),
+                deltas[2:]]
+    if close:
+        commands.append(np.array([_command(7, 1)], dtype=np.uint64))
+    cursor[:] = coords[-1]
+    return commands
+
+
+def _encode_geometry(geom, to_tile) -> tuple[int, np.ndarray] | None:
+    """
+    Returns the MVT geometry type and command stream of a clipped geometry, or None if nothing is left at tile resolution
+    """
+    commands = []
+    cursor = np.zeros(2, dtype=np.int64)
+
+    type_id = shapely.get_type_id(geom)
+    if type_id in (0, 4):
+        coords = _dedupe(to_tile(shapely.get_coordinates(geom)))
+        if not len(coords):
+            return None
+        deltas = _zigzag_array(np.diff(coords, axis=0, prepend=cursor[None, :])).ravel()
+        return 1, np.concatenate([np.array([_command(1, len(coords))], dtype=np.uint64), deltas])
+
+    if type_id in (1, 5):
+        for part in shapely.get_parts(geom):
+            coords = _dedupe(to_tile(shapely.get_coordinates(part)))
+            if len(coords) >= 2:
+                commands += _part_commands(coords, cursor)
+        return (2, np.concatenate(commands)) if commands else None
+
+    if type_id in (3, 6):
+        for part in shapely.get_parts(geom):
+            # the winding is fixed in tile space, after the y axis flip and the quantization:
+            # exterior rings have a positive area and interior rings a negative one (MVT 2.1, 4.3.4.3)
+            for ring_index, ring in enumerate([part.exterior, *part.interiors]):
+                coords = _dedupe(to_tile(shapely.get_coordinates(ring)[:-1]))
+                area = _ring_area(coords) if len(coords) >= 3 else 0.0
+                if area == 0:
+                    if ring_index == 0:
+                        break
+                    continue
+                if (area < 0) == (ring_index == 0):
+                    coords = coords[::-1]
+                commands += _part_commands(coords, cursor, close=True)
+        return (3, np.concatenate(commands)) if commands else None
+    return None
+
+
+def encode_layer(name: str, features: list[tuple[int, dict, int, np.ndarray]]) -> bytes:
+    """_summary_
+    Encode one MVT layer
+    Args:
+        name (str): layer name
+        features (list[tuple[int, dict, int, np.ndarray]]): (id, properties, geometry type, geometry commands) per feature
+
+    Returns:
+        bytes: the encoded Layer message
+    """
+    keys, values = {}, {}
+    encoded_features = []
+    for feature_id, properties, geom_type, commands in features:
+        tags = []
+        for key, value in properties.items():
+            encoded_value = _encode_value(value)
+            if encoded_value is None:
+                continue
+            tags.append(keys.setdefault(key, len(keys)))
+            tags.append(values.setdefault(encoded_value, len(values)))
+        feature = _field_key(1, 0) + _varint(feature_id)
+        if tags:
+            feature += _packed_field(2, tags)
+        feature += _field_key(3, 0) + _varint(geom_type) + _packed_field(4, commands)
+        encoded_features.append(_len_field(2, feature))
+
+    layer = _field_key(15, 0) + _varint(2) + _len_field(1, name.encode('utf-8'))
+    layer += b''.join(encoded_features)
+    layer += b''.join(_len_field(3, key.encode('utf-8')) for key in keys)
+    layer += b''.join(_len_field(4, value) for value in values)
+    layer += _field_key(5, 0) + _varint(TILE_EXTENT)
+    return layer
+
+
+# ---------------------------------------------------------------------
+# layers and tiles
+
+def tile_bounds(z: int, x: int, y: int) -> tuple[float, float, float, float]:
+    """
+    Web mercator bounds (min x, min y, max x, max y) of an XYZ tile
+    """
+    size = 2 * WEB_MERCATOR_HALF / (2 ** z)
+    min_x = -WEB_MERCATOR_HALF + x * size
+    max_y = WEB_MERCATOR_HALF - y * size
+    return (min_x, max_y - size, min_x + size, max_y)
+
+
+def session_key(session_id: str | None = None) -> str:
+    """
+    Key of the layers of a session in the tile urls, the session id itself is not written into the page
+    """
+    return hashlib.sha256((session_id or current_session_id()).encode()).hexdigest()[:16]
+
+
+def _expire_sessions(now: float):
+    expired = [key for key, seen in _sessions_seen.items() if now - seen > SESSION_TTL]
+    for key in expired:
+        del _sessions_seen[key]
+        for layer_key in [k for k in _layers if k[0] == key]:
+            del _layers[layer_key]
+    if expired:
+        with _tile_cache_lock:
+            for cache_key in [k for k in _tile_cache if k[0] in expired]:
+                del _tile_cache[cache_key]
+
+
+def register_layer(name: str, gdf: GeoDataFrame, properties: list[str] | None = None, session_id: str | None = None):
+    """_summary_
+    Make a layer available to the tile service for one session, re-registering the same layer version is a no-op
+    and a new version drops the cached tiles of the layer
+    Args:
+        name (str): name used in the tile url and as the MVT layer name
+        gdf (GeoDataFrame): layer with its crs set
+        properties (list[str] | None, optional): columns written as feature properties. Defaults to None.
+        session_id (str | None, optional): _description_. Defaults to the current session.
+    """
+    version = gdf.attrs.get('layer_version')
+    key = session_key(session_id)
+    with _layers_lock:
+        now = t.time()
+        _expire_sessions(now)
+        _sessions_seen[key] = now
+        current = _layers.get((key, name))
+        if current is not None and version is not None and current['version'] == version:
+            return
+
+    mercator = projection.project_layer(gdf, "EPSG:3857")
+    geometries = np.asarray(mercator.geometry.values)
+    columns = [c for c in (properties or []) if c in mercator.columns]
+    layer = {"version": version,
+             "geometries": geometries,
+             "tree": STRtree(geometries),
+             "properties": {c: mercator[c].astype(object).where(mercator[c].notna(), None).to_numpy() for c in columns}}
+    with _layers_lock:
+        _layers[(key, name)] = layer
+    with _tile_cache_lock:
+        for cache_key in [k for k in _tile_cache if k[:2] == (key, name)]:
+            del _tile_cache[cache_key]
+
+
+def registered_layers(session_id: str | None = None) -> list[str]:
+    key = session_key(session_id)
+    with _layers_lock:
+        return [name for layer_key, name in _layers if layer_key == key]
+
+
+def render_tile(session: str, name: str, z: int, x: int, y: int) -> bytes | None:
+    """_summary_
+    Returns the encoded MVT tile of a layer, served from the LRU tile cache when possible
+    Args:
+        session (str): session key of the layer, see session_key
+        name (str): registered layer name
+        z (int): zoom
+        x (int): tile column
+        y (int): tile row
+
+    Returns:
+        bytes | None: the tile, empty if there are no features in it, or None for an unknown layer
+    """
+    with _layers_lock:
+        layer = _layers.get((session, name))
+    if layer is None:
+        return None
+    key = (session, name, layer['version'], z, x, y)
+    with _tile_cache_lock:
+        if key in _tile_cache:
+            _tile_cache.move_to_end(key)
+            return _tile_cache[key]
+
+    min_x, min_y, max_x, max_y = tile_bounds(z, x, y)
+    units = (max_x - min_x) / TILE_EXTENT
+    buffer = TILE_BUFFER * units
+    clip_box = (min_x - buffer, min_y - buffer, max_x + buffer, max_y + buffer)
+
+    positions = np.sort(layer['tree'].query(shapely.box(*clip_box)))
+    clipped = shapely.clip_by_rect(layer['geometries'][positions], *clip_box)
+    # anything smaller than one tile unit is lost when the coordinates are quantized
+    simplified = shapely.simplify(clipped, units)
+
+    def to_tile(coords: np.ndarray) -> np.ndarray:
+        tile_x = np.round((coords[:, 0] - min_x) / units)
+        tile_y = np.round((max_y - coords[:, 1]) / units)
+        return np.column_stack([tile_x, tile_y]).astype('int64')
+
+    features = []
+    for position, geom in zip(positions, simplified):
+        if geom is None or shapely.is_empty(geom):
+            continue
+        encoded = _encode_geometry(geom, to_tile)
+        if encoded is None:
+            continue
+        properties = {c: values[position] for c, values in layer['properties'].items()}
+        features.append((int(position), properties, *encoded))
+
+    tile = _len_field(3, encode_layer(name, features)) if features else b''
+    with _tile_cache_lock:
+        _tile_cache[key] = tile
+        while len(_tile_cache) > TILE_CACHE_SIZE:
+            _tile_cache.popitem(last=False)
+    return tile
+
+
+# ---------------------------------------------------------------------
+# http service
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        match = TILE_PATH.match(self.path.split('?')[0])
+        if match is None:
+            self.send_error(404, "Expected /tiles/<session>/<layer>/<z>/<x>/<y>.pbf")
+            return
+        tile = render_tile(match['session'], match['layer'], int(match['z']), int(match['x']), int(match['y']))
+        if tile is None:
+            self.send_error(404, f"Unknown layer {match['layer']}")
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-protobuf')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', str(len(tile)))
+        self.end_headers()
+        self.wfile.write(tile)
+
+    def log_message(self, format, *args):
+        # keep the streamlit console clean
+        pass
+
+
+def start_tile_server(host: str = TILE_SERVER_HOST, port: int = TILE_SERVER_PORT) -> ThreadingHTTPServer:
+    """
+    Start the tile service in a daemon thread, only one server is started per process
+    """
+    global _server
+    with _layers_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), TileRequestHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name='mvt-tile-server', daemon=True).start()
+    return _server
+
+
+def tile_url(name: str, session_id: str | None = None) -> str:
+    """
+    Tile url template of a layer of the session, on TILE_SERVER_PUBLIC_URL when it is set, otherwise on the address
+    the running tile server is bound to
+    """
+    if _server is None:
+        raise RuntimeError("The tile server is not started, call start_tile_server first")
+    if TILE_SERVER_PUBLIC_URL:
+        base_url = TILE_SERVER_PUBLIC_URL.rstrip('/')
+    else:
+        host, port = _server.server_address[:2]
+        base_url = f'http://{host}:{port}'
+    return f'{base_url}/tiles/{session_key(session_id)}/{name}/{{z}}/{{x}}/{{y}}.pbf'
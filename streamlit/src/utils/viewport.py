@@ -0,0 +1,163 @@
+"""_summary_
+
+Viewport culling for the map layers.
+A shapely STRtree is built once per layer version, the bounds returned by st_folium are then used
+to select only the features that intersect the visible box (plus a margin) before they are serialised into the map.
+
+"""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import streamlit as st
+from geopandas import GeoDataFrame
+from shapely import STRtree, box
+
+MAX_CACHED_TREES = 16
+VIEWPORT_MARGIN = 0.25      # fraction of the viewport width/height added on every side
+
+_layer_trees: OrderedDict = OrderedDict()
+_trees_lock = threading.Lock()
+
+
+def get_layer_index(gdf: GeoDataFrame) -> STRtree:
+    """
+    Returns the STRtree of a layer, cached by gdf.attrs['layer_version'] when the layer has one
+    """
+    version = gdf.attrs.get('layer_version')
+    if version is None:
+        return STRtree(gdf.geometry.values)
+
+    key = (version, len(gdf))
+    with _trees_lock:
+        if key in _layer_trees:
+            _layer_trees.move_to_end(key)
+            return _layer_trees[key]
+
+    tree = STRtree(gdf.geometry.values)
+    with _trees_lock:
+        _layer_trees[key] = tree
+        while len(_layer_trees) > MAX_CACHED_TREES:
+            _layer_trees.popitem(last=False)
+    return tree
+
+
+def bounds_from_map_data(st_data: dict | None) -> tuple[float, float, float, float] | None:
+    """_summary_
+    Read the visible bounds of the map from the dictionary returned by st_folium
+    Args:
+        st_data (dict | None): the value returned by st_folium.st_folium
+
+    Returns:
+        tuple[float, float, float, float] | None: (min lon, min lat, max lon, max lat) or None if the map has no bounds yet
+    """
+    if not st_data or not st_data.get('bounds'):
+        return None
+    south_west = st_data['bounds'].get('_southWest') or {}
+    north_east = st_data['bounds'].get('_northEast') or {}
+    if south_west.get('lng') is None or north_east.get('lng') is None:
+        return None
+    return (south_west['lng'], south_west['lat'], north_east['lng'], north_east['lat'])
+
+
+def expand_bounds(bounds: tuple[float, float, float, float], margin: float = VIEWPORT_MARGIN) -> tuple[float, float, float, float]:
+    min_x, min_y, max_x, max_y = bounds
+    pad_x = (max_x - min_x) * margin
+    pad_y = (max_y - min_y) * margin
+    return (min_x - pad_x, min_y - pad_y, max_x + pad_x, max_y + pad_y)
+
+
+def cull_to_viewport(gdf: GeoDataFrame, bounds: tuple[float, float, float, float] | None,
+                     margin: float = VIEWPORT_MARGIN) -> GeoDataFrame:
+    """_summary_
+    Returns the features of the layer that intersect the viewport, the whole layer is returned if there are no bounds yet
+    Args:
+        gdf (GeoDataFrame): layer in the same crs as the bounds (EPSG:4326)
+        bounds (tuple[float, float, float, float] | None): viewport bounds from bounds_from_map_data
+        margin (float, optional): fraction of the viewport added on every side. Defaults to VIEWPORT_MARGIN.
+
+    Returns:
+        GeoDataFrame: the visible features, in their original order
+    """
+    if bounds is None or len(gdf) == 0:
+        return gdf
+    tree = get_layer_index(gdf)
+    positions = tree.query(box(*expand_bounds(bounds, margin)), predicate='intersects')
+    culled = gdf.iloc[np.sort(positions)]
+    # the subset changes with every view, it must not share the caches of the full layer
+    culled.attrs.pop('layer_version', None)
+    return culled
+
+
+def viewport_controls() -> bool:
+    """
+    Sidebar switch for viewport mode, only the features on screen are sent to the map when it is enabled
+    """
+    return st.sidebar.checkbox("Viewport culling", value=False,
+                               help="Only send the features inside the visible map area, the map is refreshed after panning or zooming")
+
+
+def map_view(default_center: list[float], default_zoom: int, enabled: bool,
+             zoom_only: bool = False) -> tuple[list[float], int, list[str]]:
+    """_summary_
+    Returns the center, zoom and returned_objects to pass to st_folium.
+    In viewport mode the last view of the user is kept so the map does not jump back after a rerun
+    Args:
+        default_center (list[float]): [lat, lon] used before the user has moved the map
+        default_zoom (int): zoom used before the user has moved the map
+        enabled (bool): viewport mode switch
+        zoom_only (bool, optional): only track the zoom, panning the map does not rerun the page. Defaults to False.
+
+    Returns:
+        tuple[list[float], int, list[str]]: center, zoom and returned objects for st_folium
+    """
+    if not enabled:
+        return default_center, default_zoom, []
+    zoom = st.session_state.get('viewport_zoom') or default_zoom
+    if zoom_only:
+        return default_center, zoom, ['zoom']
+    center = st.session_state.get('viewport_center') or default_center
+    return center, zoom, ['bounds', 'zoom', 'center']
+
+
+def update_viewport(st_data: dict | None, rerun_on_pan: bool = True, zoom_only: bool = False) -> bool:
+    """_summary_
+    Store the bounds, center and zoom returned by st_folium in the session state.
+    Returns True when the view changed and the page should rerun to re-cull the layers,
+    at most once per map interaction so a rerun cannot trigger another one.
+    Args:
+        st_data (dict | None): the value returned by st_folium.st_folium
+        rerun_on_pan (bool, optional): rerun when the bounds change, otherwise only when the zoom changes. Defaults to True.
+        zoom_only (bool, optional): the map only returns its zoom, see map_view. Defaults to False.
+
+    Returns:
+        bool: whether the page should rerun
+    """
+    previous_zoom = st.session_state.get('viewport_zoom')
+    if zoom_only:
+        if not st_data or st_data.get('zoom') is None:
+            return False
+        st.session_state['viewport_zoom'] = st_data['zoom']
+        unchanged = previous_zoom == st_data['zoom']
+    else:
+        bounds = bounds_from_map_data(st_data)
+        if bounds is None:
+            return False
+        if st_data.get('zoom') is not None:
+            st.session_state['viewport_zoom'] = st_data['zoom']
+        if st_data.get('center'):
+            st.session_state['viewport_center'] = [st_data['center']['lat'], st_data['center']['lng']]
+
+        previous = st.session_state.get('viewport_bounds')
+        st.session_state['viewport_bounds'] = bounds
+        unchanged = previous is not None and np.allclose(previous, bounds)
+        if not rerun_on_pan:
+            unchanged = previous_zoom == st.session_state.get('viewport_zoom')
+    if unchanged:
+        st.session_state['viewport_rerun'] = False
+        return False
+    if st.session_state.get('viewport_rerun'):
+        st.session_state['viewport_rerun'] = False
+        return False
+    st.session_state['viewport_rerun'] = True
+    return True